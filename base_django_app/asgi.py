@@ -5,12 +5,41 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
+
+Serving profile
+---------------
+ASGI only pays off when a request never leaves the event loop for nothing:
+
+* Run it with uvicorn workers, one per core, e.g.
+  ``gunicorn base_django_app.asgi:application -k uvicorn.workers.UvicornWorker``.
+* The project's middleware (``common.middleware.BaseMiddleware`` subclasses,
+  e.g. ``ThrottleMiddleware``) runs natively async. Django's own
+  ``MiddlewareMixin`` ones (sessions, auth, messages...) still hop to a thread
+  for their hooks, keep the stack short.
+* Views that hit the database should be ``async def`` and use Django's
+  async queryset methods (``aget``, ``afirst``, ``acount``...), plus
+  ``alist()`` on ``BaseDjangoModel.objects`` to evaluate a queryset at once.
+  Each runs its query in a single ``sync_to_async`` call. Sync views are run
+  in a thread as a whole.
+* Each request's sync code runs in a thread of its own, so persistent
+  connections (``CONN_MAX_AGE``) aren't reused: leave it at 0 and put a
+  pooler such as pgbouncer in front of Postgres.
+* Compare with ``python manage.py benchmark serving`` before switching, WSGI
+  stays faster for mostly sync, database bound endpoints.
+* With ``SERVE_STATIC``, ``common.static.StaticFilesASGI`` answers static
+  requests before Django is involved.
 """
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "base_django_app.settings")
 
 application = get_asgi_application()
+
+if settings.SERVE_STATIC:
+    from common.static import StaticFilesASGI
+
+    application = StaticFilesASGI(application)
@@ -9,10 +9,15 @@
 from decouple import config
 from django.conf import settings
 import logging
+import logging.handlers
 from logging import addLevelName, setLoggerClass, NOTSET
 from pathlib import Path
 
+from common.init_helpers import lazy_class_attribute, termcolor_code
+
 BASE_DIR = settings.BASE_DIR
+# log files are only opened (and their directory created) by their first record
+FAST_STARTUP = getattr(settings, "FAST_STARTUP", False)
 LOG_FILE_NAME: str = str(config("LOG_FILE_NAME", default=f"logs/{BASE_DIR.name}.log"))
 INTERNAL_LOG_FILE_NAME: str = str(config("INTERNAL_LOG_FILE_NAME", default=f"logs/{BASE_DIR.name}_internal.log"))
 LOGGING_NAME = "django"
@@ -23,9 +28,10 @@ LOG_FILE_NAMES = [
     INTERNAL_LOG_FILE_NAME,
 ]
 
-for log_file_name in LOG_FILE_NAMES:
-    log_file_parent: Path = BASE_DIR.joinpath(Path(log_file_name).parent)
-    log_file_parent.mkdir(parents=True, exist_ok=True)
+if not FAST_STARTUP:
+    for log_file_name in LOG_FILE_NAMES:
+        log_file_parent: Path = BASE_DIR.joinpath(Path(log_file_name).parent)
+        log_file_parent.mkdir(parents=True, exist_ok=True)
 
 
 from django.utils.log import CallbackFilter
@@ -96,32 +102,42 @@ class ColorConsole2(ColorConsole):
     bold dark underline blink reverse concealed"""
 
     ENDC = "\033[0m"
-    from termcolor import colored
-
-    HEADER = colored("", color="magenta", on_color=None, attrs=["bold"]).split(ENDC)[0]
-    OKBLUE = colored("", color="blue", on_color=None, attrs=None).split(ENDC)[0]
-    OKCYAN = colored("", color="cyan", on_color=None, attrs=None).split(ENDC)[0]
-    OKGREEN = colored("", color="green", on_color=None, attrs=None).split(ENDC)[0]
-    DEBUG = colored("", color="grey", on_color=None, attrs=None).split(ENDC)[0]
-    WARNING = colored("", color="yellow", on_color=None, attrs=None).split(ENDC)[0]
-    ERROR = colored("", color="red", on_color=None, attrs=None).split(ENDC)[0]
-    EXCEPTION = ERROR
-    CRITICAL = colored("", color="white", on_color="on_red", attrs=None).split(ENDC)[0]
-    BOLD = colored("", color=None, on_color=None, attrs=["bold"]).split(ENDC)[0]
-    UNDERLINE = colored("", color=None, on_color=None, attrs=["underline"]).split(ENDC)[0]
 
-    LOG_COLORS = {
-        "header": [HEADER],
-        "info": [OKGREEN],
-        "debug": [DEBUG],
-        "warning": [WARNING],
-        "debugv": [DEBUG],
-        "error": [ERROR],
-        "exception": [EXCEPTION],
-        "critical": [CRITICAL, BOLD, UNDERLINE],
-        "level 60": [DEBUG],
-        "ending": [ENDC],
-    }
+    # termcolor is imported and the codes computed on first use
+    HEADER = termcolor_code(color="magenta", attrs=["bold"])
+    OKBLUE = termcolor_code(color="blue")
+    OKCYAN = termcolor_code(color="cyan")
+    OKGREEN = termcolor_code(color="green")
+    DEBUG = termcolor_code(color="grey")
+    WARNING = termcolor_code(color="yellow")
+    ERROR = termcolor_code(color="red")
+    EXCEPTION = termcolor_code(color="red")
+    CRITICAL = termcolor_code(color="white", on_color="on_red")
+    BOLD = termcolor_code(attrs=["bold"])
+    UNDERLINE = termcolor_code(attrs=["underline"])
+
+    @lazy_class_attribute
+    def LOG_COLORS(cls):
+        return {
+            "header": [cls.HEADER],
+            "info": [cls.OKGREEN],
+            "debug": [cls.DEBUG],
+            "warning": [cls.WARNING],
+            "debugv": [cls.DEBUG],
+            "error": [cls.ERROR],
+            "exception": [cls.EXCEPTION],
+            "critical": [cls.CRITICAL, cls.BOLD, cls.UNDERLINE],
+            "level 60": [cls.DEBUG],
+            "ending": [cls.ENDC],
+        }
+
+
+class LazyRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Creates the log file's directory when the file is first opened"""
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
 
 
 class CustomFormatter(logging.Formatter):
@@ -189,8 +205,9 @@ LOGGING = {
     "handlers": {
         "file": {
             "level": "INFO",
-            "class": "logging.handlers.RotatingFileHandler",
+            "class": "base_django_app.logging_config.LazyRotatingFileHandler",
             "filename": LOG_FILE_NAME,
+            "delay": FAST_STARTUP,
             "formatter": "custom",
             "filters": ["app_filter"],
             "backupCount": 10,
@@ -203,8 +220,9 @@ LOGGING = {
         },
         "internal_handler": {
             "level": "INFO",
-            "class": "logging.handlers.RotatingFileHandler",
+            "class": "base_django_app.logging_config.LazyRotatingFileHandler",
             "filename": INTERNAL_LOG_FILE_NAME,
+            "delay": FAST_STARTUP,
             "formatter": "custom",
             "filters": ["app_filter"],
             "backupCount": 10,
@@ -10,12 +10,15 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
-from common.init_helpers import is_internal_ip
+from common.init_helpers import is_internal_ip, is_light_command
 from pathlib import Path
+import sys
 from decouple import config
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 PROJECT_NAME = BASE_DIR.name
+# defer log files, and skip the optional apps for FAST_STARTUP_COMMANDS
+FAST_STARTUP = config("FAST_STARTUP", cast=bool, default=False)
 from .logging_config import *  # noqa: F403, F401
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +43,12 @@ API_CACHE_ENABLED = config(
 USE_POSTGRESQL = config("USE_POSTGRES", cast=bool)
 ENABLE_THROTTLING = config("ENABLE_THROTTLING", cast=bool, default=True)
 ENABLE_DJDT = config("ENABLE_DJDT", cast=bool, default=False)
+EXPORT_CHUNK_SIZE = config("EXPORT_CHUNK_SIZE", cast=int, default=2000)
+IMPORT_WORKERS = config("IMPORT_WORKERS", cast=int, default=2)
+JOB_WORKERS = config("JOB_WORKERS", cast=int, default=2)
+JOB_POLL_INTERVAL = config("JOB_POLL_INTERVAL", cast=float, default=2)
+PAGINATOR_ESTIMATE_THRESHOLD = config("PAGINATOR_ESTIMATE_THRESHOLD", cast=int, default=100000)
+PAGINATOR_COUNT_TIMEOUT = config("PAGINATOR_COUNT_TIMEOUT", cast=float, default=0.2)
 
 
 # Application definition
@@ -59,6 +68,7 @@ INIT_INSTALLED_APPS += [
 
 # custom apps
 INIT_INSTALLED_APPS += [
+    "common",
     "custom_auth.apps.CustomAuthConfig",
     "funds.apps.FundsConfig",
 ]
@@ -101,6 +111,29 @@ if ALLOW_CORS:
     ]
 
 
+TESTING = sys.argv[1:2] == ["test"]
+
+# management commands which need none of the OPTIONAL_APPS
+FAST_STARTUP_COMMANDS = config(
+    "FAST_STARTUP_COMMANDS",
+    cast=lambda v: [s.strip() for s in v.split(",")],
+    default="get_db_command,prune_sessions,startup_profile",
+)
+OPTIONAL_APPS = [
+    "django.contrib.admin",
+    "import_export",
+    "rest_framework",
+    "debug_toolbar",
+    "corsheaders",
+]
+if FAST_STARTUP and is_light_command(sys.argv, FAST_STARTUP_COMMANDS):
+    INSTALLED_APPS = [app for app in INIT_INSTALLED_APPS if app not in OPTIONAL_APPS]
+# seconds a cold `manage.py check` may take (median of STARTUP_BUDGET_RUNS), checked by
+# the tests and `manage.py startup_profile --budget`
+STARTUP_BUDGET = config("STARTUP_BUDGET", cast=float, default=5.0)
+STARTUP_BUDGET_RUNS = config("STARTUP_BUDGET_RUNS", cast=int, default=3)
+
+
 MIDDLEWARE = INIT_MIDDLEWARES + [
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -111,6 +144,29 @@ MIDDLEWARE = INIT_MIDDLEWARES + [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# COMPRESSION
+"""
+Gzip of allow-listed content types over COMPRESSION_MIN_SIZE bytes, see
+`common.compression`. First in the list, so every other middleware (and
+the debug toolbar) sees the uncompressed body.
+"""
+ENABLE_COMPRESSION = config("ENABLE_COMPRESSION", cast=bool, default=True)
+COMPRESSION_MIN_SIZE = config("COMPRESSION_MIN_SIZE", cast=int, default=1024)  # bytes
+if ENABLE_COMPRESSION:
+    MIDDLEWARE.insert(0, "common.compression.CompressionMiddleware")
+
+# PROFILING
+"""
+Requests from INTERNAL_IPS with `X-Profile: <PROFILE_TOKEN>` run under
+cProfile, see `common.profiling`. The profiles are saved next to the logs.
+"""
+ENABLE_PROFILING = config("ENABLE_PROFILING", cast=bool, default=True)
+PROFILE_TOKEN = config("PROFILE_TOKEN", default="")
+PROFILE_DIR = BASE_DIR.joinpath(Path(LOG_FILE_NAME).parent, "profiles")
+PROFILE_KEEP = config("PROFILE_KEEP", cast=int, default=100)
+if ENABLE_PROFILING:
+    MIDDLEWARE.insert(0, "common.profiling.ProfilingMiddleware")
+
 
 ROOT_URLCONF = f"{PROJECT_NAME}.urls"
 
@@ -188,16 +244,81 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR.joinpath("static")
+# hashed file names and .gz variants, written by collectstatic, which tests run without
+if not TESTING:
+    STATICFILES_STORAGE = "common.storage.CompressedManifestStaticFilesStorage"
+# serve STATIC_ROOT from wsgi.py/asgi.py, runserver serves the app directories itself in DEBUG
+SERVE_STATIC = config("SERVE_STATIC", cast=bool, default=not DEBUG)
+STATIC_MAX_AGE = config("STATIC_MAX_AGE", cast=int, default=60)  # seconds, for files without a hash in their name
 
 # Media files
 MEDIA_ROOT = BASE_DIR.joinpath("media")
 MEDIA_URL = "/files/"
+# serve MEDIA_ROOT with `common.media.serve_media` (ranges, sendfile), else leave it to the web server
+SERVE_MEDIA = config("SERVE_MEDIA", cast=bool, default=DEBUG)
+MEDIA_UPLOAD_DIR = "uploads"  # under MEDIA_ROOT
+MEDIA_UPLOAD_MAX_SIZE = config("MEDIA_UPLOAD_MAX_SIZE", cast=int, default=10 * 1024**3)  # bytes
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = "custom_auth.User"
+AUTHENTICATION_BACKENDS = [
+    "custom_auth.backends.CachedModelBackend",
+    # sessions store the backend they logged in with, keeps the ones from before the cached backend valid
+    "django.contrib.auth.backends.ModelBackend",
+]
+# verified API keys are cached per process, revocations reach the other processes through a shared cache only
+API_KEY_CACHE_TTL = config("API_KEY_CACHE_TTL", cast=int, default=60 if CACHE_ENABLED else 0)
+# write last_login in batches (at most LAST_LOGIN_FLUSH_INTERVAL seconds late) instead of on every login
+COALESCE_LAST_LOGIN = config("COALESCE_LAST_LOGIN", cast=bool, default=False)
+LAST_LOGIN_FLUSH_INTERVAL = config("LAST_LOGIN_FLUSH_INTERVAL", cast=float, default=30)
+
+REST_FRAMEWORK = {
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "custom_auth.authentication.APIKeyAuthentication",
+        "rest_framework.authentication.SessionAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ],
+    # orjson when installed, see `common.renderers`
+    "DEFAULT_RENDERER_CLASSES": [
+        "common.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "common.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
+    # `search_fields` through a trigram index, see `common.search`
+    "DEFAULT_FILTER_BACKENDS": ["common.search.IndexedSearchFilter"],
+}
+
+# THROTTLING
+"""
+Sliding window limits (see `common.throttling`), shared between workers
+through Redis when CACHE_ENABLED. `THROTTLE_RATE` is the per IP limit of
+`ThrottleMiddleware`, applied to every request before authentication.
+"""
+THROTTLE_RATE = config("THROTTLE_RATE", default="600/min")
+THROTTLE_EXEMPT_PATHS = ["/" + STATIC_URL.lstrip("/"), MEDIA_URL]
+if ENABLE_THROTTLING:
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index("django.middleware.security.SecurityMiddleware") + 1,
+        "common.throttling.ThrottleMiddleware",
+    )
+    REST_FRAMEWORK["DEFAULT_THROTTLE_CLASSES"] = [
+        "common.throttling.AnonRateThrottle",
+        "common.throttling.UserRateThrottle",
+        "custom_auth.throttling.APIKeyRateThrottle",
+    ]
+    REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"] = {
+        "anon": config("THROTTLE_ANON_RATE", default="60/min"),
+        "user": config("THROTTLE_USER_RATE", default="300/min"),
+        "api_key": config("THROTTLE_API_KEY_RATE", default="1200/min"),
+        "ip": config("THROTTLE_IP_RATE", default="600/min"),
+    }
 
 
 # CACHING
@@ -207,6 +328,9 @@ Cache key prefix is used as f"{CACHE_PREFIX}:{version}:<key>"
 GENERAL_CACHE_TTL = config("CACHE_TTL", default=60 * 60 * 24, cast=int)
 CACHE_KEY_PREFIX = config("CACHE_KEY_PREFIX", default="customizer")
 CACHE_VERSION = config("CACHE_VERSION", default="1")
+# the local memory cache isn't shared between workers, only cache users in a shared one
+USER_CACHE_TTL = config("USER_CACHE_TTL", cast=int, default=300 if CACHE_ENABLED else 0)
+PERMISSION_CACHE_TTL = config("PERMISSION_CACHE_TTL", cast=int, default=300 if CACHE_ENABLED else 0)
 if CACHE_ENABLED:
     CACHES = {
         "default": {
@@ -215,3 +339,50 @@ if CACHE_ENABLED:
             "LOCATION": "redis://127.0.0.1:6379",
         }
     }
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+# SESSIONS
+"""
+With a shared cache sessions are served from it and written to the database
+behind, in batches (see `common.sessions`); without one the default database
+engine is kept, the local memory cache isn't shared between workers.
+"""
+if CACHE_ENABLED:
+    SESSION_ENGINE = "common.sessions"
+SESSION_PERSIST_TO_DB = config("SESSION_PERSIST_TO_DB", cast=bool, default=True)
+SESSION_TOUCH_INTERVAL = config("SESSION_TOUCH_INTERVAL", cast=int, default=300)
+WRITE_BEHIND_INTERVAL = config("WRITE_BEHIND_INTERVAL", cast=float, default=2)
+
+# METRICS
+"""
+Prometheus metrics (request latency per URL name, queries, cache hits, log
+records), served at /metrics to INTERNAL_IPS, see `common.metrics`. Each
+process writes to its own file in METRICS_DIR, in memory where /dev/shm is.
+"""
+ENABLE_METRICS = config("ENABLE_METRICS", cast=bool, default=True)
+METRICS_DIR = Path(
+    config(
+        "METRICS_DIR",
+        default=f"/dev/shm/{PROJECT_NAME}-metrics"
+        if Path("/dev/shm").is_dir()
+        else BASE_DIR.joinpath(Path(LOG_FILE_NAME).parent, "metrics"),
+    )
+)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+if ENABLE_METRICS:
+    MIDDLEWARE.insert(0, "common.metrics.MetricsMiddleware")
+    LOGGING["handlers"]["metrics"] = {"class": "common.metrics.LogMetricsHandler"}
+    for logger_name in (LOGGING_NAME, INTERNAL_LOGGING_NAME):
+        LOGGING["loggers"][logger_name]["handlers"].append("metrics")
+    # wrapped to count hits and misses
+    CACHES = {
+        alias: {
+            **params,
+            "BACKEND": "common.metrics.MeteredCache",
+            "METERED_BACKEND": params["BACKEND"],
+            "METERED_ALIAS": alias,
+        }
+        for alias, params in CACHES.items()
+    }
@@ -13,9 +13,26 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
+
+from common.media import ResumableUploadView, serve_media, upload_media
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("uploads/", upload_media, name="media-upload"),
+    path("uploads/resumable/", ResumableUploadView.as_view(), name="media-resumable-uploads"),
+    path("uploads/resumable/<str:upload_id>", ResumableUploadView.as_view(), name="media-resumable-upload"),
 ]
+
+if settings.ENABLE_METRICS:
+    from common.metrics import metrics_view
+
+    urlpatterns += [path("metrics", metrics_view, name="metrics")]
+
+if settings.SERVE_MEDIA:
+    # background job results and uploads are written under MEDIA_ROOT
+    urlpatterns += [re_path(rf"^{re.escape(settings.MEDIA_URL.lstrip('/'))}(?P<path>.*)$", serve_media)]
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "base_django_app.settings")
 
 application = get_wsgi_application()
+
+if settings.SERVE_STATIC:
+    from common.static import StaticFilesWSGI
+
+    application = StaticFilesWSGI(application)
@@ -0,0 +1,81 @@
+from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.html import format_html
+
+from .models import ImportExportJob
+
+
+@admin.register(ImportExportJob)
+class ImportExportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "kind",
+        "model_label",
+        "file_format",
+        "status",
+        "progress_display",
+        "output_link",
+        "created_by",
+        "create_date",
+        "finished_at",
+    )
+    list_filter = ("kind", "status", "create_date")
+    list_select_related = ("created_by",)
+    readonly_fields = [field.name for field in ImportExportJob._meta.fields] + ["progress_display", "output_link"]
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="Progress")
+    def progress_display(self, obj):
+        return f"{obj.progress}% ({obj.progress_done}/{obj.progress_total})"
+
+    @admin.display(description="Output")
+    def output_link(self, obj):
+        if not obj.output_file:
+            return "-"
+        return format_html("<a href='{}'>{}</a>", obj.output_file.url, obj.output_file.name.rsplit("/", 1)[-1])
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:object_id>/status/",
+                self.admin_site.admin_view(self.status_view),
+                name="common_importexportjob_status",
+            ),
+        ] + super().get_urls()
+
+    def status_view(self, request, object_id):
+        """Job progress page, polling itself for `?format=json` until the job is finished"""
+        job = get_object_or_404(ImportExportJob, pk=object_id)
+        if not self.has_view_permission(request, job):
+            if request.GET.get("format") == "json":
+                return JsonResponse({"detail": "forbidden"}, status=403)
+            raise PermissionDenied
+
+        status = {
+            "id": job.pk,
+            "status": job.status,
+            "progress": job.progress,
+            "progress_done": job.progress_done,
+            "progress_total": job.progress_total,
+            "output_url": job.output_file.url if job.output_file else None,
+            "result": job.result,
+            "error": job.error.strip().rsplit("\n", 1)[-1] if job.error else None,
+        }
+        if request.GET.get("format") == "json":
+            return JsonResponse(status)
+
+        context = {
+            **self.admin_site.each_context(request),
+            "title": str(job),
+            "opts": self.model._meta,
+            "job": job,
+            "status": status,
+        }
+        return TemplateResponse(request, "admin/common/importexportjob/status.html", context)
@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_search_indexes(sender, **kwargs):
+    # `common.search` imports the admin and DRF, kept out of app loading (see FAST_STARTUP)
+    from .search import create_search_indexes
+
+    create_search_indexes(sender, **kwargs)
+
+
+class CommonConfig(AppConfig):
+    name = "common"
+
+    def ready(self):
+        post_migrate.connect(create_search_indexes, sender=self)
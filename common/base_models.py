@@ -1,21 +1,137 @@
+import copy
+
+from asgiref.sync import sync_to_async
 from django.db import models
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
+class BaseQuerySet(models.QuerySet):
+    async def alist(self):
+        """Evaluate the queryset in one `sync_to_async` call, returning a list.
+        Django's async reads (`aget`, `afirst`, `acount`...) cover the rest, this
+        saves iterating with `async for`."""
+        return await sync_to_async(list)(self)
+
+    def active(self):
+        return self.filter(is_active=True)
+
+
+class BaseDjangoManager(models.Manager.from_queryset(BaseQuerySet)):
+    pass
+
+
+def _sets_value_on_save(field):
+    if isinstance(field, (models.DateField, models.TimeField)):
+        # their `pre_save` only sets a value with `auto_now` (`auto_now_add` is for inserts)
+        return field.auto_now
+    return type(field).pre_save is not models.Field.pre_save
+
+
 class BaseDjangoModel(models.Model):
 
     create_date = models.DateTimeField(_("Create Date/Time"), default=timezone.now)
     update_date = models.DateTimeField(_("Date/Time Modified"), default=timezone.now)
     is_active = models.BooleanField(_("Active"), default=True)
 
+    objects = BaseDjangoManager()
+
+    # set to False on a subclass to always write every column on save
+    track_dirty_fields = True
+
     class Meta:
         abstract = True
 
-    def save(self, *args, **kwargs):
-        """On save, update timestamps"""
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_loaded_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._snapshot_loaded_values(fields)
+
+    def _snapshot_loaded_values(self, fields=None):
+        """Remember the current value of every loaded concrete field"""
+        loaded_values = self.__dict__.setdefault("_loaded_values", {})
+        deferred_fields = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if fields is not None and field.name not in fields and field.attname not in fields:
+                continue
+            if field.attname in deferred_fields:
+                loaded_values.pop(field.attname, None)
+                continue
+            value = getattr(self, field.attname)
+            if isinstance(value, (dict, list, set)):
+                value = copy.deepcopy(value)
+            loaded_values[field.attname] = value
+
+    @classmethod
+    def get_pre_save_fields(cls):
+        """Names of the concrete fields whose value is set on save (`auto_now`, an
+        overridden `pre_save` such as `FileField`'s), which dirty tracking can't see"""
+        if "_pre_save_fields" not in cls.__dict__:
+            cls._pre_save_fields = [
+                field.name
+                for field in cls._meta.concrete_fields
+                if not field.primary_key and _sets_value_on_save(field)
+            ]
+        return cls._pre_save_fields
+
+    def get_dirty_fields(self):
+        """Return the names of concrete fields changed since the instance was loaded.
+
+        Fields that were deferred on load but have been set (or fetched) since
+        are reported as dirty, since their original value is unknown.
+        """
+        loaded_values = self.__dict__.get("_loaded_values", {})
+        deferred_fields = self.get_deferred_fields()
+        dirty_fields = []
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname in deferred_fields:
+                continue
+            if field.attname not in loaded_values:
+                dirty_fields.append(field.name)
+            elif getattr(self, field.attname) != loaded_values[field.attname]:
+                dirty_fields.append(field.name)
+        return dirty_fields
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        """On save, update timestamps.
+
+        Existing rows loaded from the database are written with an UPDATE of
+        the changed columns, the fields set on save (see `get_pre_save_fields`)
+        and `update_date`; if there are none no query is issued at all.
+        Explicit `update_fields` always get `update_date` added.
+        """
+        adding = self._state.adding or not self.pk
+        if update_fields is None and not adding and not force_insert and self.track_dirty_fields:
+            if "_loaded_values" in self.__dict__:
+                deferred_fields = self.get_deferred_fields()
+                pre_save_fields = [
+                    name
+                    for name in self.get_pre_save_fields()
+                    if self._meta.get_field(name).attname not in deferred_fields
+                ]
+                update_fields = self.get_dirty_fields() + pre_save_fields
+                if not update_fields:
+                    return
+
         if not self.pk:
             self.create_date = timezone.now()
         self.update_date = timezone.now()
 
-        super().save(*args, **kwargs)
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if update_fields:
+                update_fields.add("update_date")
+
+        super().save(
+            force_insert=force_insert,
+            force_update=force_update,
+            using=using,
+            update_fields=update_fields,
+        )
+        if self.track_dirty_fields:
+            self._snapshot_loaded_values(update_fields)
@@ -0,0 +1,205 @@
+"""
+Registry and helpers for the project's benchmark cases.
+
+Apps declare cases in a `benchmarks` module:
+
+    from common.benchmarking import register
+
+    @register("my_case")
+    def my_case(rows="1000"):
+        yield {"rows": int(rows), "seconds": ...}
+
+and run them with `python manage.py benchmark my_case -p rows=5000`.
+Every case yields result rows (dicts), parameters always arrive as strings.
+
+For CI, `--output results.json` saves the results and `--baseline
+baseline.json` compares them with a previous run's: the command fails when
+a measurement got worse by more than `--threshold` percent. Every case runs
+`--repeat` times, the medians of the runs are compared and a change within
+the spread between the runs doesn't count. Rows are matched
+on their fields that aren't measurements, a field is a measurement when its
+name ends like one of `LOWER_IS_BETTER` or `HIGHER_IS_BETTER` and isn't
+the name of one of the case's parameters (e.g. `size_mb`). Fields ending in
+`_count` are only informative, they are neither matched on nor compared.
+"""
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import django
+
+from django.utils.module_loading import autodiscover_modules
+
+BENCHMARKS = {}
+
+
+def register(name):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def autodiscover():
+    autodiscover_modules("benchmarks")
+    return BENCHMARKS
+
+
+def int_list(value):
+    """Parse a comma separated parameter such as "1000,10000" """
+    return [int(item) for item in str(value).split(",") if item.strip()]
+
+
+def measure(func, *args, **kwargs):
+    """Run func once, returning (result, seconds, peak traced memory in bytes)"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def process_memory_kb(pid="self"):
+    """(RSS, PSS) of a process in kB, PSS splits shared pages between the
+    processes sharing them. (None, None) where /proc isn't available."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        return None, None
+    return values.get("Rss"), values.get("Pss")
+
+
+def latency_stats(latencies, seconds):
+    latencies = sorted(latencies)
+    return {
+        "requests_per_second": round(len(latencies) / seconds, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, 2),
+    }
+
+
+def call_stats(func, calls, warmup=100, rounds=5):
+    """Throughput and latency of `calls` calls of a fast function, in microseconds.
+    Each statistic is the best of `rounds` rounds, as `timeit` reports: the slower
+    rounds measured whatever else the machine was doing."""
+    for _ in range(min(warmup, calls)):
+        func()
+    stats = []
+    for _ in range(rounds):
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(calls):
+            call_started = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - call_started)
+        seconds = time.perf_counter() - started
+        latencies.sort()
+        p50, p99 = latencies[len(latencies) // 2], latencies[max(0, int(len(latencies) * 0.99) - 1)]
+        stats.append((calls / seconds, p50, p99))
+    calls_per_second, p50, p99 = zip(*stats)
+    return {
+        "calls_per_second": round(max(calls_per_second)),
+        "p50_us": round(min(p50) * 1_000_000, 2),
+        "p99_us": round(min(p99) * 1_000_000, 2),
+    }
+
+
+# measurement fields by the end of their name, checked in this order ("_mb_s" also ends with "_s")
+HIGHER_IS_BETTER = ("_per_second", "_per_s", "_mb_s")
+LOWER_IS_BETTER = ("_ms", "_us", "_s", "_seconds", "_kb", "_mb", "_per_request", "_per_row")
+# e.g. the requests a load test managed to send in its duration
+COUNT_SUFFIX = "_count"
+
+
+def is_measurement(field, parameters=()):
+    return field not in parameters and (field.endswith(HIGHER_IS_BETTER) or field.endswith(LOWER_IS_BETTER))
+
+
+def row_identity(row, parameters=()):
+    """The fields of a result row that say what was measured, e.g. the parameters"""
+    return tuple(
+        (key, str(value))
+        for key, value in row.items()
+        if not is_measurement(key, parameters) and not key.endswith(COUNT_SUFFIX)
+    )
+
+
+def write_results(path, results, params):
+    data = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def spread(values):
+    """Run-to-run spread of repeated measurements, in percent of their median"""
+    middle = statistics.median(values)
+    return (max(values) - min(values)) / middle * 100 if middle else 0
+
+
+def group_rows(rows, parameters=()):
+    """{row identity: {measurement: [values of the repeated runs]}}"""
+    grouped = {}
+    for row in rows:
+        samples = grouped.setdefault(row_identity(row, parameters), {})
+        for field, value in row.items():
+            if is_measurement(field, parameters) and isinstance(value, (int, float)):
+                samples.setdefault(field, []).append(value)
+    return grouped
+
+
+def find_regressions(results, baseline, threshold, parameters=None):
+    """Measurements of `results` worse than the same row of `baseline` by more
+    than `threshold` percent, as `(case, row identity, field, baseline, current,
+    change %, spread %)`. `parameters` are the parameter names of each case.
+
+    Rows repeated by several runs are compared on their medians, and a change
+    within the spread of the runs (of the results or of the baseline, whichever
+    is wider) is noise, not a regression."""
+    parameters = parameters or {}
+    regressions = []
+    for case, rows in results.items():
+        names = parameters.get(case, ())
+        baseline_rows = group_rows(baseline.get(case, ()), names)
+        for identity, samples in group_rows(rows, names).items():
+            baseline_samples = baseline_rows.get(identity)
+            if baseline_samples is None:
+                continue
+            for field, values in samples.items():
+                previous_values = baseline_samples.get(field)
+                if not previous_values:
+                    continue
+                previous, value = statistics.median(previous_values), statistics.median(values)
+                if not previous:
+                    continue
+                change = (value - previous) / previous * 100
+                worse = -change if field.endswith(HIGHER_IS_BETTER) else change
+                noise = max(spread(values), spread(previous_values))
+                if worse > max(threshold, noise):
+                    described = "  ".join(f"{key}={text}" for key, text in identity)
+                    regressions.append((case, described, field, previous, value, round(change, 1), round(noise, 1)))
+    return regressions
@@ -0,0 +1,506 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.apps import apps
+from django.apps.registry import Apps
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections, models
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve
+from django.utils.module_loading import import_string
+from import_export.resources import modelresource_factory
+from import_export.formats.base_formats import CSV
+
+from . import metrics
+from .benchmarking import call_stats, int_list, latency_stats, measure, process_memory_kb, register
+from .management.commands.generate_admin import AdminApp
+from .media import MediaUpload, serve_media
+from .resources import BaseModelResource
+
+
+def _first_rows(model, row_count):
+    last_pk = model._default_manager.order_by("pk").values_list("pk", flat=True)[row_count - 1 : row_count].first()
+    if last_pk is None:
+        return None
+    return model._default_manager.filter(pk__lte=last_pk).order_by("pk")
+
+
+@register("export_memory")
+def export_memory(model="custom_auth.User", rows="1000,10000,100000"):
+    """Peak memory of the stock tablib export against the streaming export"""
+    model = apps.get_model(model)
+    resource = modelresource_factory(model, resource_class=BaseModelResource)()
+
+    for row_count in int_list(rows):
+        queryset = _first_rows(model, row_count)
+        if queryset is None:
+            yield {"rows": row_count, "skipped": "not enough rows"}
+            continue
+
+        _, stock_seconds, stock_peak = measure(lambda: CSV().export_data(resource.export(queryset.all())))
+        _, streaming_seconds, streaming_peak = measure(
+            lambda: sum(len(chunk) for chunk in resource.iter_export("csv", queryset.all()))
+        )
+        yield {
+            "rows": row_count,
+            "stock_peak_kb": stock_peak // 1024,
+            "streaming_peak_kb": streaming_peak // 1024,
+            "stock_seconds": round(stock_seconds, 3),
+            "streaming_seconds": round(streaming_seconds, 3),
+        }
+
+
+def _run_wsgi(path, host, requests, concurrency):
+    handler = WSGIHandler()
+    factory = RequestFactory(HTTP_HOST=host)
+    statuses = set()
+
+    def start_response(status, headers, exc_info=None):
+        statuses.add(status.split()[0])
+
+    def one(_):
+        environ = factory.get(path).environ
+        started = time.perf_counter()
+        response = handler(environ, start_response)
+        b"".join(response)
+        response.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(one, range(requests)))
+    return latencies, time.perf_counter() - started, statuses
+
+
+def _run_asgi(path, host, requests, concurrency):
+    handler = ASGIHandler()
+    statuses = set()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", host.encode())],
+        "client": ("127.0.0.1", 50000),
+        "server": (host, 80),
+    }
+
+    async def one(semaphore):
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.add(str(message["status"]))
+
+        async with semaphore:
+            started = time.perf_counter()
+            await handler(dict(scope), receive, send)
+            return time.perf_counter() - started
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(one(semaphore) for _ in range(requests)))
+
+    started = time.perf_counter()
+    latencies = asyncio.run(run())
+    return latencies, time.perf_counter() - started, statuses
+
+
+@register("serving")
+def serving(paths="/admin/login/", requests="2000", concurrency="1,16", host="localhost"):
+    """Requests/sec and latency of the same endpoints through the WSGI and ASGI handlers,
+    in process (no server or network), with the full middleware stack"""
+    # a benchmark is an abusive client
+    with override_settings(ENABLE_THROTTLING=False, ALLOWED_HOSTS=[host]):
+        for path in paths.split(","):
+            for workers in int_list(concurrency):
+                for name, run in (("wsgi", _run_wsgi), ("asgi", _run_asgi)):
+                    # warm up url resolving, templates and connections
+                    run(path, host, min(50, int(requests)), workers)
+                    latencies, seconds, statuses = run(path, host, int(requests), workers)
+                    yield {
+                        "path": path,
+                        "handler": name,
+                        "concurrency": workers,
+                        "status": ",".join(sorted(statuses)),
+                        **latency_stats(latencies, seconds),
+                    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _responds(url):
+    try:
+        urllib.request.urlopen(url, timeout=1).close()
+    except urllib.error.HTTPError:
+        pass
+    except OSError:
+        return False
+    return True
+
+
+@register("gunicorn_boot")
+def gunicorn_boot(workers="4", preload="0,1", path="/admin/login/", timeout="120"):
+    """Boot time and per worker memory of gunicorn (with `gunicorn.conf.py`)
+    without and with `preload_app`. Memory is read from /proc, Linux only."""
+    config_path = Path(settings.BASE_DIR).joinpath("gunicorn.conf.py")
+    app = ":".join(settings.WSGI_APPLICATION.rsplit(".", 1))
+    worker_count = int(workers)
+
+    for preload_app in preload.split(","):
+        port = _free_port()
+        env = dict(
+            os.environ,
+            GUNICORN_PRELOAD=preload_app,
+            GUNICORN_WORKERS=workers,
+            GUNICORN_BIND=f"127.0.0.1:{port}",
+        )
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", str(config_path), app],
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        # post_worker_init logs one "Worker ... ready" line per worker
+        all_ready = threading.Event()
+        ready_times = []
+
+        def read_log():
+            for line in process.stderr:
+                if "Worker" in line and " ready in " in line:
+                    ready_times.append(time.perf_counter() - started)
+                    if len(ready_times) == worker_count:
+                        all_ready.set()
+
+        threading.Thread(target=read_log, daemon=True).start()
+        try:
+            deadline = started + int(timeout)
+            first_response = None
+            while first_response is None and time.perf_counter() < deadline and process.poll() is None:
+                if _responds(f"http://127.0.0.1:{port}{path}"):
+                    first_response = time.perf_counter() - started
+                else:
+                    time.sleep(0.05)
+            all_ready.wait(max(0, deadline - time.perf_counter()))
+            memory = [process_memory_kb(pid) for pid in _child_pids(process.pid)]
+            master_rss, _ = process_memory_kb(process.pid)
+        finally:
+            process.terminate()
+            process.wait(30)
+
+        if first_response is None:
+            yield {"preload_app": preload_app, "skipped": "gunicorn didn't start, run it by hand to see why"}
+            continue
+
+        rss = [value for value, _ in memory if value is not None]
+        pss = [value for _, value in memory if value is not None]
+        yield {
+            "preload_app": preload_app,
+            "workers": len(memory),
+            "first_response_s": round(first_response, 2),
+            "all_workers_ready_s": round(ready_times[-1], 2) if ready_times else None,
+            "master_rss_mb": round(master_rss / 1024, 1) if master_rss else None,
+            "worker_rss_mb": round(sum(rss) / len(rss) / 1024, 1) if rss else None,
+            "worker_pss_mb": round(sum(pss) / len(pss) / 1024, 1) if pss else None,
+            "total_pss_mb": round(sum(pss) / 1024, 1) if pss else None,
+        }
+
+
+def _thread_cpu(func, *args):
+    """CPU seconds of the calling thread spent in `func`, the reader thread not included"""
+    started = time.thread_time()
+    func(*args)
+    return time.thread_time() - started
+
+
+def _sendfile(response, out):
+    """Send the body as gunicorn's `wsgi.file_wrapper` does"""
+    filelike = response.file_to_stream
+    offset, count = filelike.tell(), int(response["Content-Length"])
+    while count:
+        sent = os.sendfile(out, filelike.fileno(), offset, count)
+        if not sent:
+            break
+        offset += sent
+        count -= sent
+    response.close()
+
+
+def _iterate(response, out):
+    """Send the body through Python, as without a file wrapper (e.g. ASGI)"""
+    for chunk in response.streaming_content:
+        out.sendall(chunk)
+    response.close()
+
+
+def _client_socket():
+    """A loopback TCP connection whose other end is read (and discarded) by a thread"""
+    with socket.create_server(("127.0.0.1", 0)) as listener:
+        client = socket.create_connection(listener.getsockname())
+        server, _ = listener.accept()
+
+    def drain():
+        buffer = bytearray(1024 * 1024)
+        with client:
+            while client.recv_into(buffer):
+                pass
+
+    threading.Thread(target=drain, daemon=True).start()
+    return server
+
+
+@register("media_serving")
+def media_serving(size_mb="1024,4096", ranges="500", range_kb="1024", upload_mb="512", chunk_kb="1024"):
+    """`serve_media` throughput on multi-GB files: sent with sendfile() (gunicorn)
+    against sent through Python, random ranges, and streaming uploads (written
+    in place, hashed) against a temporary file copied into MEDIA_ROOT.
+
+    The served files are sparse, so the disk isn't measured, only the copies."""
+    directory = Path(settings.MEDIA_ROOT).joinpath("benchmarks")
+    directory.mkdir(parents=True, exist_ok=True)
+    factory = RequestFactory()
+    range_size = int(range_kb) * 1024
+
+    with _client_socket() as out:
+        for size in int_list(size_mb):
+            name = f"benchmarks/sparse-{size}mb.bin"
+            path = directory.joinpath(f"sparse-{size}mb.bin")
+            with open(path, "wb") as f:
+                f.truncate(size * 1024 * 1024)
+            try:
+                sendfile_cpu, sendfile_seconds, sendfile_peak = measure(
+                    _thread_cpu, _sendfile, serve_media(factory.get(f"/{name}"), name), out.fileno()
+                )
+                python_cpu, python_seconds, python_peak = measure(
+                    _thread_cpu, _iterate, serve_media(factory.get(f"/{name}"), name), out
+                )
+
+                started = time.perf_counter()
+                for _ in range(int(ranges)):
+                    first = random.randrange(0, size * 1024 * 1024 - range_size)
+                    request = factory.get(f"/{name}", HTTP_RANGE=f"bytes={first}-{first + range_size - 1}")
+                    _sendfile(serve_media(request, name), out.fileno())
+                ranges_seconds = time.perf_counter() - started
+            finally:
+                path.unlink()
+
+            yield {
+                "size_mb": size,
+                "sendfile_mb_s": round(size / sendfile_seconds),
+                "python_mb_s": round(size / python_seconds),
+                "sendfile_cpu_s": round(sendfile_cpu, 2),
+                "python_cpu_s": round(python_cpu, 2),
+                "sendfile_peak_kb": sendfile_peak // 1024,
+                "python_peak_kb": python_peak // 1024,
+                "ranges_per_s": round(int(ranges) / ranges_seconds),
+            }
+
+    chunk = os.urandom(int(chunk_kb) * 1024)
+    chunks = int(upload_mb) * 1024 // int(chunk_kb)
+
+    def streaming_upload():
+        upload = MediaUpload.create("benchmark.bin")
+        for _ in range(chunks):
+            upload.write(chunk)
+        uploaded = upload.complete()
+        uploaded.close()
+        upload.discard()
+
+    def temporary_file_upload():
+        # Django's TemporaryFileUploadHandler, the copy into MEDIA_ROOT when the
+        # temporary directory is on another file system, and a pass for the checksum
+        with tempfile.NamedTemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR) as temporary:
+            for _ in range(chunks):
+                temporary.write(chunk)
+            temporary.flush()
+            target = directory.joinpath("benchmark.bin")
+            shutil.copyfile(temporary.name, target)
+        sha256 = hashlib.sha256()
+        with open(target, "rb") as f:
+            for block in iter(lambda: f.read(len(chunk)), b""):
+                sha256.update(block)
+        target.unlink()
+
+    _, streaming_seconds, _ = measure(streaming_upload)
+    _, temporary_seconds, _ = measure(temporary_file_upload)
+    yield {
+        "upload_mb": int(upload_mb),
+        "streaming_upload_mb_s": round(int(upload_mb) / streaming_seconds),
+        "temporary_file_upload_mb_s": round(int(upload_mb) / temporary_seconds),
+    }
+
+
+def _per_call_us(func, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+@register("metrics_overhead")
+def metrics_overhead(calls="200000"):
+    """Microseconds `common.metrics` adds: per sample recorded, per request in
+    `MetricsMiddleware` and per query in the execute wrapper. The samples go to
+    a temporary file, not to METRICS_DIR."""
+    calls = int(calls)
+    request = RequestFactory().get("/admin/login/")
+    request.resolver_match = resolve("/admin/login/")
+    response = HttpResponse()
+    middleware = metrics.MetricsMiddleware(lambda request: response)
+    # the wrapper gets the connection itself, not the `django.db.connection` proxy
+    context = {"connection": connections["default"]}
+
+    def execute(sql, params, many, context):
+        return None
+
+    previous_file = metrics._process_file
+    with tempfile.TemporaryDirectory() as directory:
+        metrics._process_file = metrics.MetricsFile(Path(directory, "benchmark.db"))
+        for metric in metrics.METRICS.values():
+            metric.forget_indexes()
+        try:
+            cases = {
+                "counter_inc": lambda: metrics.DB_QUERIES.inc("benchmark"),
+                "histogram_observe": lambda: metrics.REQUEST_DURATION.observe(0.042, "benchmark", "GET", "200"),
+                "middleware": lambda: middleware(request),
+                "query_wrapper": lambda: metrics.record_query(execute, "SELECT 1", None, False, context),
+            }
+            baselines = {
+                "middleware": lambda: middleware.get_response(request),
+                "query_wrapper": lambda: execute("SELECT 1", None, False, context),
+            }
+            for name, func in cases.items():
+                func()  # the first call allocates the entries
+                microseconds = _per_call_us(func, calls)
+                if name in baselines:
+                    microseconds -= _per_call_us(baselines[name], calls)
+                yield {"operation": name, "calls": calls, "overhead_us": round(microseconds, 3)}
+        finally:
+            metrics._process_file.close()
+            metrics._process_file = previous_file
+            for metric in metrics.METRICS.values():
+                metric.forget_indexes()
+
+
+@register("log_formatting")
+def log_formatting(calls="20000"):
+    """Throughput and latency of the "custom" formatter and the "app_filter" filter of
+    `LOGGING`, which every record of the django and internal loggers goes through"""
+    try:
+        formatter_config = settings.LOGGING["formatters"]["custom"]
+        filter_config = settings.LOGGING["filters"]["app_filter"]
+    except (AttributeError, KeyError):
+        yield {"skipped": "no custom formatter or app_filter in LOGGING"}
+        return
+
+    formatter = import_string(formatter_config["class"])(formatter_config["format"], formatter_config["datefmt"])
+    app_filter = filter_config["()"](callback=filter_config["callback"])
+    records = {
+        "message": ("Served %s in %.1fms", ("/api/items/", 12.3)),
+        "static_request": ('"GET /static/app.css HTTP/1.1" %s %s', (200, 1024)),
+    }
+    for kind, (message, args) in records.items():
+        record = logging.LogRecord("django", logging.INFO, __file__, 42, message, args, None, func="view")
+        stats = call_stats(lambda: app_filter.filter(record), int(calls))
+        yield {"operation": "filter", "record": kind, "calls": int(calls), **stats}
+        if kind == "message":
+            # after the filter, which sets the `short_filename` the format refers to
+            stats = call_stats(lambda: formatter.format(record), int(calls))
+            yield {"operation": "format", "record": kind, "calls": int(calls), **stats}
+
+
+def _synthetic_models(count, field_count):
+    """`count` models of `field_count` fields (text, dates, booleans, numbers and a
+    foreign key to the previous model), in an app registry of their own"""
+    registry = Apps()
+    synthetic = []
+    for i in range(count):
+        attrs = {
+            "__module__": __name__,
+            "Meta": type("Meta", (), {"apps": registry, "app_label": "benchmark"}),
+            "name": models.CharField(max_length=100),
+            "slug": models.SlugField(),
+            "created": models.DateTimeField(),
+        }
+        for j in range(field_count - 3):
+            kind = j % 4
+            if kind == 0:
+                attrs[f"flag_{j}"] = models.BooleanField(default=False)
+            elif kind == 1:
+                attrs[f"amount_{j}"] = models.IntegerField(default=0)
+            elif kind == 2:
+                attrs[f"day_{j}"] = models.DateField(null=True)
+            elif synthetic:
+                attrs[f"parent_{j}"] = models.ForeignKey(
+                    synthetic[-1], on_delete=models.CASCADE, related_name="+", null=True
+                )
+            else:
+                attrs[f"title_{j}"] = models.CharField(max_length=100)
+        synthetic.append(type(f"Synthetic{i}", (models.Model,), attrs))
+    return synthetic
+
+
+@register("admin_generation")
+def admin_generation(count="50,500", fields="20", repeat="5"):
+    """`generate_admin`'s analysis and rendering of `count` synthetic models, without
+    querying the database (`--no-query-db`), best of `repeat` runs"""
+    for model_count in int_list(count):
+        synthetic = _synthetic_models(model_count, int(fields))
+        app = SimpleNamespace(name="benchmark", get_models=lambda: synthetic)
+        analyze_seconds, render_seconds = [], []
+        for _ in range(int(repeat)):
+            admin_app = AdminApp(app, [], no_query_db=True)
+            started = time.perf_counter()
+            admin_app.analyze()
+            analyze_seconds.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            str(admin_app)
+            render_seconds.append(time.perf_counter() - started)
+        yield {
+            "models": model_count,
+            "fields": int(fields),
+            "analyze_ms": round(min(analyze_seconds) * 1000, 2),
+            "render_ms": round(min(render_seconds) * 1000, 2),
+            "models_per_second": round(model_count / (min(analyze_seconds) + min(render_seconds))),
+        }
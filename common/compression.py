@@ -0,0 +1,180 @@
+"""
+Gzip compression of responses, for WSGI and ASGI.
+
+Unlike Django's `GZipMiddleware`, only allow-listed content types above
+`COMPRESSION_MIN_SIZE` bytes are compressed, at a level that goes down as
+responses get bigger, and streaming responses are compressed as one gzip
+stream (zlib keeps its window across chunks) flushed every
+`STREAM_FLUSH_SIZE` bytes, instead of flushing after every chunk.
+
+Responses that already have a `Content-Encoding` (e.g. precompressed ones
+or compressed bodies served from a cache) are left alone. The CPU time
+spent compressing is sent in a `Server-Timing` header when the body isn't
+streamed, and summed up per process in `stats`.
+"""
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .middleware import BaseMiddleware, add_server_timing, in_thread
+from .static import accepts_gzip
+
+COMPRESSION_MIN_SIZE = getattr(settings, "COMPRESSION_MIN_SIZE", 1024)  # bytes
+COMPRESSION_CONTENT_TYPES = getattr(
+    settings,
+    "COMPRESSION_CONTENT_TYPES",
+    (
+        "text/html",
+        "text/css",
+        "text/plain",
+        "text/csv",
+        "text/javascript",
+        "application/javascript",
+        "application/json",
+        "application/xml",
+        "image/svg+xml",
+    ),
+)
+# (up to this many bytes, level), cheaper levels for bigger bodies keep the CPU time bounded
+COMPRESSION_LEVELS = ((64 * 1024, 6), (1024 * 1024, 5), (None, 3))
+STREAMING_LEVEL = 5
+STREAM_FLUSH_SIZE = 64 * 1024  # bytes of input buffered by zlib at most before a flush
+THREAD_MIN_SIZE = 256 * 1024  # under ASGI, bigger bodies are compressed in a thread
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def get_level(size):
+    for max_size, level in COMPRESSION_LEVELS:
+        if max_size is None or size <= max_size:
+            return level
+
+
+class CompressionStats:
+    def __init__(self):
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, bytes_in, bytes_out, cpu_seconds):
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_seconds += cpu_seconds
+
+
+stats = CompressionStats()
+
+
+def compress(content, level):
+    """`(compressed, CPU seconds)`"""
+    started = time.thread_time()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    compressed = compressor.compress(content) + compressor.flush()
+    return compressed, time.thread_time() - started
+
+
+class StreamCompressor:
+    """Compress the chunks of one response as a single gzip stream"""
+
+    def __init__(self, level=STREAMING_LEVEL, flush_size=STREAM_FLUSH_SIZE):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+        self.flush_size = flush_size
+        self.unflushed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def compress(self, chunk):
+        started = time.thread_time()
+        data = self.compressor.compress(chunk)
+        self.unflushed += len(chunk)
+        if self.unflushed >= self.flush_size:
+            # sends what zlib holds back, so neither memory nor latency grow with the response
+            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            self.unflushed = 0
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_in += len(chunk)
+        self.bytes_out += len(data)
+        return data
+
+    def finish(self):
+        started = time.thread_time()
+        data = self.compressor.flush()
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_out += len(data)
+        stats.add(self.bytes_in, self.bytes_out, self.cpu_seconds)
+        return data
+
+    def wrap(self, chunks):
+        for chunk in chunks:
+            data = self.compress(chunk)
+            if data:
+                yield data
+        yield self.finish()
+
+    async def awrap(self, chunks):
+        async for chunk in chunks:
+            data = self.compress(chunk)
+            if data:
+                yield data
+        yield self.finish()
+
+
+class CompressionMiddleware(BaseMiddleware):
+    """Put it first in `MIDDLEWARE` (after `SecurityMiddleware`), so the
+    other middleware see the uncompressed response"""
+
+    def should_compress(self, request, response):
+        if response.has_header("Content-Encoding") or response.status_code in (204, 206, 304):
+            return False
+        if response.has_header("Accept-Ranges"):
+            # ranges are offsets in the uncompressed file, which is sent with sendfile()
+            return False
+        content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type not in COMPRESSION_CONTENT_TYPES:
+            return False
+        if not response.streaming and len(response.content) < COMPRESSION_MIN_SIZE:
+            return False
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return accepts_gzip(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+
+    def process_response(self, request, response):
+        if not self.should_compress(request, response):
+            return response
+
+        if response.streaming:
+            compressor = StreamCompressor()
+            if getattr(response, "is_async", False):
+                response.streaming_content = compressor.awrap(response.streaming_content)
+            else:
+                response.streaming_content = compressor.wrap(response.streaming_content)
+            # the length isn't known anymore
+            del response["Content-Length"]
+        else:
+            content = response.content
+            compressed, cpu_seconds = compress(content, get_level(len(content)))
+            stats.add(len(content), len(compressed), cpu_seconds)
+            if len(compressed) >= len(content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+            add_server_timing(response, f"gzip;dur={cpu_seconds * 1000:.2f}")
+
+        # the representation changed, so its ETag can only be a weak one
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = "gzip"
+        return response
+
+    async def aprocess_response(self, request, response):
+        if not response.streaming and len(response.content) >= THREAD_MIN_SIZE:
+            # zlib releases the GIL, the event loop keeps running meanwhile
+            return await in_thread(self.process_response)(request, response)
+        return self.process_response(request, response)
@@ -12,6 +12,8 @@ logger = get_logger(name=__name__, log_file_name=fname, level=logging.DEBUG, fil
 # endregion
 """
 
+import functools
+import ipaddress
 import logging
 import logging.config
 from logging import addLevelName, setLoggerClass, NOTSET
@@ -76,6 +78,70 @@ class AppFilter(CallbackFilter):
         return True and super().filter(record)
 
 
+class lazy_class_attribute:
+    """Class attribute computed by `func(cls)` on first access, then stored on the class"""
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        value = self.func(owner)
+        setattr(owner, self.name, value)
+        return value
+
+
+class termcolor_code(lazy_class_attribute):
+    """Escape code of a termcolor style, termcolor is only imported on first access"""
+
+    def __init__(self, color=None, on_color=None, attrs=None):
+        self.color = color
+        self.on_color = on_color
+        self.attrs = attrs
+
+    def func(self, owner):
+        try:
+            from termcolor import colored
+        except ImportError:
+            raise ImportError("Please install termcolor: pip install termcolor")
+
+        return colored("", color=self.color, on_color=self.on_color, attrs=self.attrs).split(owner.ENDC)[0]
+
+
+@functools.lru_cache(maxsize=None)
+def _internal_networks(internal_ips):
+    networks = []
+    for entry in internal_ips:
+        if entry == "localhost":
+            networks += [ipaddress.ip_network("127.0.0.0/8"), ipaddress.ip_network("::1/128")]
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            pass
+    return networks
+
+
+def is_internal_ip(request, internal_ips, debug=True):
+    """Whether the request's REMOTE_ADDR is in `internal_ips` (addresses, CIDR
+    networks such as "10.0.0.0/8", or "localhost"). Always False unless `debug`."""
+    if not debug:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(address in network for network in _internal_networks(tuple(internal_ips)))
+
+
+def is_light_command(argv, commands):
+    """Whether `argv` runs one of the management `commands`, which don't need the optional apps"""
+    return len(argv) > 1 and Path(argv[0]).name in ("manage.py", "django-admin") and argv[1] in commands
+
+
 # Deprecated
 class ColorConsole:
     HEADER = "\033[95m"
@@ -108,35 +174,33 @@ class ColorConsole2(ColorConsole):
     bold dark underline blink reverse concealed"""
 
     ENDC = "\033[0m"
-    try:
-        from termcolor import colored
-    except ImportError:
-        raise ImportError("Please install termcolor: pip install termcolor")
-
-    HEADER = colored("", color="magenta", on_color=None, attrs=["bold"]).split(ENDC)[0]
-    OKBLUE = colored("", color="blue", on_color=None, attrs=None).split(ENDC)[0]
-    OKCYAN = colored("", color="cyan", on_color=None, attrs=None).split(ENDC)[0]
-    OKGREEN = colored("", color="green", on_color=None, attrs=None).split(ENDC)[0]
-    DEBUG = colored("", color="grey", on_color=None, attrs=None).split(ENDC)[0]
-    WARNING = colored("", color="yellow", on_color=None, attrs=None).split(ENDC)[0]
-    ERROR = colored("", color="red", on_color=None, attrs=None).split(ENDC)[0]
-    EXCEPTION = ERROR
-    CRITICAL = colored("", color="white", on_color="on_red", attrs=None).split(ENDC)[0]
-    BOLD = colored("", color=None, on_color=None, attrs=["bold"]).split(ENDC)[0]
-    UNDERLINE = colored("", color=None, on_color=None, attrs=["underline"]).split(ENDC)[0]
 
-    LOG_COLORS = {
-        "header": [HEADER],
-        "info": [OKGREEN],
-        "debug": [DEBUG],
-        "warning": [WARNING],
-        "debugv": [DEBUG],
-        "error": [ERROR],
-        "exception": [EXCEPTION],
-        "critical": [CRITICAL, BOLD, UNDERLINE],
-        "level 60": [DEBUG],
-        "ending": [ENDC],
-    }
+    HEADER = termcolor_code(color="magenta", attrs=["bold"])
+    OKBLUE = termcolor_code(color="blue")
+    OKCYAN = termcolor_code(color="cyan")
+    OKGREEN = termcolor_code(color="green")
+    DEBUG = termcolor_code(color="grey")
+    WARNING = termcolor_code(color="yellow")
+    ERROR = termcolor_code(color="red")
+    EXCEPTION = termcolor_code(color="red")
+    CRITICAL = termcolor_code(color="white", on_color="on_red")
+    BOLD = termcolor_code(attrs=["bold"])
+    UNDERLINE = termcolor_code(attrs=["underline"])
+
+    @lazy_class_attribute
+    def LOG_COLORS(cls):
+        return {
+            "header": [cls.HEADER],
+            "info": [cls.OKGREEN],
+            "debug": [cls.DEBUG],
+            "warning": [cls.WARNING],
+            "debugv": [cls.DEBUG],
+            "error": [cls.ERROR],
+            "exception": [cls.EXCEPTION],
+            "critical": [cls.CRITICAL, cls.BOLD, cls.UNDERLINE],
+            "level 60": [cls.DEBUG],
+            "ending": [cls.ENDC],
+        }
 
 
 class CustomFormatter(logging.Formatter):
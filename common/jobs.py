@@ -0,0 +1,327 @@
+"""
+Background export/import jobs for the `import_export` admin integration.
+
+The admin enqueues `ImportExportJob` rows (the database is the queue) and
+`python manage.py run_jobs` runs them in a thread or process pool, writing
+exports under `MEDIA_ROOT/jobs/exports/` so they're served from `MEDIA_URL`
+(job files get a random token in their name, they can't be guessed).
+No external broker is needed.
+"""
+import secrets
+import time
+import traceback
+from pathlib import Path
+
+from django import forms
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpRequest, HttpResponseRedirect, QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from django.utils.translation import gettext_lazy as _
+from import_export.formats.base_formats import DEFAULT_FORMATS
+from import_export.forms import ExportForm, ImportForm
+from import_export.resources import modelresource_factory
+
+from .models import ImportExportJob
+from .resources import STREAMING_ENCODERS, BaseModelResource, buffered
+
+PROGRESS_UPDATE_INTERVAL = 1  # seconds between progress writes
+# random bytes in the names of job files, which MEDIA_URL serves to anyone knowing them
+FILE_TOKEN_BYTES = 16
+
+
+# region Queue
+
+
+def enqueue_export(model, file_format, rows=None, user=None):
+    """`rows` selects the rows to export, see `ImportExportJob.export_rows`"""
+    return ImportExportJob.objects.create(
+        kind=ImportExportJob.EXPORT,
+        model_label=model._meta.label,
+        file_format=file_format,
+        export_rows=rows,
+        created_by=user,
+    )
+
+
+def enqueue_import(model, file_format, uploaded_file, dry_run=False, user=None):
+    job = ImportExportJob(
+        kind=ImportExportJob.IMPORT,
+        model_label=model._meta.label,
+        file_format=file_format,
+        dry_run=dry_run,
+        created_by=user,
+    )
+    job.input_file.save(f"{secrets.token_urlsafe(FILE_TOKEN_BYTES)}-{uploaded_file.name}", uploaded_file, save=False)
+    job.save()
+    return job
+
+
+def claim_next_job():
+    """Atomically move the oldest pending job to running and return it.
+
+    The conditional UPDATE makes claiming safe across several workers on
+    every database backend, without `select_for_update`.
+    """
+    pending_ids = ImportExportJob.objects.filter(status=ImportExportJob.PENDING).order_by("create_date")
+    for job_id in pending_ids.values_list("pk", flat=True)[:10]:
+        claimed = ImportExportJob.objects.filter(pk=job_id, status=ImportExportJob.PENDING).update(
+            status=ImportExportJob.RUNNING,
+            started_at=timezone.now(),
+        )
+        if claimed:
+            return job_id
+    return None
+
+
+# endregion
+
+
+# region Runner
+
+
+class ProgressReporter:
+    """Write a job's progress at most once every PROGRESS_UPDATE_INTERVAL seconds"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.last_update = 0
+
+    def __call__(self, done, total=None, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_update < PROGRESS_UPDATE_INTERVAL:
+            return
+        self.last_update = now
+        values = {"progress_done": done}
+        if total is not None:
+            values["progress_total"] = total
+        ImportExportJob.objects.filter(pk=self.job_id).update(**values)
+
+
+def get_file_format(title):
+    for file_format in DEFAULT_FORMATS:
+        if file_format().get_title() == title:
+            return file_format()
+    raise ValueError(f"Unknown format {title!r}")
+
+
+def get_resource(model, kind):
+    model_admin = admin.site._registry.get(model)
+    if model_admin is None:
+        return modelresource_factory(model, resource_class=BaseModelResource)()
+    if kind == ImportExportJob.EXPORT:
+        return model_admin.get_export_resource_class()()
+    return model_admin.get_import_resource_class()()
+
+
+def get_export_queryset(job, model):
+    """The rows of `job.export_rows`, the changelist's filters are applied again by the model admin"""
+    rows = job.export_rows or {}
+    if "pks" in rows:
+        return model._default_manager.filter(pk__in=rows["pks"])
+    model_admin = admin.site._registry.get(model)
+    if "query_string" not in rows or model_admin is None:
+        return model._default_manager.all()
+
+    request = HttpRequest()
+    request.GET = QueryDict(rows["query_string"])
+    request.user = job.created_by or AnonymousUser()
+    return model_admin.get_export_queryset(request)
+
+
+def run_export(job, model, resource, progress):
+    queryset = get_export_queryset(job, model)
+    file_format = get_file_format(job.file_format)
+    token = secrets.token_urlsafe(FILE_TOKEN_BYTES)
+    name = f"jobs/exports/{model._meta.model_name}-{job.pk}-{token}.{file_format.get_extension()}"
+    path = Path(settings.MEDIA_ROOT).joinpath(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    total = queryset.count()
+    progress(0, total, force=True)
+
+    if job.file_format in STREAMING_ENCODERS and isinstance(resource, BaseModelResource):
+
+        def counted(rows):
+            for done, row in enumerate(rows, 1):
+                yield row
+                progress(done)
+
+        encoder = STREAMING_ENCODERS[job.file_format]
+        rows = counted(resource.iter_export_rows(queryset))
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for chunk in buffered(encoder(resource.get_export_headers(), rows)):
+                f.write(chunk)
+    else:
+        data = file_format.export_data(resource.export(queryset))
+        mode = "wb" if file_format.is_binary() else "w"
+        with open(path, mode) as f:
+            f.write(data)
+
+    job.output_file.name = name
+    job.progress_done = total
+    job.progress_total = total
+
+
+def run_import(job, model, resource, progress):
+    file_format = get_file_format(job.file_format)
+    with job.input_file.open(file_format.get_read_mode()) as f:
+        data = f.read()
+    if not file_format.is_binary() and isinstance(data, bytes):
+        data = data.decode("utf-8")
+    dataset = file_format.create_dataset(data)
+    progress(0, len(dataset), force=True)
+
+    if isinstance(resource, BaseModelResource) and resource._meta.use_bulk:
+        result = resource.bulk_import_data(
+            dataset,
+            dry_run=job.dry_run,
+            progress=lambda done, total, rows_per_second: progress(done, total),
+        )
+    else:
+        result = resource.import_data(dataset, dry_run=job.dry_run, user=job.created_by)
+
+    job.progress_done = len(dataset)
+    job.progress_total = len(dataset)
+    errors = [str(error.error) for error in result.base_errors]
+    errors += [str(error.error) for _, row_errors in result.row_errors() for error in row_errors]
+    job.result = {
+        "totals": dict(result.totals),
+        "errors": errors[:100],
+        "invalid_rows": [
+            {"row": row.number, "errors": {key: list(map(str, value)) for key, value in row.error_dict.items()}}
+            for row in result.invalid_rows[:100]
+        ],
+    }
+    if result.has_errors() or result.has_validation_errors():
+        raise ValueError("Import finished with errors, see the result for details")
+
+
+def run_job(job_id):
+    job = ImportExportJob.objects.get(pk=job_id)
+    progress = ProgressReporter(job_id)
+    try:
+        model = apps.get_model(job.model_label)
+        resource = get_resource(model, job.kind)
+        if job.kind == ImportExportJob.EXPORT:
+            run_export(job, model, resource, progress)
+        else:
+            run_import(job, model, resource, progress)
+        job.status = ImportExportJob.DONE
+    except Exception:
+        job.status = ImportExportJob.FAILED
+        job.error = traceback.format_exc()
+        settings.LOGGER.exception(f"Job {job_id} failed")
+    finally:
+        job.finished_at = timezone.now()
+        job.save(
+            update_fields=[
+                "status",
+                "error",
+                "result",
+                "output_file",
+                "progress_done",
+                "progress_total",
+                "finished_at",
+            ]
+        )
+        # connections are per thread, don't leave one open per pool thread
+        connections.close_all()
+    return job.status
+
+
+# endregion
+
+
+# region Admin
+
+
+class BackgroundExportForm(ExportForm):
+    in_background = forms.BooleanField(
+        label=_("Run in the background"),
+        required=False,
+        help_text=_("Queue the export and download the file from the jobs page when it's done"),
+    )
+
+
+class BackgroundImportForm(ImportForm):
+    in_background = forms.BooleanField(
+        label=_("Run in the background"),
+        required=False,
+        help_text=_("Queue the import and follow its progress from the jobs page"),
+    )
+    dry_run = forms.BooleanField(label=_("Dry run"), required=False)
+
+
+class BackgroundJobMixin:
+    """Let the import/export pages of an `ImportExportMixin` admin queue an
+    `ImportExportJob` instead of running in the request"""
+
+    background_export_format = "csv"
+    actions = ["export_in_background"]
+
+    def get_export_form(self):
+        return BackgroundExportForm
+
+    def get_import_form(self):
+        return BackgroundImportForm
+
+    def _redirect_to_job(self, request, job):
+        url = reverse("admin:common_importexportjob_status", args=[job.pk])
+        self.message_user(
+            request,
+            format_html(_("{} queued, follow it <a href='{}'>here</a>"), job, url),
+            messages.SUCCESS,
+        )
+        return HttpResponseRedirect(url)
+
+    def export_action(self, request, *args, **kwargs):
+        if request.method == "POST" and request.POST.get("in_background"):
+            if not self.has_export_permission(request):
+                raise PermissionDenied
+            formats = self.get_export_formats()
+            form = self.get_export_form()(formats, request.POST)
+            if form.is_valid():
+                file_format = formats[int(form.cleaned_data["file_format"])]()
+                # the worker applies the changelist's filters and search again
+                rows = {"query_string": request.GET.urlencode()}
+                job = enqueue_export(self.model, file_format.get_title(), rows, request.user)
+                return self._redirect_to_job(request, job)
+        return super().export_action(request, *args, **kwargs)
+
+    def import_action(self, request, *args, **kwargs):
+        if request.method == "POST" and request.POST.get("in_background"):
+            if not self.has_import_permission(request):
+                raise PermissionDenied
+            formats = self.get_import_formats()
+            form = self.get_import_form()(formats, request.POST, request.FILES)
+            if form.is_valid():
+                file_format = formats[int(form.cleaned_data["input_format"])]()
+                job = enqueue_import(
+                    self.model,
+                    file_format.get_title(),
+                    form.cleaned_data["import_file"],
+                    dry_run=form.cleaned_data["dry_run"],
+                    user=request.user,
+                )
+                return self._redirect_to_job(request, job)
+        return super().import_action(request, *args, **kwargs)
+
+    @admin.action(description=_("Export selected rows in the background"))
+    def export_in_background(self, request, queryset):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        if request.POST.get("select_across") == "1":
+            rows = {"query_string": request.GET.urlencode()}
+        else:
+            rows = {"pks": list(queryset.values_list("pk", flat=True))}
+        job = enqueue_export(self.model, self.background_export_format, rows, request.user)
+        return self._redirect_to_job(request, job)
+
+
+# endregion
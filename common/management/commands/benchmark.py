@@ -0,0 +1,104 @@
+import inspect
+
+from django.core.management.base import BaseCommand, CommandError
+
+from common.benchmarking import autodiscover, find_regressions, load_results, write_results
+
+
+class Command(BaseCommand):
+    help = "Run the benchmark cases registered in the apps' `benchmarks` modules"
+
+    def add_arguments(self, parser):
+        parser.add_argument("cases", nargs="*", help="Benchmark cases to run (default: all)")
+        parser.add_argument("-l", "--list", action="store_true", help="List the available cases")
+        parser.add_argument(
+            "-p",
+            "--param",
+            action="append",
+            default=[],
+            metavar="KEY=VALUE",
+            help="Parameter passed to every selected case",
+        )
+        parser.add_argument("-o", "--output", metavar="FILE", help="Save the results as JSON")
+        parser.add_argument(
+            "-b",
+            "--baseline",
+            metavar="FILE",
+            help="Results saved by a previous run, fail if a measurement regressed",
+        )
+        parser.add_argument(
+            "-r",
+            "--repeat",
+            type=int,
+            default=3,
+            help="Runs of every case, a baseline is compared with their medians (default: 3)",
+        )
+        parser.add_argument(
+            "-t",
+            "--threshold",
+            type=float,
+            default=10,
+            help="Percentage a measurement may get worse by against the baseline (default: 10)",
+        )
+
+    def handle(self, *args, **options):
+        benchmarks = autodiscover()
+        if options["list"]:
+            for name in sorted(benchmarks):
+                self.stdout.write(name)
+            return
+
+        params = {}
+        for param in options["param"]:
+            if "=" not in param:
+                raise CommandError(f"Invalid parameter {param!r}, expected KEY=VALUE")
+            key, value = param.split("=", 1)
+            params[key.strip()] = value
+
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        names = options["cases"] or sorted(benchmarks)
+        unknown = [name for name in names if name not in benchmarks]
+        if unknown:
+            raise CommandError(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+        # read first, a missing baseline shouldn't only show up after the whole run
+        baseline = None
+        if options["baseline"]:
+            try:
+                baseline = load_results(options["baseline"])
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Can't read the baseline {options['baseline']}: {e}")
+
+        results = {}
+        parameters = {}
+        for name in names:
+            self.stdout.write(self.style.SUCCESS(f"# {name}"))
+            accepted = inspect.signature(benchmarks[name]).parameters
+            parameters[name] = set(accepted)
+            case_params = {key: value for key, value in params.items() if key in accepted}
+            results[name] = []
+            for run in range(1, options["repeat"] + 1):
+                if options["repeat"] > 1:
+                    self.stdout.write(f"  run {run}/{options['repeat']}")
+                for row in benchmarks[name](**case_params):
+                    results[name].append(row)
+                    self.stdout.write("  " + "  ".join(f"{key}={value}" for key, value in row.items()))
+
+        if options["output"]:
+            write_results(options["output"], results, params)
+            self.stdout.write(f"Saved the results to {options['output']}")
+
+        if baseline is not None:
+            self.compare(results, baseline, options["threshold"], parameters)
+
+    def compare(self, results, baseline, threshold, parameters):
+        regressions = find_regressions(results, baseline, threshold, parameters)
+        for case, row, field, previous, value, change, spread in regressions:
+            self.stdout.write(
+                self.style.ERROR(f"{case}  {row}  {field}: {previous} -> {value} ({change:+}%, spread {spread}%)")
+            )
+        if regressions:
+            raise CommandError(f"{len(regressions)} measurement(s) regressed by more than {threshold:g}%")
+        self.stdout.write(self.style.SUCCESS(f"No regression over {threshold:g}% against the baseline"))
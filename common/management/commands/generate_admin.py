@@ -6,11 +6,18 @@ import datetime
 import os
 import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import six
-from django.db import models
+from django.db import connections, models, router
 from django.core.management.base import BaseCommand, CommandError
 from django.db.models import ManyToManyField, ManyToOneRel
 from django.apps.registry import apps
+from django.contrib import admin
+
+from common.paginators import EstimatedCountPaginator, estimate_table_rows
 
 
 # region Command setup
@@ -73,23 +80,42 @@ DATE_HIERARCHY_THRESHOLD = 250
 LIST_FILTER_THRESHOLD = 25
 RAW_ID_THRESHOLD = 100
 NO_QUERY_DB = True
+# tables whose planner estimate is above this aren't counted at all
+ESTIMATE_THRESHOLD = 10000
+COUNT_WORKERS = 4
+# from this many rows on, changelists skip the full count and use smaller pages
+LARGE_TABLE_THRESHOLD = 10000
+LARGE_TABLE_LIST_PER_PAGE = 50
+HUGE_TABLE_THRESHOLD = 1000000
+HUGE_TABLE_LIST_PER_PAGE = 25
+# from this many rows on, changelists use `EstimatedCountPaginator`
+ESTIMATED_COUNT_THRESHOLD = 100000
 
 PRINT_IMPORTS = """
 from django.contrib import admin
 from import_export.admin import ImportExportMixin
-from import_export import resources
-from . import models
+from common.jobs import BackgroundJobMixin
+from common.resources import BaseModelResource, StreamingExportMixin
+%(imports)sfrom . import models
+
+"""
+
+PRINT_PAGINATOR_IMPORT = """from common.paginators import EstimatedCountPaginator
+"""
 
+PRINT_SEARCH_IMPORT = """from common.search import IndexedSearchMixin
 """
 
 PRINT_ADMIN_CLASS = """
 
 @admin.register(models.%(name)s)
-class %(name)sAdmin(ImportExportMixin, admin.ModelAdmin):
+class %(name)sAdmin(%(mixins)sBackgroundJobMixin, StreamingExportMixin, ImportExportMixin, admin.ModelAdmin):
 
-    class %(name)sResource(resources.ModelResource):
+    class %(name)sResource(BaseModelResource):
         class Meta:
-            model = models.%(name)s
+            model = models.%(name)s%(resource_meta)s
+
+    resource_class = %(name)sResource
 %(class_)s
 """
 
@@ -97,6 +123,9 @@ class %(name)sAdmin(ImportExportMixin, admin.ModelAdmin):
 PRINT_ADMIN_PROPERTY = """
     %(key)s = %(value)s"""
 
+PRINT_RESOURCE_META_PROPERTY = """
+            %(key)s = %(value)r"""
+
 # endregion
 
 
@@ -106,15 +135,124 @@ def cprint(*args, **kwargs):
     print('"""')
 
 
+class RelatedCounts(object):
+    """Row counts of the models the generated admins refer to.
+
+    Every model is counted at most once per run, counts are capped at
+    `max_count` (a sliced COUNT) and tables whose planner estimate
+    (`pg_class.reltuples`, `sqlite_stat1`) is at least `estimate_threshold`
+    aren't counted at all.
+    """
+
+    def __init__(self, max_count, estimate_threshold=ESTIMATE_THRESHOLD, workers=COUNT_WORKERS):
+        self.max_count = max_count
+        self.estimate_threshold = estimate_threshold
+        self.workers = workers
+        self.counts = {}
+        self.estimated = set()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _estimate(self, model):
+        return estimate_table_rows(model, router.db_for_read(model))
+
+    def _count(self, model):
+        estimate = self._estimate(model)
+        if estimate is not None and estimate >= self.estimate_threshold:
+            with self.lock:
+                self.estimated.add(model)
+            return estimate
+        return model._default_manager.all()[: self.max_count].count()
+
+    def _count_in_thread(self, model):
+        try:
+            return self._count(model)
+        finally:
+            # connections are per thread, close the one opened for this count
+            connections.close_all()
+
+    def get(self, model):
+        with self.lock:
+            if model in self.counts:
+                return self.counts[model]
+
+        count = self._count(model)
+        with self.lock:
+            self.counts[model] = count
+        return count
+
+    def prefetch(self, related_models):
+        """Count every model not counted yet, running the counts concurrently"""
+        pending = [model for model in dict.fromkeys(related_models) if model not in self.counts]
+        if len(pending) < 2 or self.workers < 2:
+            for model in pending:
+                self.get(model)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for model, count in zip(pending, executor.map(self._count_in_thread, pending)):
+                with self.lock:
+                    self.counts[model] = count
+
+
 class AdminApp(object):
     def __init__(self, app, model_res, **options):
         self.app = app
         self.model_res = model_res
         self.options = options
+        self.admin_models = None
+        max_count = max(
+            options.get("list_filter_threshold") or LIST_FILTER_THRESHOLD,
+            options.get("raw_id_threshold") or RAW_ID_THRESHOLD,
+            options.get("large_table_threshold") or LARGE_TABLE_THRESHOLD,
+        )
+        self.related_counts = RelatedCounts(
+            max_count,
+            estimate_threshold=options.get("estimate_threshold") or ESTIMATE_THRESHOLD,
+            workers=options.get("count_workers") or COUNT_WORKERS,
+        )
+
+    def analyze(self):
+        """Count the related tables of every model concurrently, then process the models"""
+        admin_models = list(self)
+        related_models = [
+            related_model for admin_model in admin_models for related_model in admin_model.get_related_models()
+        ]
+        if admin_models and admin_models[0].query_db:
+            self.related_counts.prefetch(related_models)
+
+        for admin_model in admin_models:
+            admin_model._process()
+        self._process_autocomplete(admin_models)
+        self.admin_models = admin_models
+        return admin_models
+
+    def _process_autocomplete(self, admin_models):
+        """Turn the raw id fields of large related tables into `autocomplete_fields`
+        when the admin of the related model has (or can be given) `search_fields`"""
+        admin_models_by_model = {admin_model.model: admin_model for admin_model in admin_models}
+        for admin_model in admin_models:
+            for field_name, related_model in admin_model.large_foreign_keys:
+                related_admin_model = admin_models_by_model.get(related_model)
+                if related_admin_model is not None:
+                    searchable = related_admin_model.ensure_search_fields()
+                else:
+                    registered_admin = admin.site._registry.get(related_model)
+                    searchable = bool(registered_admin and registered_admin.search_fields)
+
+                if searchable:
+                    admin_model.raw_id_fields.remove(field_name)
+                    admin_model.autocomplete_fields.append(field_name)
 
     def __iter__(self):
+        if self.admin_models is not None:
+            yield from self.admin_models
+            return
+
         for model in get_models(self.app):
-            admin_model = AdminModel(model, **self.options)
+            admin_model = AdminModel(model, related_counts=self.related_counts, **self.options)
 
             for model_re in self.model_res:
                 if model_re.search(admin_model.name):
@@ -135,15 +273,22 @@ class AdminApp(object):
             return self.__unicode__()
 
     def _unicode_generator(self):
-        yield PRINT_IMPORTS
+        admin_models = list(self)
+        imports = ""
+        if any(admin_model.paginator for admin_model in admin_models):
+            imports += PRINT_PAGINATOR_IMPORT
+        if any(admin_model.search_fields for admin_model in admin_models):
+            imports += PRINT_SEARCH_IMPORT
+        yield PRINT_IMPORTS % dict(imports=imports)
 
         admin_model_names = []
 
-        # calls the __iter__ method
-        for admin_model in self:
+        for admin_model in admin_models:
             yield PRINT_ADMIN_CLASS % dict(
                 name=admin_model.name,
+                mixins=admin_model.mixins,
                 class_=admin_model,
+                resource_meta=admin_model.resource_meta,
             )
             admin_model_names.append(admin_model.name)
 
@@ -158,10 +303,15 @@ class AdminModel(object):
     PRINTABLE_PROPERTIES = (
         "list_display",
         "list_filter",
+        "list_select_related",
         "raw_id_fields",
+        "autocomplete_fields",
         "search_fields",
         "prepopulated_fields",
         "date_hierarchy",
+        "show_full_result_count",
+        "list_per_page",
+        "paginator",
     )
 
     def __init__(
@@ -174,22 +324,39 @@ class AdminModel(object):
         date_hierarchy_names=DATE_HIERARCHY_NAMES,
         prepopulated_field_names=PREPOPULATED_FIELD_NAMES,
         no_query_db=NO_QUERY_DB,
+        use_bulk=False,
+        related_counts=None,
+        large_table_threshold=LARGE_TABLE_THRESHOLD,
+        estimated_count_threshold=ESTIMATED_COUNT_THRESHOLD,
         **options,
     ):
         self.model = model
         self.list_display = []
         self.list_filter = []
+        self.list_select_related = []
         self.raw_id_fields = []
+        self.autocomplete_fields = []
+        self.large_foreign_keys = []
         self.search_fields = []
         self.prepopulated_fields = {}
         self.date_hierarchy = None
+        self.show_full_result_count = None
+        self.list_per_page = None
+        self.paginator = None
         self.search_field_names = search_field_names
         self.raw_id_threshold = raw_id_threshold
         self.list_filter_threshold = list_filter_threshold
         self.date_hierarchy_threshold = date_hierarchy_threshold
         self.date_hierarchy_names = date_hierarchy_names
         self.prepopulated_field_names = prepopulated_field_names
+        self.large_table_threshold = large_table_threshold
+        self.estimated_count_threshold = estimated_count_threshold
         self.query_db = not no_query_db
+        self.use_bulk = use_bulk
+        self.processed = False
+        if related_counts is None:
+            related_counts = RelatedCounts(max(list_filter_threshold, raw_id_threshold, large_table_threshold))
+        self.related_counts = related_counts
 
     def __repr__(self):
         return "<%s[%s]>" % (
@@ -201,14 +368,33 @@ class AdminModel(object):
     def name(self):
         return self.model.__name__
 
+    @property
+    def mixins(self):
+        # `search_fields` are searched through an index (see `common.search`)
+        return "IndexedSearchMixin, " if self.search_fields else ""
+
+    @property
+    def resource_meta(self):
+        if not self.use_bulk:
+            return ""
+        return PRINT_RESOURCE_META_PROPERTY % dict(key="use_bulk", value=True)
+
     def _process_many_to_many(self, meta):
         raw_id_threshold = self.raw_id_threshold
         for field in meta.local_many_to_many:
             related_model = self._get_related_model(field)
-            related_objects = related_model.objects.all()
-            if related_objects[:raw_id_threshold].count() < raw_id_threshold:
+            if self.related_counts.get(related_model) < raw_id_threshold:
                 yield field.name
 
+    def get_related_models(self):
+        """Models whose row count `_process` needs, the model itself included"""
+        yield self.model
+        meta = self.model._meta
+        parent_fields = meta.parents.values()
+        for field in meta.fields:
+            if field not in parent_fields and isinstance(field, models.ForeignKey):
+                yield self._get_related_model(field)
+
     def _process_fields(self, meta):
         parent_fields = meta.parents.values()
         for field in meta.fields:
@@ -230,13 +416,12 @@ class AdminModel(object):
     def _process_foreign_key(self, field):
         raw_id_threshold = self.raw_id_threshold
         list_filter_threshold = self.list_filter_threshold
-        max_count = max(list_filter_threshold, raw_id_threshold)
         related_model = self._get_related_model(field)
-        related_count = related_model.objects.all()
-        related_count = related_count[:max_count].count()
+        related_count = self.related_counts.get(related_model)
 
         if related_count >= raw_id_threshold:
             self.raw_id_fields.append(field.name)
+            self.large_foreign_keys.append((field.name, related_model))
 
         elif related_count < list_filter_threshold:
             self.list_filter.append(field.name)
@@ -249,6 +434,9 @@ class AdminModel(object):
             return
 
         self.list_display.append(field.name)
+        if isinstance(field, models.ForeignKey):
+            self.list_select_related.append(field.name)
+
         if isinstance(field, LIST_FILTER):
             if isinstance(field, models.ForeignKey) and self.query_db:
                 self._process_foreign_key(field)
@@ -269,8 +457,40 @@ class AdminModel(object):
     def __unicode__(self):
         return six.u("").join(self._unicode_generator())
 
+    def ensure_search_fields(self):
+        """Make sure the admin has `search_fields` (needed by `autocomplete_fields`
+        pointing at it), falling back to its first text field"""
+        if not self.search_fields:
+            for field in self.model._meta.fields:
+                if isinstance(field, models.CharField) and not field.choices and not field.primary_key:
+                    self.search_fields.append(field.name)
+                    break
+        return bool(self.search_fields)
+
+    def _process_table_size(self):
+        table_size = self.related_counts.get(self.model)
+        related_counts = self.related_counts
+        capped = table_size >= related_counts.max_count and self.model not in related_counts.estimated
+        if capped and self.estimated_count_threshold > related_counts.max_count:
+            # the related counts stop below the paginator's threshold, count this table further
+            table_size = self.model._default_manager.all()[: self.estimated_count_threshold].count()
+        if table_size >= self.estimated_count_threshold:
+            self.paginator = EstimatedCountPaginator
+        if table_size < self.large_table_threshold:
+            return
+
+        self.show_full_result_count = False
+        if table_size >= HUGE_TABLE_THRESHOLD:
+            self.list_per_page = HUGE_TABLE_LIST_PER_PAGE
+        else:
+            self.list_per_page = LARGE_TABLE_LIST_PER_PAGE
+
     def _yield_value(self, key, value):
-        if isinstance(value, (list, set, tuple)):
+        if isinstance(value, type):
+            return self._yield_string(key, value.__name__, str)
+        elif isinstance(value, (bool, int)):
+            return self._yield_string(key, value)
+        elif isinstance(value, (list, set, tuple)):
             return self._yield_tuple(key, tuple(value))
         elif isinstance(value, dict):
             return self._yield_dict(key, value)
@@ -312,10 +532,11 @@ class AdminModel(object):
         return row
 
     def _unicode_generator(self):
-        self._process()
+        if not self.processed:
+            self._process()
         for key in self.PRINTABLE_PROPERTIES:
             value = getattr(self, key)
-            if value:
+            if value or value is False:
                 yield self._yield_value(key, value)
 
     def _process(self):
@@ -339,6 +560,9 @@ class AdminModel(object):
                 if not incomplete:
                     self.prepopulated_fields[k] = vs
 
+        if self.query_db:
+            self._process_table_size()
+
         self.processed = True
 
 
@@ -403,6 +627,43 @@ class Command(BaseCommand):
             help="Don't query the database in order to decide whether "
             "fields/relationships are added to `list_filter`",
         )
+        parser.add_argument(
+            "--use-bulk",
+            action="store_true",
+            dest="use_bulk",
+            help="Import through the batched bulk path of `BaseModelResource`",
+        )
+        parser.add_argument(
+            "--estimate-threshold",
+            type=int,
+            default=ESTIMATE_THRESHOLD,
+            metavar="ESTIMATE_THRESHOLD",
+            help="On Postgres, related tables estimated to have at least "
+            "ESTIMATE_THRESHOLD rows use the planner estimate instead of a COUNT",
+        )
+        parser.add_argument(
+            "--large-table-threshold",
+            type=int,
+            default=LARGE_TABLE_THRESHOLD,
+            metavar="LARGE_TABLE_THRESHOLD",
+            help="Models with at least LARGE_TABLE_THRESHOLD rows get "
+            "`show_full_result_count = False` and a smaller `list_per_page`",
+        )
+        parser.add_argument(
+            "--estimated-count-threshold",
+            type=int,
+            default=ESTIMATED_COUNT_THRESHOLD,
+            metavar="ESTIMATED_COUNT_THRESHOLD",
+            help="Models with at least ESTIMATED_COUNT_THRESHOLD rows get "
+            "`paginator = EstimatedCountPaginator`",
+        )
+        parser.add_argument(
+            "--count-workers",
+            type=int,
+            default=COUNT_WORKERS,
+            metavar="COUNT_WORKERS",
+            help="Number of related table counts run concurrently",
+        )
         parser.add_argument("app", help="App to generate admin definitions for")
         parser.add_argument("models", nargs="*", help="Regular expressions to filter the models by")
 
@@ -439,9 +700,18 @@ class Command(BaseCommand):
 
         generated_marker = f"# Generated on {datetime.datetime.now()}"
 
+        admin_app = AdminApp(app, model_res, **options)
+        started = time.perf_counter()
+        admin_models = admin_app.analyze()
+        related_counts = admin_app.related_counts
+        self.stdout.write(
+            f"Analyzed {len(admin_models)} models in {time.perf_counter() - started:.2f}s "
+            f"({len(related_counts)} related tables, {len(related_counts.estimated)} estimated)"
+        )
+
         output = f"""
 {generated_marker}
-{AdminApp(app, model_res, **options).__str__()}
+{admin_app.__str__()}
         """
         with open(filename, "w") as f:
             f.write(output)
@@ -0,0 +1,510 @@
+"""
+Load test the app in-process and report the latency percentiles per endpoint.
+
+    python manage.py loadtest scenario.json --concurrency 32 --duration 30
+    python manage.py loadtest scenario.json --rate 200 --duration 60 --server asgi
+
+The scenario is a JSON file:
+
+    {
+        "user": "alice",
+        "auth": "session",
+        "requests": [
+            {"name": "home", "path": "/"},
+            {"name": "search", "path": "/api/items/?q=chair", "weight": 5},
+            {"name": "create", "method": "POST", "path": "/api/items/", "json": {"name": "Chair"}},
+            {"name": "upload", "method": "POST", "path": "/import/", "data": {"kind": "csv"},
+             "headers": {"Accept-Language": "de"}}
+        ]
+    }
+
+Requests are picked at random by `weight` (1 by default). With a `user`,
+every request is authenticated as that `custom_auth.User`: `session` logs it
+in (and sends a CSRF token), `api_key` creates a temporary API key. Both are
+deleted at the end.
+
+`--server wsgi` serves the app with Django's threaded development server on
+a local port, the requests go through sockets (kept alive); `--server asgi`
+calls the ASGI handler directly. The client is asyncio based in both cases.
+
+Without `--rate`, `--concurrency` clients send their next request as soon as
+they get a response. With `--rate`, requests are due on a fixed schedule
+whatever the response times, and latencies are measured from when they were
+due: an overloaded app shows up as latency rather than as a lower rate.
+
+The database queries are counted on the server side, per request. Throttling
+is off (a load test is one abusive client). `--output` saves the results in
+the format of `manage.py benchmark`, for `--baseline` comparisons.
+"""
+import asyncio
+import contextvars
+import itertools
+import json
+import random
+import secrets
+import socketserver
+import threading
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+from common.benchmarking import find_regressions, load_results, write_results
+
+QUERIES_HEADER = "X-Loadtest-Queries"
+HOST = "127.0.0.1"
+CASE_NAME = "loadtest"
+
+request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender=None, connection=None, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_query)
+
+
+class QueryCountingWSGI:
+    """Counts the queries of each request, sent back in `QUERIES_HEADER`"""
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        counter = [0]
+        token = request_queries.set(counter)
+
+        def counting_start_response(status, headers, exc_info=None):
+            return start_response(status, headers + [(QUERIES_HEADER, str(counter[0]))], exc_info)
+
+        try:
+            # the queries are over once the view returned, before the body is sent
+            return self.application(environ, counting_start_response)
+        finally:
+            request_queries.reset(token)
+
+
+class QueryCountingASGI:
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        counter = [0]
+        # sync_to_async() runs the view in a copy of this context, with the same counter
+        token = request_queries.set(counter)
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message["headers"], (QUERIES_HEADER.encode(), b"%d" % counter[0])]}
+            await send(message)
+
+        try:
+            await self.application(scope, receive, counting_send)
+        finally:
+            request_queries.reset(token)
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadedWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class Endpoint:
+    def __init__(self, spec):
+        if "path" not in spec:
+            raise CommandError(f"Scenario request without a path: {spec}")
+        self.path = spec["path"]
+        self.method = spec.get("method", "GET").upper()
+        self.name = spec.get("name") or f"{self.method} {self.path}"
+        self.weight = spec.get("weight", 1)
+        self.headers = {key.lower(): str(value) for key, value in spec.get("headers", {}).items()}
+        self.body = b""
+        if "json" in spec:
+            self.body = json.dumps(spec["json"]).encode()
+            self.headers.setdefault("content-type", "application/json")
+        elif "data" in spec:
+            self.body = urlencode(spec["data"], doseq=True).encode()
+            self.headers.setdefault("content-type", "application/x-www-form-urlencoded")
+        elif "body" in spec:
+            self.body = spec["body"].encode()
+
+
+class Scenario:
+    def __init__(self, path):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Can't read the scenario {path}: {e}")
+        self.endpoints = [Endpoint(spec) for spec in data.get("requests", ())]
+        if not self.endpoints:
+            raise CommandError(f"The scenario {path} has no requests")
+        self.weights = list(itertools.accumulate(endpoint.weight for endpoint in self.endpoints))
+        self.username = data.get("user")
+        self.auth = data.get("auth", "session")
+        if self.auth not in ("session", "api_key"):
+            raise CommandError(f"Unknown auth {self.auth!r}, expected session or api_key")
+        self.headers = {}
+        self._cleanup = []
+
+    def pick(self):
+        return random.choices(self.endpoints, cum_weights=self.weights)[0]
+
+    def authenticate(self):
+        """Log the scenario's user in, setting the headers sent with every request"""
+        if not self.username:
+            return
+        User = get_user_model()
+        try:
+            user = User._default_manager.get_by_natural_key(self.username)
+        except User.DoesNotExist:
+            raise CommandError(f"No user {self.username!r}")
+
+        if self.auth == "api_key":
+            from custom_auth.models import APIKey
+
+            api_key, raw_key = APIKey.objects.create_key(user, "loadtest")
+            self._cleanup.append(api_key.delete)
+            self.headers["x-api-key"] = raw_key
+            return
+
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        self._cleanup.append(session.delete)
+        # any 32 character secret is a valid token, sent as the cookie and the header
+        csrf_token = secrets.token_hex(16)
+        cookies = SimpleCookie(
+            {settings.SESSION_COOKIE_NAME: session.session_key, settings.CSRF_COOKIE_NAME: csrf_token}
+        )
+        self.headers["cookie"] = cookies.output(header="", sep=";").strip()
+        self.headers["x-csrftoken"] = csrf_token
+
+    def cleanup(self):
+        for func in self._cleanup:
+            func()
+        self._cleanup.clear()
+
+
+class HTTPConnection:
+    """A minimal HTTP/1.1 client connection, kept alive between requests"""
+
+    def __init__(self, address, port, host):
+        self.address = address
+        self.port = port
+        self.host = host
+        self.reader = self.writer = None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers, body):
+        """`(status, headers)`, the body is read and dropped"""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        head += "".join(f"{key}: {value}\r\n" for key, value in headers.items()) + "\r\n"
+        reused = self.writer is not None
+        try:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.address, self.port)
+            self.writer.write(head.encode("latin-1") + body)
+            await self.writer.drain()
+            return await self._read_response()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+            # the server closed the kept alive connection meanwhile
+            return await self.request(method, path, headers, body)
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.read()
+            headers["connection"] = "close"
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, headers
+
+
+class ASGIConnection:
+    """Calls the ASGI application directly, without sockets"""
+
+    def __init__(self, application, host):
+        self.application = application
+        self.host = host
+
+    def close(self):
+        pass
+
+    async def request(self, method, path, headers, body):
+        url = urlsplit(path)
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": url.path,
+            "raw_path": url.path.encode(),
+            "query_string": url.query.encode(),
+            "root_path": "",
+            "headers": [(b"host", self.host.encode())]
+            + [(key.encode(), value.encode("latin-1")) for key, value in headers.items()],
+            "client": (HOST, 50000),
+            "server": (self.host, 80),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        response = {}
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            # only sent once the response is complete
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {key.decode().lower(): value.decode() for key, value in message["headers"]}
+
+        await self.application(scope, receive, send)
+        return response["status"], response["headers"]
+
+
+class Schedule:
+    """Hands out the due time of the next request, None once the test is over"""
+
+    def __init__(self, duration, requests, rate):
+        self.duration = duration
+        self.requests = requests
+        self.rate = rate
+        self.sent = 0
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    async def next(self):
+        if self.requests and self.sent >= self.requests:
+            return None
+        now = time.perf_counter()
+        if not self.rate:
+            if self.duration and now - self.started >= self.duration:
+                return None
+            self.sent += 1
+            return now
+
+        due = self.started + self.sent / self.rate
+        if self.duration and due - self.started >= self.duration:
+            return None
+        self.sent += 1
+        if due > now:
+            await asyncio.sleep(due - now)
+        return due
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, max(0, int(len(ordered) * fraction + 0.5) - 1))]
+
+
+def summarize(endpoint, method, path, samples, seconds):
+    """A result row of `[(status, latency, queries)]`"""
+    latencies = sorted(latency for _, latency, _ in samples)
+    queries = [count for _, _, count in samples if count is not None]
+    statuses = {status for status, _, _ in samples}
+    return {
+        "endpoint": endpoint,
+        "method": method,
+        "path": path,
+        "status": ",".join(str(status or "error") for status in sorted(statuses, key=lambda status: status or 0)),
+        "request_count": len(samples),
+        "error_count": sum(1 for status, _, _ in samples if status is None or status >= 500),
+        "requests_per_second": round(len(samples) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 0.9) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+class Command(BaseCommand):
+    help = "Load test the app in-process from a scenario file, reporting latency percentiles per endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenario", help="JSON scenario file (see the command's module)")
+        parser.add_argument("--server", choices=("wsgi", "asgi"), default="wsgi")
+        parser.add_argument("-c", "--concurrency", type=int, default=8, help="Concurrent clients (default: 8)")
+        parser.add_argument("-d", "--duration", type=float, default=10, help="Seconds to run for (default: 10)")
+        parser.add_argument("-n", "--requests", type=int, default=0, help="Stop after this many requests")
+        parser.add_argument("-r", "--rate", type=float, default=0, help="Requests per second to start (open loop)")
+        parser.add_argument("--warmup", type=int, default=20, help="Requests sent first, not measured (default: 20)")
+        parser.add_argument("--host", default="localhost", help="Host header (default: localhost)")
+        parser.add_argument("-o", "--output", metavar="FILE", help="Save the results as JSON")
+        parser.add_argument("-b", "--baseline", metavar="FILE", help="Results of a previous run to compare with")
+        parser.add_argument("-t", "--threshold", type=float, default=10, help="Percentage of regression allowed")
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        if not options["duration"] and not options["requests"]:
+            raise CommandError("Give a --duration or a number of --requests")
+        scenario = Scenario(options["scenario"])
+        baseline = None
+        if options["baseline"]:
+            try:
+                baseline = load_results(options["baseline"])
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Can't read the baseline {options['baseline']}: {e}")
+        if settings.DEBUG:
+            self.stderr.write(self.style.WARNING("DEBUG is on, every query is kept in memory and views are slower"))
+
+        with override_settings(ENABLE_THROTTLING=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, options["host"]]):
+            connection_created.connect(install_query_counter)
+            for connection in connections.all():
+                install_query_counter(connection=connection)
+            scenario.authenticate()
+            try:
+                rows = self.run(scenario, options)
+            finally:
+                scenario.cleanup()
+                connection_created.disconnect(install_query_counter)
+
+        for row in rows:
+            self.stdout.write("  " + "  ".join(f"{key}={value}" for key, value in row.items()))
+
+        params = {
+            key: options[key]
+            for key in ("scenario", "server", "concurrency", "duration", "requests", "rate", "warmup")
+        }
+        if options["output"]:
+            write_results(options["output"], {CASE_NAME: rows}, params)
+            self.stdout.write(f"Saved the results to {options['output']}")
+        if baseline is not None:
+            self.compare(rows, baseline, options["threshold"])
+
+    def compare(self, rows, baseline, threshold):
+        regressions = find_regressions({CASE_NAME: rows}, baseline, threshold)
+        for case, row, field, previous, value, change in regressions:
+            self.stdout.write(self.style.ERROR(f"{row}  {field}: {previous} -> {value} ({change:+}%)"))
+        if regressions:
+            raise CommandError(f"{len(regressions)} measurement(s) regressed by more than {threshold:g}%")
+        self.stdout.write(self.style.SUCCESS(f"No regression over {threshold:g}% against the baseline"))
+
+    def run(self, scenario, options):
+        if options["server"] == "asgi":
+            application = QueryCountingASGI(ASGIHandler())
+
+            def connect():
+                return ASGIConnection(application, options["host"])
+
+            return asyncio.run(self.drive(scenario, connect, options))
+
+        server = ThreadedWSGIServer((HOST, 0), QuietWSGIRequestHandler)
+        server.set_app(QueryCountingWSGI(WSGIHandler()))
+        port = server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.stdout.write(f"Serving on http://{HOST}:{port}/")
+        try:
+            return asyncio.run(self.drive(scenario, lambda: HTTPConnection(HOST, port, options["host"]), options))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    async def drive(self, scenario, connect, options):
+        headers = scenario.headers
+        samples = defaultdict(list)
+
+        async def send(connection, endpoint, due):
+            try:
+                status, response_headers = await connection.request(
+                    endpoint.method, endpoint.path, {**headers, **endpoint.headers}, endpoint.body
+                )
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                status, response_headers = None, {}
+            queries = response_headers.get(QUERIES_HEADER.lower())
+            return status, time.perf_counter() - due, int(queries) if queries is not None else None
+
+        async def client(schedule, record):
+            connection = connect()
+            try:
+                while True:
+                    due = await schedule.next()
+                    if due is None:
+                        return
+                    endpoint = scenario.pick()
+                    sample = await send(connection, endpoint, due)
+                    if record:
+                        samples[endpoint].append(sample)
+            finally:
+                connection.close()
+
+        if options["warmup"]:
+            warmup = Schedule(0, options["warmup"], 0)
+            warmup.start()
+            await asyncio.gather(*(client(warmup, False) for _ in range(options["concurrency"])))
+
+        schedule = Schedule(options["duration"], options["requests"], options["rate"])
+        self.stdout.write(
+            f"Running {options['server'].upper()} with {options['concurrency']} clients"
+            + (f" at {options['rate']:g} requests/s" if options["rate"] else "")
+        )
+        schedule.start()
+        await asyncio.gather(*(client(schedule, True) for _ in range(options["concurrency"])))
+        seconds = time.perf_counter() - schedule.started
+
+        rows = [
+            summarize(endpoint.name, endpoint.method, endpoint.path, samples[endpoint], seconds)
+            for endpoint in scenario.endpoints
+            if samples[endpoint]
+        ]
+        everything = [sample for endpoint_samples in samples.values() for sample in endpoint_samples]
+        if everything:
+            rows.append(summarize("all", "*", "*", everything, seconds))
+        return rows
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from common.sessions import PRUNE_BATCH_SIZE, prune_expired_sessions
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions from the database in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=PRUNE_BATCH_SIZE,
+            help="Number of sessions deleted per query",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to pause between batches, to go easy on a busy database",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for deleted in prune_expired_sessions(options["batch_size"], options["sleep"]):
+            total += deleted
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Deleted {total} expired session(s) so far")
+        self.stdout.write(self.style.SUCCESS(f"Deleted {total} expired session(s)"))
@@ -0,0 +1,104 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from common.jobs import claim_next_job, run_job
+from common.models import ImportExportJob
+from common.resources import init_django_worker
+
+
+class Command(BaseCommand):
+    help = "Run queued import/export jobs in a local thread or process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=getattr(settings, "JOB_WORKERS", 2),
+            help="Number of jobs run at the same time",
+        )
+        parser.add_argument(
+            "--processes",
+            action="store_true",
+            help="Run jobs in a process pool instead of a thread pool",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=getattr(settings, "JOB_POLL_INTERVAL", 2),
+            help="Seconds to wait before looking for new jobs when idle",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once there are no pending jobs left",
+        )
+        parser.add_argument(
+            "--requeue-running",
+            action="store_true",
+            help="Put jobs left running by a stopped worker back in the queue first",
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
+
+        if options["requeue_running"]:
+            requeued = ImportExportJob.objects.filter(status=ImportExportJob.RUNNING).update(
+                status=ImportExportJob.PENDING
+            )
+            self.stdout.write(f"Requeued {requeued} running job(s)")
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+
+        if options["processes"]:
+            # spawned, not forked, so workers never inherit this process' database connections
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_django_worker,
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+        kind = "processes" if options["processes"] else "threads"
+        self.stdout.write(self.style.SUCCESS(f"Running jobs with {workers} {kind}"))
+        running = {}
+        try:
+            while not self.stopping:
+                while len(running) < workers:
+                    job_id = claim_next_job()
+                    if job_id is None:
+                        break
+                    self.stdout.write(f"Job {job_id} started")
+                    running[executor.submit(run_job, job_id)] = job_id
+
+                if not running:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                done, _ = wait(running, timeout=options["poll_interval"], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        self.stdout.write(f"Job {job_id} {future.result()}")
+                    except Exception as e:
+                        self.stderr.write(f"Job {job_id} crashed: {e}")
+        except KeyboardInterrupt:
+            self.stopping = True
+        finally:
+            if running:
+                self.stdout.write(f"Waiting for {len(running)} running job(s)")
+            executor.shutdown(wait=True)
+
+    def stop(self, signum, frame):
+        self.stopping = True
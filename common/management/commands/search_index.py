@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from common.search import SEARCH_INDEXES, drop_search_index, ensure_search_indexes, register_api_search_fields
+
+
+class Command(BaseCommand):
+    help = "Create the search indexes of the admin and API `search_fields` (also done after `migrate`)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database to create the indexes in",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Drop and recreate the indexes",
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Only drop the indexes",
+        )
+
+    def handle(self, *args, **options):
+        if options["drop"]:
+            register_api_search_fields()
+            for model, field_names in SEARCH_INDEXES.items():
+                drop_search_index(model, field_names, options["database"])
+                self.stdout.write(f"Dropped the search index of {model.__name__}")
+            return
+
+        for model, field_names, error in ensure_search_indexes(options["database"], rebuild=options["rebuild"]):
+            fields = ", ".join(sorted(field_names))
+            if error is None:
+                self.stdout.write(self.style.SUCCESS(f"{model.__name__}: {fields}"))
+            else:
+                self.stderr.write(self.style.WARNING(f"{model.__name__}: {fields}: {error}"))
@@ -0,0 +1,152 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict, namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PHASE_MARKER = "startup_profile:phase"
+PHASES = ("settings", "apps", "urls")
+
+# each phase is profiled in a fresh interpreter, nothing imported beforehand
+PROFILE_SCRIPT = """
+import os, sys, time
+
+def phase(name):
+    sys.stderr.write(f"{marker} {{name}} {{time.perf_counter()}}\\n")
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", {settings_module!r})
+phase("settings")
+from django.conf import settings
+settings.INSTALLED_APPS
+phase("apps")
+import django
+django.setup(set_prefix=False)
+phase("urls")
+from django.urls import get_resolver
+get_resolver().url_patterns
+phase("end")
+"""
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+Module = namedtuple("Module", ["name", "self_us", "cumulative_us", "children"])
+
+
+def parse_import_times(stderr):
+    """`-X importtime` output -> `{phase: (seconds, [top level Module, ...])}`.
+
+    Modules are printed once their import is over, after their own imports
+    and indented one level deeper than their importer, so children come first.
+    """
+    phases = {}
+    pending = defaultdict(list)
+    current = None
+    started = None
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            _, name, timestamp = line.split()
+            if current is not None:
+                phases[current] = (float(timestamp) - started, pending.pop(0, []))
+                pending.clear()
+            current, started = name, float(timestamp)
+            continue
+
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None or current is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        depth = len(indent) // 2
+        children = pending.pop(depth + 1, [])
+        pending[depth].append(Module(name, int(self_us), int(cumulative_us), children))
+    return phases
+
+
+def time_cold_check(runs):
+    """Seconds each of `runs` cold `manage.py check` took, each in a fresh interpreter"""
+    manage_py = Path(settings.BASE_DIR) / "manage.py"
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, str(manage_py), "check"], capture_output=True, text=True)
+        timings.append(time.perf_counter() - started)
+        if result.returncode:
+            raise CommandError(f"`manage.py check` failed:\n{result.stderr[-2000:]}")
+    return timings
+
+
+class Command(BaseCommand):
+    help = "Report the import time of the settings, app loading and URLconf loading, as a cumulative tree"
+
+    def add_arguments(self, parser):
+        parser.add_argument("phases", nargs="*", help=f"Phases to report: {', '.join(PHASES)} (default: all)")
+        parser.add_argument("--top", type=int, default=15, help="Slowest top level imports shown per phase")
+        parser.add_argument("--depth", type=int, default=3, help="Levels of the import tree shown")
+        parser.add_argument("--min-ms", type=float, default=5, help="Hide imports faster than this (cumulative)")
+        parser.add_argument(
+            "--budget",
+            type=float,
+            nargs="?",
+            const=True,
+            metavar="SECONDS",
+            help="Instead of profiling, time a cold `manage.py check` and fail if the median is over "
+            "SECONDS (default: the STARTUP_BUDGET setting)",
+        )
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=settings.STARTUP_BUDGET_RUNS,
+            help="Runs of `manage.py check` for --budget (default: the STARTUP_BUDGET_RUNS setting)",
+        )
+
+    def handle(self, *args, **options):
+        if options["budget"] is not None:
+            budget = settings.STARTUP_BUDGET if options["budget"] is True else options["budget"]
+            self.check_budget(budget, options["runs"])
+            return
+
+        unknown = [name for name in options["phases"] if name not in PHASES]
+        if unknown:
+            raise CommandError(f"Unknown phase(s): {', '.join(unknown)}")
+
+        script = PROFILE_SCRIPT.format(marker=PHASE_MARKER, settings_module=os.environ["DJANGO_SETTINGS_MODULE"])
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", script],
+            capture_output=True,
+            text=True,
+            cwd=os.getcwd(),
+        )
+        if result.returncode:
+            raise CommandError(f"Profiling failed:\n{result.stderr[-2000:]}")
+
+        phases = parse_import_times(result.stderr)
+        for name in options["phases"] or PHASES:
+            seconds, modules = phases[name]
+            imported = sum(module.cumulative_us for module in modules) / 1000
+            summary = f"# {name}: {seconds * 1000:.0f}ms, {imported:.0f}ms importing {len(modules)} modules"
+            self.stdout.write(self.style.SUCCESS(summary))
+            modules = sorted(modules, key=lambda module: module.cumulative_us, reverse=True)[: options["top"]]
+            self.write_tree(modules, options["depth"], options["min_ms"] * 1000)
+
+    def write_tree(self, modules, depth, min_us, level=0):
+        for module in sorted(modules, key=lambda module: module.cumulative_us, reverse=True):
+            if module.cumulative_us < min_us:
+                break
+            self.stdout.write(
+                f"{'  ' * level}{module.cumulative_us / 1000:8.1f}ms {module.self_us / 1000:7.1f}ms  {module.name}"
+            )
+            if level + 1 < depth:
+                self.write_tree(module.children, depth, min_us, level + 1)
+
+    def check_budget(self, budget, runs):
+        median = statistics.median(time_cold_check(runs))
+        message = f"Cold `manage.py check`: {median:.2f}s (median of {runs}), budget {budget:.2f}s"
+        if median > budget:
+            raise CommandError(message)
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,488 @@
+"""
+Serving and uploading `MEDIA_ROOT` files without copying them through Python.
+
+`serve_media` answers with a `FileResponse` over the open file, positioned
+at the start of the requested range and limited to its length. Under
+gunicorn, `wsgi.file_wrapper` hands the descriptor to `os.sendfile()`, so
+the bytes go from the page cache to the socket without entering Python.
+`Range` (a single range), `If-Range` and the conditional headers are
+supported. Uploads and job files are sent as attachments, and job files
+only to the staff allowed to see the job.
+
+Uploads are written where they end up,
+`MEDIA_ROOT/<MEDIA_UPLOAD_DIR>/<id>/<name>`, as a `.part` file renamed once
+complete, and hashed (SHA-256) as the chunks arrive:
+
+* `upload_media` (`MediaUploadHandler`) takes multipart form uploads;
+* `ResumableUploadView` takes one file in raw chunks:
+
+    POST /uploads/resumable/?name=<file name>&size=<bytes>
+        -> 201 {"id": ..., "offset": 0}, with a Location header
+    PUT <location> with `Content-Range: bytes <first>-<last>/<size>`
+        -> 204 with the `Upload-Offset` reached, or 201 and the file once complete
+    HEAD <location>
+        -> `Upload-Offset`, where to resume an interrupted upload from
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.urls import reverse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.utils.text import get_valid_filename
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
+
+from .models import ImportExportJob
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+MEDIA_UPLOAD_DIR = getattr(settings, "MEDIA_UPLOAD_DIR", "uploads")
+MEDIA_UPLOAD_MAX_SIZE = getattr(settings, "MEDIA_UPLOAD_MAX_SIZE", 10 * 1024**3)  # bytes
+BLOCK_SIZE = 1024 * 1024  # bytes per read when the file isn't sent with sendfile()
+PART_SUFFIX = ".part"
+UPLOAD_INFO_NAME = ".upload.json"
+JOB_FILES_DIR = "jobs/"  # `ImportExportJob` files, see `common.jobs`
+HASH_CACHE_SIZE = 1000  # resumable uploads whose hash state is kept between chunks
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+# region Serving
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """`(first, last)` byte of a `Range` header, or None to send the whole file
+    (invalid header, several ranges)"""
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if size == 0:
+        raise RangeNotSatisfiable
+
+    if not first:
+        # the last `last` bytes
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable
+        return max(size - suffix, 0), size - 1
+
+    first = int(first)
+    if first >= size:
+        raise RangeNotSatisfiable
+    last = min(int(last), size - 1) if last else size - 1
+    if last < first:
+        return None
+    return first, last
+
+
+def if_range_matches(if_range, etag, mtime):
+    """Whether the `If-Range` validator (if any) is still current. A strong
+    comparison, so weak ETags never match."""
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(mtime) <= date
+
+
+class LimitedFile:
+    """A file read from `offset`, for `length` bytes.
+
+    `fileno()` is the real file's and its position is `offset`, which is what
+    gunicorn's sendfile() path reads, together with the Content-Length.
+    """
+
+    def __init__(self, file, offset, length):
+        file.seek(offset)
+        self.file = file
+        self.remaining = length
+
+    @property
+    def name(self):
+        return self.file.name
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class MediaFileResponse(FileResponse):
+    # the Python path (ASGI, no file_wrapper) reads big blocks
+    block_size = BLOCK_SIZE
+
+
+def can_download_job_file(user, path):
+    """Job files are only for staff: the job's creator or who can view the job in the admin"""
+    if not user.is_active or not user.is_staff:
+        return False
+    jobs = ImportExportJob.objects.filter(Q(input_file=path) | Q(output_file=path))
+    if user.has_perm("common.view_importexportjob"):
+        return jobs.exists()
+    return jobs.filter(created_by=user).exists()
+
+
+def serve_media(request, path, document_root=None):
+    """`django.views.static.serve`, with ranges and without reading the file in Python"""
+    # as the file will be opened, for the checks on the path
+    path = posixpath.normpath(path).lstrip("/")
+    if path.endswith((PART_SUFFIX, UPLOAD_INFO_NAME)):
+        raise Http404
+    if path.startswith(JOB_FILES_DIR) and not can_download_job_file(request.user, path):
+        raise Http404
+    try:
+        full_path = safe_join(document_root or settings.MEDIA_ROOT, path)
+        file = open(full_path, "rb")
+    except (SuspiciousFileOperation, FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        raise Http404
+
+    stat = os.fstat(file.fileno())
+    etag = quote_etag(f"{stat.st_size:x}-{stat.st_mtime_ns:x}")
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is not None:
+        file.close()
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if "HTTP_RANGE" in request.META and if_range_matches(request.META.get("HTTP_IF_RANGE"), etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(request.META["HTTP_RANGE"], size)
+        except RangeNotSatisfiable:
+            file.close()
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    first, last = byte_range or (0, size - 1)
+    response = MediaFileResponse(
+        LimitedFile(file, first, last - first + 1),
+        status=206 if byte_range else 200,
+        # files sent by users are downloaded, never rendered by the browser in the site's origin
+        as_attachment=path.startswith((f"{MEDIA_UPLOAD_DIR}/", JOB_FILES_DIR)),
+        filename=os.path.basename(path),
+    )
+    response["X-Content-Type-Options"] = "nosniff"
+    # FileResponse sets the whole file's length
+    response["Content-Length"] = str(last - first + 1)
+    if byte_range:
+        response["Content-Range"] = f"bytes {first}-{last}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    return response
+
+
+# endregion
+
+
+# region Uploads
+
+
+_hashes = OrderedDict()
+_hashes_lock = threading.Lock()
+
+
+def _save_hash(upload_id, offset, sha256):
+    with _hashes_lock:
+        _hashes[upload_id] = (offset, sha256)
+        _hashes.move_to_end(upload_id)
+        while len(_hashes) > HASH_CACHE_SIZE:
+            _hashes.popitem(last=False)
+
+
+def _pop_hash(upload_id, offset):
+    with _hashes_lock:
+        cached = _hashes.pop(upload_id, None)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+    return None
+
+
+class MediaUploadedFile(UploadedFile):
+    """A complete upload, already at its place under `MEDIA_ROOT`.
+
+    `temporary_file_path()` makes `FileSystemStorage` move it (a rename) when
+    saved to a `FileField`, instead of copying it.
+    """
+
+    def __init__(self, path, media_name, size, sha256, content_type=None, charset=None, content_type_extra=None):
+        super().__init__(open(path, "rb"), os.path.basename(path), content_type, size, charset, content_type_extra)
+        self.media_name = media_name
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    @property
+    def url(self):
+        return settings.MEDIA_URL + self.media_name
+
+    def as_json(self):
+        return {"name": self.media_name, "url": self.url, "size": self.size, "sha256": self.sha256}
+
+
+class MediaUpload:
+    """One file being written at its final place, `<id>/<name>` under the upload directory"""
+
+    def __init__(self, upload_id, name, size=None, user_id=None):
+        self.id = upload_id
+        self.name = name
+        self.size = size
+        self.user_id = user_id
+        self.media_name = f"{MEDIA_UPLOAD_DIR}/{upload_id}/{name}"
+        self.directory = Path(settings.MEDIA_ROOT, MEDIA_UPLOAD_DIR, upload_id)
+        self.path = self.directory / name
+        self.part_path = self.directory / f"{name}{PART_SUFFIX}"
+        self.offset = 0
+        self.sha256 = hashlib.sha256()
+        self._file = None
+
+    @classmethod
+    def create(cls, name, size=None, user_id=None, resumable=False):
+        name = get_valid_filename(os.path.basename(name))
+        upload = cls(uuid.uuid4().hex, name, size, user_id)
+        upload.directory.mkdir(parents=True)
+        upload.part_path.touch()
+        if resumable:
+            info = {"name": name, "size": size, "user_id": user_id}
+            (upload.directory / UPLOAD_INFO_NAME).write_text(json.dumps(info))
+        return upload
+
+    @classmethod
+    def load(cls, upload_id):
+        """An incomplete resumable upload, None if there's no such upload"""
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id):
+            return None
+        try:
+            info = json.loads(Path(settings.MEDIA_ROOT, MEDIA_UPLOAD_DIR, upload_id, UPLOAD_INFO_NAME).read_text())
+        except (OSError, ValueError):
+            return None
+
+        upload = cls(upload_id, info["name"], info["size"], info["user_id"])
+        upload.offset = upload.part_path.stat().st_size
+        sha256 = _pop_hash(upload_id, upload.offset)
+        if sha256 is None:
+            # another process received the previous chunks, hash them once
+            with open(upload.part_path, "rb") as f:
+                for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                    upload.sha256.update(block)
+        else:
+            upload.sha256 = sha256
+        return upload
+
+    def open(self):
+        """Open the part file for appending, False if another request is writing
+        to it or wrote to it since `load()` (`offset` is then the current one)"""
+        self._file = open(self.part_path, "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.close()
+                return False
+        # the offset was read before the lock was taken, a chunk may have been appended since
+        offset = os.fstat(self._file.fileno()).st_size
+        if offset != self.offset:
+            # the hash is of the first `self.offset` bytes, it isn't saved for the new offset
+            self._file.close()
+            self._file = None
+            self.offset = offset
+            return False
+        return True
+
+    def write(self, chunk):
+        if self._file is None:
+            self.open()
+        if self.offset + len(chunk) > (self.size if self.size is not None else MEDIA_UPLOAD_MAX_SIZE):
+            raise ValueError(f"Upload {self.id} is larger than {self.size or MEDIA_UPLOAD_MAX_SIZE} bytes")
+        self._file.write(chunk)
+        self.sha256.update(chunk)
+        self.offset += len(chunk)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.size is not None and self.offset < self.size:
+            _save_hash(self.id, self.offset, self.sha256)
+
+    def complete(self, content_type=None, charset=None, content_type_extra=None):
+        self.close()
+        _pop_hash(self.id, self.offset)
+        os.replace(self.part_path, self.path)
+        (self.directory / UPLOAD_INFO_NAME).unlink(missing_ok=True)
+        return MediaUploadedFile(
+            self.path,
+            self.media_name,
+            self.offset,
+            self.sha256.hexdigest(),
+            content_type or mimetypes.guess_type(self.name)[0],
+            charset,
+            content_type_extra,
+        )
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        _pop_hash(self.id, self.offset)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class MediaUploadHandler(FileUploadHandler):
+    """Writes the files of a multipart request under `MEDIA_ROOT` as they're received.
+
+    Must be the request's only upload handler, set before its body is read.
+    """
+
+    upload = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.upload = MediaUpload.create(self.file_name)
+
+    def receive_data_chunk(self, raw_data, start):
+        try:
+            self.upload.write(raw_data)
+        except ValueError:
+            self.upload.discard()
+            self.upload = None
+            raise StopUpload(connection_reset=True)
+        return None
+
+    def file_complete(self, file_size):
+        upload, self.upload = self.upload, None
+        return upload.complete(self.content_type, self.charset, self.content_type_extra)
+
+    def upload_interrupted(self):
+        if self.upload is not None:
+            self.upload.discard()
+
+
+@csrf_exempt
+def upload_media(request):
+    """Multipart upload of files under `MEDIA_ROOT`, answers their name, url, size and SHA-256"""
+    if not request.user.is_authenticated:
+        raise PermissionDenied
+    # before the CSRF check, which reads the body
+    request.upload_handlers = [MediaUploadHandler(request)]
+    return _upload_media(request)
+
+
+@csrf_protect
+@require_POST
+def _upload_media(request):
+    files = [uploaded.as_json() for uploaded in request.FILES.values() if isinstance(uploaded, MediaUploadedFile)]
+    return JsonResponse({"files": files}, status=201)
+
+
+class ResumableUploadView(View):
+    http_method_names = ["post", "put", "head"]
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            raise PermissionDenied
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_upload(self, upload_id):
+        upload = MediaUpload.load(upload_id)
+        if upload is None or upload.user_id != self.request.user.pk:
+            raise Http404
+        return upload
+
+    def offset_response(self, upload, status=204):
+        response = HttpResponse(status=status)
+        response["Upload-Offset"] = str(upload.offset)
+        return response
+
+    def post(self, request, upload_id=None):
+        name = request.GET.get("name", "")
+        try:
+            size = int(request.GET.get("size", ""))
+        except ValueError:
+            size = -1
+        if upload_id is not None or not name or not 0 <= size <= MEDIA_UPLOAD_MAX_SIZE:
+            return HttpResponseBadRequest("Expected ?name=<file name>&size=<bytes>")
+
+        upload = MediaUpload.create(name, size, request.user.pk, resumable=True)
+        response = JsonResponse({"id": upload.id, "offset": 0}, status=201)
+        response["Location"] = reverse("media-resumable-upload", args=[upload.id])
+        return response
+
+    def head(self, request, upload_id=None):
+        return self.offset_response(self.get_upload(upload_id), status=200)
+
+    def put(self, request, upload_id=None):
+        upload = self.get_upload(upload_id)
+        match = CONTENT_RANGE_RE.match(request.META.get("HTTP_CONTENT_RANGE", ""))
+        if match is None:
+            return HttpResponseBadRequest("Expected Content-Range: bytes <first>-<last>/<size>")
+        first, last, size = map(int, match.groups())
+        if size != upload.size or last < first or last >= size:
+            return HttpResponseBadRequest(f"Invalid range for an upload of {upload.size} bytes")
+        if first != upload.offset:
+            # a lost or repeated chunk, the client resumes from Upload-Offset
+            return self.offset_response(upload, status=409)
+
+        if not upload.open():
+            return self.offset_response(upload, status=409)
+        remaining = last - first + 1
+        try:
+            # read in blocks straight from the socket, the body is never buffered whole
+            while remaining:
+                chunk = request.read(min(BLOCK_SIZE, remaining))
+                if not chunk:
+                    break
+                upload.write(chunk)
+                remaining -= len(chunk)
+        finally:
+            upload.close()
+
+        if upload.offset == upload.size:
+            return JsonResponse(upload.complete().as_json(), status=201)
+        return self.offset_response(upload)
+
+
+# endregion
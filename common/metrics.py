@@ -0,0 +1,504 @@
+"""
+Prometheus metrics that add up across worker processes.
+
+Every process writes its samples to its own memory mapped file under
+`METRICS_DIR`: recording a sample is a dict lookup and an in place update of
+8 bytes, without a system call. `metrics_view` sums the files of all the
+processes in the text exposition format. The files of processes that exited
+are folded into one archive file then, so the counters don't go down when
+gunicorn recycles its workers, and the directory is cleared when gunicorn
+starts.
+
+Recorded when `ENABLE_METRICS`:
+
+* `http_request_duration_seconds`: per resolved URL name, method and status,
+  by `MetricsMiddleware` (for streaming responses, until the response starts);
+* `db_queries_total` and `db_query_duration_seconds_total`: per database, by
+  an execute wrapper added to every new connection;
+* `cache_gets_total`: hits and misses per cache, by `MeteredCache`, which
+  wraps the configured cache backends;
+* `log_records_total`: per logger and level, by `LogMetricsHandler` on the
+  `django` and internal loggers.
+
+The endpoint only answers `INTERNAL_IPS`, and the `Authorization: Bearer
+<METRICS_TOKEN>` header when a token is set (behind a proxy REMOTE_ADDR is
+the proxy's). Measure the recording overhead with
+`python manage.py benchmark metrics_overhead`.
+"""
+import bisect
+import fcntl
+import hmac
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache.backends.base import BaseCache
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.utils.module_loading import import_string
+
+from .init_helpers import is_internal_ip
+from .middleware import BaseMiddleware
+
+METRICS_DIR = Path(getattr(settings, "METRICS_DIR", Path(settings.BASE_DIR, "logs", "metrics")))
+METRICS_TOKEN = getattr(settings, "METRICS_TOKEN", "")
+LATENCY_BUCKETS = getattr(
+    settings, "METRICS_LATENCY_BUCKETS", (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+ARCHIVE_NAME = "archive.db"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+INITIAL_SIZE = 64 * 1024  # bytes, doubled whenever a file is full
+# anything else is counted as "other", clients choose the method
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+UNRESOLVED = "<unresolved>"
+
+USED = struct.Struct("Q")
+KEY_LENGTH = struct.Struct("I")
+VALUE = struct.Struct("d")
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+def read_entries(data):
+    """`(key, value, offset of the value)` for every entry of a metrics file's content"""
+    used = USED.unpack_from(data, 0)[0] if len(data) >= USED.size else 0
+    position = USED.size
+    while position < used:
+        length = KEY_LENGTH.unpack_from(data, position)[0]
+        key_start = position + KEY_LENGTH.size
+        value_position = position + _padded(KEY_LENGTH.size + length)
+        key = bytes(data[key_start : key_start + length]).decode()
+        yield key, VALUE.unpack_from(data, value_position)[0], value_position
+        position = value_position + VALUE.size
+
+
+class MetricsFile:
+    """Float values under string keys in a memory mapped file, written by a single process
+
+    The file starts with the number of bytes used (8 bytes), followed for every
+    key by its length (4 bytes), the UTF-8 key padded to 8 bytes and the value
+    (a double). The used size is written after the entry, so readers never see
+    a partly written one."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(self.fd).st_size
+        if size == 0:
+            size = INITIAL_SIZE
+            os.ftruncate(self.fd, size)
+        self._map(size)
+        # a process reusing the pid of a dead one carries on with its values
+        self.indexes = {key: position // VALUE.size for key, _, position in read_entries(self.mmap)}
+        self.used = max(USED.unpack_from(self.mmap, 0)[0], USED.size)
+        self.lock = threading.Lock()
+
+    def index(self, key):
+        """Index of the value of `key` for `add()`, the key is added with a value of 0 if it's new"""
+        index = self.indexes.get(key)
+        if index is None:
+            with self.lock:
+                index = self.indexes.get(key)
+                if index is None:
+                    index = self._append(key)
+        return index
+
+    def add(self, index, amount):
+        # the values are aligned doubles, updated in place through a view, much cheaper than struct
+        with self.lock:
+            self.values[index] += amount
+
+    def close(self):
+        self.values.release()
+        self.mmap.close()
+        os.close(self.fd)
+
+    def _map(self, size):
+        self.mmap = mmap.mmap(self.fd, size)
+        self.values = memoryview(self.mmap).cast("d")
+
+    def _append(self, key):
+        encoded = key.encode()
+        key_start = self.used + KEY_LENGTH.size
+        value_position = self.used + _padded(KEY_LENGTH.size + len(encoded))
+        end = value_position + VALUE.size
+        if end > len(self.mmap):
+            self._grow(end)
+        KEY_LENGTH.pack_into(self.mmap, self.used, len(encoded))
+        self.mmap[key_start : key_start + len(encoded)] = encoded
+        VALUE.pack_into(self.mmap, value_position, 0.0)
+        USED.pack_into(self.mmap, 0, end)
+        self.used = end
+        self.indexes[key] = index = value_position // VALUE.size
+        return index
+
+    def _grow(self, size):
+        capacity = len(self.mmap)
+        while capacity < size:
+            capacity *= 2
+        self.values.release()
+        self.mmap.close()
+        os.ftruncate(self.fd, capacity)
+        self._map(capacity)
+
+
+_process_file = None
+_process_file_lock = threading.Lock()
+
+
+def process_file():
+    """This process's `MetricsFile`, opened on first use"""
+    global _process_file
+    if _process_file is None:
+        with _process_file_lock:
+            if _process_file is None:
+                _process_file = MetricsFile(METRICS_DIR / f"{os.getpid()}.db")
+    return _process_file
+
+
+def _after_fork():
+    # the parent's file and offsets belong to the parent, e.g. gunicorn's master with preload_app
+    global _process_file, _process_file_lock
+    _process_file = None
+    _process_file_lock = threading.Lock()
+    for metric in METRICS.values():
+        metric.forget_indexes()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def _format_value(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+def _escape(value):
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+METRICS = {}
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # label values -> indexes of the values in the process file
+        self._indexes = {}
+        METRICS[name] = self
+
+    def forget_indexes(self):
+        self._indexes = {}
+
+    def key(self, suffix, labelvalues, le=None):
+        return json.dumps([self.name, suffix, labelvalues, le])
+
+    def expose(self, samples):
+        """Exposition lines of `{(suffix, label values, le): value}`"""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        file = process_file()
+        index = self._indexes.get(labelvalues)
+        if index is None:
+            index = self._indexes[labelvalues] = file.index(self.key("", labelvalues))
+        file.add(index, amount)
+
+    def expose(self, samples):
+        for (_, labelvalues, _), value in sorted(samples.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Stores the count of every bucket and the sum, the cumulative counts are
+    computed when exposed"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(bucket) for bucket in buckets)
+        self.bucket_labels = tuple(_format_value(bucket) for bucket in self.buckets) + ("+Inf",)
+
+    def observe(self, value, *labelvalues):
+        file = process_file()
+        indexes = self._indexes.get(labelvalues)
+        if indexes is None:
+            indexes = self._indexes[labelvalues] = [
+                file.index(self.key("_bucket", labelvalues, le)) for le in self.bucket_labels
+            ] + [file.index(self.key("_sum", labelvalues))]
+        # the first bucket the value fits in, +Inf past the last one
+        file.add(indexes[bisect.bisect_left(self.buckets, value)], 1)
+        file.add(indexes[-1], value)
+
+    def expose(self, samples):
+        buckets, sums = defaultdict(dict), {}
+        for (suffix, labelvalues, le), value in samples.items():
+            if suffix == "_sum":
+                sums[labelvalues] = value
+            else:
+                buckets[labelvalues][le] = value
+
+        for labelvalues in sorted(buckets):
+            count = 0.0
+            for le in self.bucket_labels:
+                count += buckets[labelvalues].get(le, 0.0)
+                labels = _format_labels(self.labelnames + ("le",), labelvalues + (le,))
+                yield f"{self.name}_bucket{labels} {_format_value(count)}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(sums.get(labelvalues, 0.0))}"
+            yield f"{self.name}_count{labels} {_format_value(count)}"
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to respond, per resolved URL name, method and status.",
+    ("view", "method", "status"),
+)
+DB_QUERIES = Counter("db_queries_total", "Database queries, per database.", ("database",))
+DB_QUERY_DURATION = Counter(
+    "db_query_duration_seconds_total", "Time spent in database queries, per database.", ("database",)
+)
+CACHE_GETS = Counter("cache_gets_total", "Cache reads, per cache and result (hit or miss).", ("cache", "result"))
+LOG_RECORDS = Counter("log_records_total", "Log records, per logger and level.", ("logger", "level"))
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def archive_dead_processes():
+    """Add the values of the processes that exited to the archive file and remove their files.
+    Call it with the directory lock held."""
+    archive = None
+    for path in METRICS_DIR.glob("*.db"):
+        if not path.stem.isdigit() or _is_alive(int(path.stem)):
+            continue
+        if archive is None:
+            archive = MetricsFile(METRICS_DIR / ARCHIVE_NAME)
+        for key, value, _ in read_entries(path.read_bytes()):
+            archive.add(archive.index(key), value)
+        path.unlink()
+    if archive is not None:
+        archive.close()
+
+
+def collect():
+    """Values summed over the files of all the processes: `{key: value}`"""
+    totals = defaultdict(float)
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(METRICS_DIR / ".lock", "a") as lock:
+        # one scrape at a time archives, and none reads a file being archived
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_dead_processes()
+        for path in METRICS_DIR.glob("*.db"):
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:
+                continue
+            for key, value, _ in read_entries(data):
+                totals[key] += value
+    return totals
+
+
+def exposition():
+    """All the metrics in the Prometheus text format"""
+    samples = defaultdict(dict)
+    for key, value in collect().items():
+        name, suffix, labelvalues, le = json.loads(key)
+        samples[name][suffix, tuple(labelvalues), le] = value
+
+    lines = []
+    for metric in METRICS.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.expose(samples.get(metric.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+def clear_directory():
+    """Remove the files of a previous run, gunicorn calls it on start"""
+    for path in METRICS_DIR.glob("*.db"):
+        path.unlink(missing_ok=True)
+
+
+def metrics_view(request):
+    if not is_internal_ip(request, settings.INTERNAL_IPS):
+        raise Http404
+    if METRICS_TOKEN:
+        scheme, _, token = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            raise Http404
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Put it first in `MIDDLEWARE`, the time of the other middleware is included"""
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def record(request, response, seconds):
+        # the URL name keeps the number of series bounded, unlike the path
+        match = request.resolver_match
+        REQUEST_DURATION.observe(
+            seconds,
+            match.view_name if match is not None else UNRESOLVED,
+            request.method if request.method in METHODS else "other",
+            str(response.status_code),
+        )
+
+
+def record_query(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        alias = context["connection"].alias
+        DB_QUERIES.inc(alias)
+        DB_QUERY_DURATION.inc(alias, amount=time.perf_counter() - started)
+
+
+def install_query_metrics(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        # first, `connection.execute_wrapper()` blocks pop the last wrapper on exit
+        connection.execute_wrappers.insert(0, record_query)
+
+
+if getattr(settings, "ENABLE_METRICS", False):
+    connection_created.connect(install_query_metrics)
+
+
+_MISSING = object()
+
+
+class MeteredCache(BaseCache):
+    """Cache backend counting the hits and misses of `get()`, `get_many()` and
+    their async versions on the backend it wraps, `METERED_BACKEND` in the
+    `CACHES` entry. Everything else goes to the wrapped backend."""
+
+    def __init__(self, location, params):
+        params = dict(params)
+        self.alias = params.pop("METERED_ALIAS", "default")
+        self.backend = import_string(params.pop("METERED_BACKEND"))(location, params)
+        super().__init__(params)
+
+    def __getattr__(self, name):
+        # attributes of the wrapped backend that aren't part of `BaseCache`
+        return getattr(self.backend, name)
+
+    def _count(self, value):
+        if value is _MISSING:
+            CACHE_GETS.inc(self.alias, "miss")
+        else:
+            CACHE_GETS.inc(self.alias, "hit")
+
+    def _count_many(self, keys, values):
+        if values:
+            CACHE_GETS.inc(self.alias, "hit", amount=len(values))
+        if len(keys) > len(values):
+            CACHE_GETS.inc(self.alias, "miss", amount=len(keys) - len(values))
+
+    def get(self, key, default=None, version=None):
+        value = self.backend.get(key, _MISSING, version=version)
+        self._count(value)
+        return default if value is _MISSING else value
+
+    async def aget(self, key, default=None, version=None):
+        value = await self.backend.aget(key, _MISSING, version=version)
+        self._count(value)
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        values = self.backend.get_many(keys, version=version)
+        self._count_many(keys, values)
+        return values
+
+    async def aget_many(self, keys, version=None):
+        keys = list(keys)
+        values = await self.backend.aget_many(keys, version=version)
+        self._count_many(keys, values)
+        return values
+
+
+def _forward(name):
+    def method(self, *args, **kwargs):
+        return getattr(self.backend, name)(*args, **kwargs)
+
+    method.__name__ = name
+    return method
+
+
+# the wrapped backend's own implementations, not `BaseCache`'s generic ones built on `get()`
+# (`get_or_set()` and `aget_or_set()` are left to `BaseCache`, so their reads are counted)
+for _name in (
+    "add",
+    "set",
+    "touch",
+    "delete",
+    "set_many",
+    "delete_many",
+    "has_key",
+    "incr",
+    "decr",
+    "incr_version",
+    "decr_version",
+    "clear",
+    "close",
+    "make_key",
+    "validate_key",
+    "make_and_validate_key",
+):
+    setattr(MeteredCache, _name, _forward(_name))
+    if hasattr(BaseCache, f"a{_name}"):
+        setattr(MeteredCache, f"a{_name}", _forward(f"a{_name}"))
+del _name
+
+
+class LogMetricsHandler(logging.Handler):
+    """Counts the records of the loggers it's added to"""
+
+    def emit(self, record):
+        LOG_RECORDS.inc(record.name, record.levelname)
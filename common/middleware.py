@@ -0,0 +1,79 @@
+"""
+Base class for the project's middleware.
+
+Django's `MiddlewareMixin` is sync and async capable, but under ASGI it runs
+every `process_request`/`process_response` through `sync_to_async`, one
+thread hop each. `BaseMiddleware` calls the hooks directly in both modes,
+so a request only leaves the event loop for the hooks that override
+`aprocess_request`/`aprocess_response` to do blocking I/O in a thread.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+try:
+    # unlike asyncio's, recognizes the callables marked with `markcoroutinefunction`
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    from asyncio import iscoroutinefunction
+
+    markcoroutinefunction = None
+
+
+class BaseMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            # tells the handler to await us instead of wrapping us in a thread
+            if markcoroutinefunction is not None:
+                markcoroutinefunction(self)
+            else:
+                self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} get_response={self.get_response!r}>"
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        response = self.process_request(request)
+        if response is None:
+            response = self.get_response(request)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        response = await self.aprocess_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return await self.aprocess_response(request, response)
+
+    def process_request(self, request):
+        """Return a response to skip the view, or None. Must not block under ASGI
+        unless `aprocess_request` is overridden too."""
+        return None
+
+    def process_response(self, request, response):
+        return response
+
+    async def aprocess_request(self, request):
+        return self.process_request(request)
+
+    async def aprocess_response(self, request, response):
+        return self.process_response(request, response)
+
+
+def add_server_timing(response, metric):
+    """Append a `Server-Timing` metric such as `db;dur=12.5`"""
+    if response.has_header("Server-Timing"):
+        metric = f"{response['Server-Timing']}, {metric}"
+    response["Server-Timing"] = metric
+
+
+def in_thread(func):
+    """`sync_to_async` for blocking calls that don't touch the database"""
+    return sync_to_async(func, thread_sensitive=False)
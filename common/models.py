@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from .base_models import BaseDjangoModel
+
+
+class ImportExportJob(BaseDjangoModel):
+    """An export or import queued from the admin and run by `manage.py run_jobs`"""
+
+    EXPORT = "export"
+    IMPORT = "import"
+    KIND_CHOICES = (
+        (EXPORT, _("Export")),
+        (IMPORT, _("Import")),
+    )
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, _("Pending")),
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    )
+
+    kind = models.CharField(_("Kind"), max_length=10, choices=KIND_CHOICES)
+    status = models.CharField(_("Status"), max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    model_label = models.CharField(_("Model"), max_length=100)
+    file_format = models.CharField(_("Format"), max_length=10)
+    # rows to export: `{"pks": [...]}` selected in the changelist or `{"query_string": "..."}`
+    # of its filters and search, all rows when empty
+    export_rows = models.JSONField(_("Rows"), null=True, blank=True, editable=False, encoder=DjangoJSONEncoder)
+    dry_run = models.BooleanField(_("Dry run"), default=False)
+    input_file = models.FileField(_("Input file"), upload_to="jobs/imports/", blank=True)
+    output_file = models.FileField(_("Output file"), upload_to="jobs/exports/", blank=True)
+    progress_done = models.PositiveIntegerField(_("Rows processed"), default=0)
+    progress_total = models.PositiveIntegerField(_("Rows total"), default=0)
+    result = models.JSONField(_("Result"), null=True, blank=True)
+    error = models.TextField(_("Error"), blank=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_("Created by"),
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    started_at = models.DateTimeField(_("Started at"), null=True, blank=True)
+    finished_at = models.DateTimeField(_("Finished at"), null=True, blank=True)
+
+    class Meta:
+        ordering = ("-create_date",)
+        indexes = [
+            models.Index(fields=["status", "create_date"]),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.model_label} #{self.pk}"
+
+    @property
+    def progress(self):
+        """Percentage of rows processed"""
+        if self.status == self.DONE:
+            return 100
+        if not self.progress_total:
+            return 0
+        return min(100, int(self.progress_done * 100 / self.progress_total))
@@ -0,0 +1,184 @@
+"""
+Paginators for changelists of large tables.
+
+`SELECT COUNT(*)` has to visit every row, so on big tables it's usually the
+slowest query of an admin changelist. `EstimatedCountPaginator` uses the
+planner's row estimate when it's large enough to make the exact number
+irrelevant and only counts exactly, with a time limit, below it.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import DatabaseError, OperationalError, connections, transaction
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+ESTIMATE_THRESHOLD = getattr(settings, "PAGINATOR_ESTIMATE_THRESHOLD", 100000)
+COUNT_TIMEOUT = getattr(settings, "PAGINATOR_COUNT_TIMEOUT", 0.2)  # seconds
+
+# SQLSTATE of a statement cancelled by `statement_timeout`
+POSTGRES_QUERY_CANCELED = "57014"
+
+
+# region Estimates
+
+
+def estimate_table_rows(model, using="default"):
+    """Row count of `model`'s table according to the planner statistics.
+
+    Uses `pg_class.reltuples` on Postgres and `sqlite_stat1` on SQLite,
+    returns None when there are no statistics (the table was never
+    analyzed) or the backend has none.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [connection.ops.quote_name(table)],
+                )
+                rows = [row[0] for row in cursor.fetchall()]
+            elif connection.vendor == "sqlite":
+                # the first number of `stat` is the row count of the table (or index)
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+                rows = [int(row[0].split()[0]) for row in cursor.fetchall() if row[0]]
+            else:
+                return None
+    except DatabaseError:
+        # sqlite_stat1 only exists once ANALYZE has run
+        return None
+
+    # reltuples is -1 (or 0 on older versions) until the table has been analyzed
+    estimate = max(rows, default=0)
+    return estimate if estimate > 0 else None
+
+
+def explain_rows(queryset):
+    """Row count the Postgres planner expects `queryset` to return, or None"""
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def is_unfiltered(queryset):
+    query = queryset.query
+    return not query.where and not query.distinct and not query.is_sliced and not query.combinator
+
+
+def estimate_queryset_rows(queryset):
+    """Planner estimate of `queryset.count()`, or None when there isn't one"""
+    if is_unfiltered(queryset):
+        return estimate_table_rows(queryset.model, queryset.db)
+    return explain_rows(queryset)
+
+
+# endregion
+
+
+# region Time-boxed counts
+
+
+def _postgresql_timed_count(queryset, connection, timeout):
+    with transaction.atomic(using=queryset.db):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('statement_timeout')")
+            previous_timeout = cursor.fetchone()[0]
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", [str(int(timeout * 1000))])
+        try:
+            # the savepoint keeps a cancelled count from aborting the transaction
+            with transaction.atomic(using=queryset.db):
+                return queryset.count()
+        except OperationalError as e:
+            cause = e.__cause__
+            if (getattr(cause, "pgcode", None) or getattr(cause, "sqlstate", None)) != POSTGRES_QUERY_CANCELED:
+                raise
+            return None
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", [previous_timeout])
+
+
+def _sqlite_timed_count(queryset, connection, timeout):
+    connection.ensure_connection()
+    deadline = time.monotonic() + timeout
+
+    def interrupt():
+        # a non-zero return aborts the running statement
+        return time.monotonic() > deadline
+
+    connection.connection.set_progress_handler(interrupt, 10000)
+    try:
+        return queryset.count()
+    except OperationalError as e:
+        if "interrupted" not in str(e):
+            raise
+        return None
+    finally:
+        connection.connection.set_progress_handler(None, 10000)
+
+
+def timed_count(queryset, timeout=COUNT_TIMEOUT):
+    """`queryset.count()`, or None if it didn't finish within `timeout` seconds.
+
+    Backends other than Postgres and SQLite can't be interrupted and always
+    run the plain count.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        return _postgresql_timed_count(queryset, connection, timeout)
+    if connection.vendor == "sqlite":
+        return _sqlite_timed_count(queryset, connection, timeout)
+    return queryset.count()
+
+
+# endregion
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that doesn't `COUNT(*)` large querysets.
+
+    Querysets the planner expects to have at least `estimate_threshold` rows
+    use the estimate. Smaller ones are counted exactly, unless the count
+    takes longer than `count_timeout` seconds, in which case the estimate
+    (or `estimate_threshold` if there's none) is used after all.
+    `estimated` tells whether `count` is exact.
+
+    Set it as `paginator` of a `ModelAdmin`, together with
+    `show_full_result_count = False` so the unfiltered total isn't counted
+    either.
+    """
+
+    estimate_threshold = ESTIMATE_THRESHOLD
+    count_timeout = COUNT_TIMEOUT
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estimated = False
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+
+        estimate = estimate_queryset_rows(self.object_list)
+        if estimate is not None and estimate >= self.estimate_threshold:
+            self.estimated = True
+            return estimate
+
+        count = timed_count(self.object_list, self.count_timeout)
+        if count is None:
+            self.estimated = True
+            return estimate if estimate is not None else self.estimate_threshold
+        return count
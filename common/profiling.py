@@ -0,0 +1,135 @@
+"""
+Profile single requests on demand, in production too.
+
+A request from one of `INTERNAL_IPS` carrying `X-Profile: <PROFILE_TOKEN>`
+(or `?_profile=<PROFILE_TOKEN>`, any value when no token is set) runs under
+cProfile. The response gets:
+
+* `X-Profile-Top`: the functions the most time was spent in;
+* `X-Profile-File`: the name of the full profile, saved under `PROFILE_DIR`
+  (the newest `PROFILE_KEEP` are kept), to open with
+  `snakeviz <file>` or `python -m pstats <file>`.
+
+With `X-Profile-Output: text` (or `?_profile_output=text`) the response is
+replaced by the pstats report instead.
+
+Other requests only pay a header and a query string lookup. Behind a proxy
+REMOTE_ADDR is the proxy's, so set a `PROFILE_TOKEN` there.
+
+Under ASGI only the event loop thread is profiled: the time the view spends
+in `sync_to_async` threads shows up as one awaited call.
+"""
+import cProfile
+import hmac
+import io
+import pstats
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from .init_helpers import is_internal_ip
+from .middleware import BaseMiddleware, add_server_timing
+
+PROFILE_HEADER = "HTTP_X_PROFILE"
+PROFILE_OUTPUT_HEADER = "HTTP_X_PROFILE_OUTPUT"
+PROFILE_QUERY_PARAM = "_profile"
+PROFILE_OUTPUT_QUERY_PARAM = "_profile_output"
+PROFILE_DIR = Path(getattr(settings, "PROFILE_DIR", Path(settings.BASE_DIR, "logs", "profiles")))
+PROFILE_KEEP = getattr(settings, "PROFILE_KEEP", 100)
+PROFILE_TOKEN = getattr(settings, "PROFILE_TOKEN", "")
+PROFILE_TOP = 20  # functions in the text report
+PROFILE_HEADER_TOP = 5  # functions in the X-Profile-Top header
+
+
+def _function_name(function):
+    filename, line, name = function
+    if filename == "~":
+        # a builtin, e.g. "<method 'execute' of 'sqlite3.Cursor' objects>"
+        return name
+    return f"{Path(filename).name}:{line}({name})"
+
+
+def top_functions(stats, limit):
+    """`[(function, calls, own seconds, cumulative seconds)]` by own time, where
+    the time goes (cumulative times mostly show the middleware chain)"""
+    rows = [
+        (_function_name(function), calls, own, cumulative)
+        for function, (_, calls, own, cumulative, _) in stats.stats.items()
+    ]
+    return sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+
+
+def save_profile(profile, request, seconds):
+    """Dump the profile, drop the oldest ones beyond `PROFILE_KEEP`, return the file name"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", request.path).strip("_")[:80] or "root"
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{request.method}-{slug}-{seconds * 1000:.0f}ms.prof"
+    profile.dump_stats(PROFILE_DIR / name)
+
+    profiles = sorted(PROFILE_DIR.glob("*.prof"), key=lambda path: path.stat().st_mtime)
+    for path in profiles[:-PROFILE_KEEP]:
+        path.unlink(missing_ok=True)
+    return name
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Put it first in `MIDDLEWARE`, the other middleware are profiled too"""
+
+    def wants_profile(self, request):
+        token = request.META.get(PROFILE_HEADER)
+        if token is None:
+            if f"{PROFILE_QUERY_PARAM}=" not in request.META.get("QUERY_STRING", ""):
+                return False
+            token = request.GET.get(PROFILE_QUERY_PARAM, "")
+        if PROFILE_TOKEN and not hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()):
+            return False
+        return is_internal_ip(request, settings.INTERNAL_IPS)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.wants_profile(request):
+            return self.get_response(request)
+
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        response = profile.runcall(self.get_response, request)
+        return self.report(request, response, profile, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        if not self.wants_profile(request):
+            return await self.get_response(request)
+
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.disable()
+        return self.report(request, response, profile, time.perf_counter() - started)
+
+    def report(self, request, response, profile, seconds):
+        name = save_profile(profile, request, seconds)
+        stats = pstats.Stats(profile)
+        settings.LOGGER.info(f"Profiled {request.method} {request.path} in {seconds * 1000:.0f}ms: {name}")
+
+        output = request.META.get(PROFILE_OUTPUT_HEADER) or request.GET.get(PROFILE_OUTPUT_QUERY_PARAM)
+        if output == "text":
+            report = io.StringIO()
+            stats.stream = report
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP)
+            response = HttpResponse(report.getvalue(), content_type="text/plain; charset=utf-8")
+        else:
+            response["X-Profile-Top"] = "; ".join(
+                f"{function} {calls}x {own * 1000:.1f}ms"
+                for function, calls, own, _ in top_functions(stats, PROFILE_HEADER_TOP)
+            )
+
+        response["X-Profile-File"] = name
+        add_server_timing(response, f"profile;dur={seconds * 1000:.1f}")
+        return response
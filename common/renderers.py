@@ -0,0 +1,104 @@
+"""
+JSON renderer and parser for DRF on a faster encoder.
+
+`JSON_BACKEND` picks the encoder: "orjson" (the default when it's
+installed, encoding runs in C and builds the bytes directly) or "json"
+(the standard library, as fast as `JSONRenderer`, for when orjson isn't
+available). Both render the same bytes as DRF's `JSONRenderer` in its
+default settings (compact, UTF-8), except that orjson always writes
+non-ASCII characters unescaped and NaN as null. The types orjson doesn't
+serialize (and datetimes, whose format differs) go through DRF's
+`JSONEncoder`, data orjson can't encode at all (integers over 64 bits) is
+rendered with "json".
+
+Indented output (`Accept: application/json; indent=4`, the browsable API)
+is rendered by `JSONRenderer` itself.
+"""
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = getattr(settings, "JSON_BACKEND", "orjson" if orjson is not None else "json")
+# U+2028 and U+2029 are valid JSON but end a line in JavaScript, JSONRenderer escapes them
+LINE_SEPARATORS = ("\u2028".encode(), "\u2029".encode())
+
+_encoder = JSONEncoder(
+    ensure_ascii=not api_settings.UNICODE_JSON,
+    allow_nan=not api_settings.STRICT_JSON,
+    separators=(",", ":") if api_settings.COMPACT_JSON else (", ", ": "),
+)
+
+
+def _escape_line_separators(data):
+    # isascii() is much faster than searching, and true for most payloads
+    if not data.isascii() and (LINE_SEPARATORS[0] in data or LINE_SEPARATORS[1] in data):
+        data = data.replace(LINE_SEPARATORS[0], b"\\u2028").replace(LINE_SEPARATORS[1], b"\\u2029")
+    return data
+
+
+def _strict_constant(constant):
+    raise ValueError(f"{constant} is not valid JSON")
+
+
+def json_dumps(data):
+    return _escape_line_separators(_encoder.encode(data).encode())
+
+
+def json_loads(data):
+    return json.loads(data, parse_constant=_strict_constant)
+
+
+# name: (dumps to bytes, loads from bytes or str, decoding error)
+BACKENDS = {"json": (json_dumps, json_loads, ValueError)}
+
+if orjson is not None:
+    # DRF formats datetimes with milliseconds, and accepts dicts with int keys
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def orjson_dumps(data):
+        try:
+            encoded = orjson.dumps(data, default=_encoder.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            # e.g. integers over 64 bits, which the standard library encodes
+            return json_dumps(data)
+        return _escape_line_separators(encoded)
+
+    BACKENDS["orjson"] = (orjson_dumps, orjson.loads, orjson.JSONDecodeError)
+
+if JSON_BACKEND not in BACKENDS:
+    raise ImproperlyConfigured(f"JSON_BACKEND {JSON_BACKEND!r} isn't available, use one of {', '.join(BACKENDS)}")
+dumps, loads, DECODE_ERROR = BACKENDS[JSON_BACKEND]
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get("encoding", settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read()
+            if encoding.lower().replace("-", "") != "utf8":
+                data = data.decode(encoding)
+            return loads(data)
+        except (DECODE_ERROR, UnicodeDecodeError) as e:
+            raise ParseError(f"JSON parse error - {e}")
@@ -0,0 +1,742 @@
+"""
+Resource and admin helpers for the `import_export` integration.
+
+`generate_admin` builds every admin class on `StreamingExportMixin` and every
+nested resource on `BaseModelResource`, so large tables can be exported
+without building the whole dataset in memory, and imported in bulk when the
+resource's `Meta.use_bulk` is set.
+"""
+import csv
+import json
+import os
+import pickle
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy, deepcopy
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.exceptions import (
+    FieldDoesNotExist,
+    ImproperlyConfigured,
+    ObjectDoesNotExist,
+    PermissionDenied,
+    ValidationError,
+)
+from django.db import connections, transaction
+from django.db.models import QuerySet, prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from import_export import resources, widgets
+from import_export.forms import ExportForm
+from import_export.results import RowResult
+from import_export.signals import post_export
+from import_export.utils import atomic_if_using_transaction
+from tablib.formats._json import serialize_objects_handler
+
+EXPORT_CHUNK_SIZE = getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+IMPORT_WORKERS = getattr(settings, "IMPORT_WORKERS", min(4, os.cpu_count() or 1))
+STREAMING_BUFFER_SIZE = 64 * 1024  # 64KB per chunk sent to the client
+
+
+# region Encoders
+
+
+class Echo:
+    """File-like object whose `write` hands back the value instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(headers, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_json(headers, rows):
+    """The JSON tablib writes for the same dataset, one row at a time"""
+    yield "["
+    separator = ""
+    for row in rows:
+        yield separator + json.dumps(dict(zip(headers, row)), default=serialize_objects_handler, ensure_ascii=False)
+        separator = ", "
+    yield "]"
+
+
+STREAMING_ENCODERS = {
+    "csv": iter_csv,
+    "json": iter_json,
+}
+
+
+def buffered(chunks, buffer_size=STREAMING_BUFFER_SIZE):
+    """Join small string chunks so the response isn't flushed once per row"""
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+# endregion
+
+
+# region Bulk import
+
+
+def init_django_worker():
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def _clean_rows_in_worker(resource_class, first_number, rows):
+    return resource_class().clean_rows(first_number, rows)
+
+
+def report_import_progress(processed, total, rows_per_second):
+    settings.LOGGER.info(f"Imported {processed}/{total} rows ({rows_per_second:.0f} rows/sec)")
+
+
+# endregion
+
+
+class BaseModelResource(resources.ModelResource):
+    export_chunk_size = EXPORT_CHUNK_SIZE
+    import_workers = IMPORT_WORKERS
+
+    def _resolve_export_path(self, model, attribute):
+        """Return (select_related path, only path, prefetch path) for a field
+        attribute, or None if the attribute isn't a plain chain of fields"""
+        parts = attribute.split("__")
+        relations = []
+        for index, part in enumerate(parts):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return None
+
+            if field.many_to_many or field.one_to_many:
+                if index != len(parts) - 1:
+                    return None
+                return "__".join(relations), "", attribute
+            if not field.concrete:
+                return None
+
+            if field.is_relation:
+                relations.append(part)
+                model = field.related_model
+            elif index != len(parts) - 1:
+                return None
+
+        return "__".join(relations), attribute, ""
+
+    def optimize_export_queryset(self, queryset, fields):
+        """Add `select_related` for exported relations and restrict the selected
+        columns with `only` when every exported value comes from a concrete field.
+
+        Returns the queryset and the many-to-many paths to prefetch per chunk.
+        """
+        select_related = set()
+        only = set()
+        prefetch = set()
+        can_restrict_columns = True
+
+        for field in fields:
+            if getattr(self, "dehydrate_%s" % self.get_field_name(field), None) is not None:
+                can_restrict_columns = False
+                continue
+            if not field.attribute:
+                continue
+
+            path = self._resolve_export_path(queryset.model, field.attribute)
+            if path is None:
+                can_restrict_columns = False
+                continue
+
+            related_path, only_path, prefetch_path = path
+            if related_path:
+                select_related.add(related_path)
+            if only_path:
+                only.add(only_path)
+            if prefetch_path:
+                prefetch.add(prefetch_path)
+
+        if select_related:
+            queryset = queryset.select_related(*sorted(select_related))
+        if can_restrict_columns and only:
+            queryset = queryset.only(*sorted(only))
+        return queryset, sorted(prefetch)
+
+    def iter_chunked(self, queryset, prefetch):
+        """Read the queryset with `iterator`, prefetching relations one chunk at a time"""
+        chunk = []
+        for obj in queryset.iterator(chunk_size=self.export_chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= self.export_chunk_size:
+                prefetch_related_objects(chunk, *prefetch)
+                yield from chunk
+                chunk = []
+        if chunk:
+            prefetch_related_objects(chunk, *prefetch)
+            yield from chunk
+
+    def iter_export_rows(self, queryset=None):
+        """Yield exported rows one at a time, reading the queryset in chunks"""
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        fields = self.get_export_fields()
+        if isinstance(queryset, QuerySet) and not queryset._prefetch_related_lookups:
+            queryset, prefetch = self.optimize_export_queryset(queryset, fields)
+            objects = self.iter_chunked(queryset, prefetch)
+        else:
+            objects = self.iter_queryset(queryset)
+
+        for obj in objects:
+            yield self.export_resource(obj)
+
+    def iter_export(self, format_name, queryset=None, *args, **kwargs):
+        """Yield the encoded export in `format_name` ("csv" or "json").
+
+        `after_export` isn't called since there is no dataset to hand it.
+        """
+        encoder = STREAMING_ENCODERS[format_name]
+        self.before_export(queryset, *args, **kwargs)
+        return buffered(encoder(self.get_export_headers(), self.iter_export_rows(queryset)))
+
+    # region Bulk import
+
+    def _is_bulk_field(self, field):
+        return (
+            field.attribute
+            and "__" not in field.attribute
+            and not isinstance(field.widget, widgets.ManyToManyWidget)
+        )
+
+    def get_bulk_clean_fields(self):
+        """Import fields that can be cleaned without database lookups"""
+        return [
+            field
+            for field in self.get_import_fields()
+            if self._is_bulk_field(field) and not isinstance(field.widget, widgets.ForeignKeyWidget)
+        ]
+
+    def get_bulk_relation_fields(self):
+        """Import fields resolved with one query per batch in the main process"""
+        return [
+            field
+            for field in self.get_import_fields()
+            if self._is_bulk_field(field) and isinstance(field.widget, widgets.ForeignKeyWidget)
+        ]
+
+    def get_bulk_many_to_many_fields(self):
+        """Many-to-many import fields, which the bulk path can't write"""
+        return [
+            field
+            for field in self.get_import_fields()
+            if field.attribute and isinstance(field.widget, widgets.ManyToManyWidget)
+        ]
+
+    def get_bulk_write_fields(self):
+        """Model fields passed to `bulk_update`"""
+        opts = self._meta.model._meta
+        names = []
+        for field in self.get_bulk_clean_fields() + self.get_bulk_relation_fields():
+            try:
+                model_field = opts.get_field(field.attribute)
+            except FieldDoesNotExist:
+                continue
+            if model_field.concrete and not model_field.primary_key and model_field.name not in names:
+                names.append(model_field.name)
+
+        if "update_date" not in names and any(field.name == "update_date" for field in opts.concrete_fields):
+            names.append("update_date")
+        return names
+
+    def clean_rows(self, first_number, rows):
+        """Clean the plain (non relational) fields of a chunk of rows.
+
+        Runs in a worker process when `import_workers` is set, so it must not
+        touch the database. Returns (row number, cleaned values, errors) tuples.
+        """
+        fields = self.get_bulk_clean_fields()
+        cleaned = []
+        for number, row in enumerate(rows, first_number):
+            values = {}
+            errors = {}
+            for field in fields:
+                if field.column_name not in row:
+                    continue
+                try:
+                    values[field.attribute] = field.clean(row)
+                except Exception as e:
+                    errors[field.attribute] = str(e) or e.__class__.__name__
+            cleaned.append((number, values, errors))
+        return cleaned
+
+    def _iter_cleaned_chunks(self, rows, batch_size):
+        chunks = [(start + 1, rows[start : start + batch_size]) for start in range(0, len(rows), batch_size)]
+
+        workers = self.import_workers if len(chunks) > 1 else 0
+        if workers:
+            try:
+                pickle.dumps(type(self))
+            except (pickle.PicklingError, AttributeError, TypeError):
+                # e.g. resources built on the fly by `modelresource_factory`
+                workers = 0
+
+        if not workers:
+            for first_number, chunk in chunks:
+                yield chunk, self.clean_rows(first_number, chunk)
+            return
+
+        # spawned, not forked: a fork copies the locks held by the parent's other threads (server
+        # threads, write-behind flushes...) and its database connections, the workers start clean
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=get_context("spawn"), initializer=init_django_worker
+        ) as executor:
+            cleaned_chunks = executor.map(
+                _clean_rows_in_worker,
+                [type(self)] * len(chunks),
+                [first_number for first_number, chunk in chunks],
+                [chunk for first_number, chunk in chunks],
+            )
+            for (first_number, chunk), cleaned in zip(chunks, cleaned_chunks):
+                yield chunk, cleaned
+
+    def _resolve_relations(self, rows, cleaned):
+        for field in self.get_bulk_relation_fields():
+            widget = field.widget
+            rows_with_value = [
+                (row, values, errors)
+                for row, (number, values, errors) in zip(rows, cleaned)
+                if field.column_name in row
+            ]
+            custom_lookup = type(widget).get_queryset is not widgets.ForeignKeyWidget.get_queryset
+            if custom_lookup or "__" in widget.field:
+                # lookups that depend on the row are resolved one by one
+                for row, values, errors in rows_with_value:
+                    try:
+                        values[field.attribute] = field.clean(row)
+                    except ValueError as e:
+                        errors[field.attribute] = str(e)
+                    except ObjectDoesNotExist as e:
+                        # an error of the row, not a validation error, as in the stock import
+                        errors[field.attribute] = e
+                continue
+
+            lookup_values = {
+                row[field.column_name] for row, values, errors in rows_with_value if row[field.column_name]
+            }
+            related = {}
+            if lookup_values:
+                queryset = widget.get_queryset(None, None).filter(**{"%s__in" % widget.field: lookup_values})
+                related = {str(getattr(obj, widget.field)): obj for obj in queryset}
+
+            for row, values, errors in rows_with_value:
+                value = row[field.column_name]
+                if not value:
+                    values[field.attribute] = None
+                elif str(value) in related:
+                    values[field.attribute] = related[str(value)]
+                else:
+                    errors[field.attribute] = widget.model.DoesNotExist(
+                        "%s matching query does not exist." % widget.model._meta.object_name
+                    )
+
+    def _get_existing_instances(self, headers, cleaned, collect_diff):
+        """Fetch the existing instances of a batch with a single query.
+
+        Returns a function building the lookup key of a row's cleaned values
+        and the instances by key, or (None, {}) when every row is new.
+        """
+        id_fields = [self.fields[name] for name in self.get_import_id_fields()]
+        if self._meta.force_init_instance or any(field.column_name not in headers for field in id_fields):
+            return None, {}
+
+        opts = self._meta.model._meta
+        model_fields = [opts.get_field(field.attribute) for field in id_fields]
+
+        def get_key(values):
+            key = []
+            for field, model_field in zip(id_fields, model_fields):
+                value = values.get(field.attribute)
+                if model_field.is_relation and value is not None:
+                    value = value.pk
+                if value in (None, ""):
+                    return None
+                key.append(value)
+            return tuple(key)
+
+        keys = {key for key in (get_key(values) for number, values, errors in cleaned) if key is not None}
+        if not keys:
+            return get_key, {}
+
+        lookups = {
+            "%s__in" % model_field.name: {key[index] for key in keys} for index, model_field in enumerate(model_fields)
+        }
+        select_related = [
+            field.attribute for field in self.get_bulk_relation_fields() if opts.get_field(field.attribute).concrete
+        ]
+        queryset = self.get_queryset().filter(**lookups).select_related(*select_related)
+        if collect_diff:
+            many_to_many = [
+                field.attribute
+                for field in self.get_user_visible_fields()
+                if isinstance(field.widget, widgets.ManyToManyWidget) and field.attribute
+            ]
+            queryset = queryset.prefetch_related(*many_to_many)
+        existing = {}
+        for instance in queryset:
+            key = tuple(getattr(instance, model_field.attname) for model_field in model_fields)
+            if key in keys:
+                existing[key] = instance
+        return get_key, existing
+
+    def _invalid_row_result(self, result, number, row, validation_error, raise_errors, collect_failed_rows):
+        row_result = self.get_row_result_class()()
+        row_result.import_type = RowResult.IMPORT_TYPE_INVALID
+        row_result.validation_error = validation_error
+        result.append_invalid_row(number, row, validation_error)
+        if collect_failed_rows:
+            result.append_failed_row(row, validation_error)
+        if raise_errors:
+            raise validation_error
+        return row_result
+
+    def _error_row_result(self, result, row, error, raise_errors, collect_failed_rows):
+        row_result = self.get_row_result_class()()
+        row_result.import_type = RowResult.IMPORT_TYPE_ERROR
+        row_result.errors.append(self.get_error_result_class()(error, "", row))
+        if collect_failed_rows:
+            result.append_failed_row(row, row_result.errors[0])
+        if raise_errors:
+            raise error
+        return row_result
+
+    def validate_bulk_instance(self, instance, looked_up_fields):
+        """`validate_instance` of the bulk path, the uniqueness checks are left to the database.
+
+        The foreign keys of `looked_up_fields` that hold an object aren't checked
+        again, it was just read for the batch (`full_clean` runs a query per row)."""
+        if not self._meta.clean_model_instances:
+            return
+        exclude = [name for name in looked_up_fields if getattr(instance, name) is not None]
+        instance.full_clean(exclude=exclude, validate_unique=False)
+
+    def _bulk_import_batch(
+        self, headers, rows, cleaned, result, dry_run, collect_diff, raise_errors, collect_failed_rows
+    ):
+        self._resolve_relations(rows, cleaned)
+        opts = self._meta.model._meta
+        # `limit_choices_to` is only checked by `full_clean`
+        looked_up_fields = [
+            field.attribute
+            for field in self.get_bulk_relation_fields()
+            if opts.get_field(field.attribute).concrete and not opts.get_field(field.attribute).get_limit_choices_to()
+        ]
+        get_key, existing = self._get_existing_instances(headers, cleaned, collect_diff)
+
+        pending = []
+        new_instances = []
+        updated_instances = []
+        # key: instance written by an earlier row of the batch, later rows with the key update it
+        # (as they would one row at a time) instead of creating it twice
+        batch_instances = {}
+        for row, (number, values, errors) in zip(rows, cleaned):
+            lookup_error = next((e for e in errors.values() if isinstance(e, ObjectDoesNotExist)), None)
+            if lookup_error is not None:
+                row_result = self._error_row_result(result, row, lookup_error, raise_errors, collect_failed_rows)
+                pending.append((row_result, row, None, None))
+                continue
+            if errors:
+                validation_error = ValidationError({attribute: [error] for attribute, error in errors.items()})
+                row_result = self._invalid_row_result(
+                    result, number, row, validation_error, raise_errors, collect_failed_rows
+                )
+                pending.append((row_result, row, None, None))
+                continue
+
+            key = get_key(values) if get_key else None
+            repeated = key in batch_instances
+            instance = batch_instances.get(key, existing.get(key)) if key is not None else None
+            new = instance is None
+            if new:
+                instance = self.init_instance(row)
+
+            # a repeated key's instance is restored if the row turns out invalid
+            original = deepcopy(instance) if repeated or (not new and self._meta.skip_unchanged) else None
+            # the diff renders the current values right away, so no copy is needed for it
+            diff = self.get_diff_class()(self, None if new else instance, new) if collect_diff else None
+
+            for attribute, value in values.items():
+                setattr(instance, attribute, value)
+
+            row_result = self.get_row_result_class()()
+            row_result.new_record = new
+            if self._meta.skip_unchanged and original is not None and self.skip_row(instance, original):
+                row_result.import_type = RowResult.IMPORT_TYPE_SKIP
+            else:
+                try:
+                    self.validate_bulk_instance(instance, looked_up_fields)
+                except ValidationError as e:
+                    if repeated:
+                        vars(instance).update(vars(original))
+                    row_result = self._invalid_row_result(result, number, row, e, raise_errors, collect_failed_rows)
+                    pending.append((row_result, row, None, None))
+                    continue
+
+                if new:
+                    row_result.import_type = RowResult.IMPORT_TYPE_NEW
+                    new_instances.append(instance)
+                else:
+                    row_result.import_type = RowResult.IMPORT_TYPE_UPDATE
+                    if not repeated:
+                        updated_instances.append(instance)
+                if key is not None:
+                    batch_instances[key] = instance
+            pending.append((row_result, row, instance, diff))
+
+        if not dry_run and (new_instances or updated_instances):
+            manager = self._meta.model._default_manager.db_manager(self.get_db_connection_name())
+            write_fields = self.get_bulk_write_fields()
+            try:
+                with transaction.atomic(using=manager.db):
+                    if new_instances:
+                        manager.bulk_create(new_instances, batch_size=self._meta.batch_size)
+                    if updated_instances and write_fields:
+                        if "update_date" in write_fields:
+                            now = timezone.now()
+                            for instance in updated_instances:
+                                instance.update_date = now
+                        manager.bulk_update(updated_instances, write_fields, batch_size=self._meta.batch_size)
+            except Exception as e:
+                error = self.get_error_result_class()(e, traceback.format_exc())
+                result.append_base_error(error)
+                if raise_errors:
+                    raise
+                for row_result, row, instance, diff in pending:
+                    if row_result.import_type in (RowResult.IMPORT_TYPE_NEW, RowResult.IMPORT_TYPE_UPDATE):
+                        row_result.import_type = RowResult.IMPORT_TYPE_ERROR
+                        row_result.errors.append(self.get_error_result_class()(e, error.traceback, row))
+                        if collect_failed_rows:
+                            result.append_failed_row(row, row_result.errors[0])
+
+        for row_result, row, instance, diff in pending:
+            if instance is not None and row_result.import_type != RowResult.IMPORT_TYPE_ERROR:
+                row_result.add_instance_info(instance)
+                if diff is not None:
+                    diff.compare_with(self, instance, dry_run)
+                    if not self._meta.skip_html_diff:
+                        row_result.diff = diff.as_html()
+            result.increment_row_result_total(row_result)
+            if row_result.import_type != RowResult.IMPORT_TYPE_SKIP or self._meta.report_skipped:
+                result.append_row_result(row_result)
+
+    def bulk_import_data(
+        self,
+        dataset,
+        dry_run=False,
+        raise_errors=False,
+        use_transactions=None,
+        collect_failed_rows=False,
+        rollback_on_validation_errors=False,
+        progress=report_import_progress,
+        **kwargs,
+    ):
+        """Import `dataset` in batches of `Meta.batch_size` rows.
+
+        Plain fields are cleaned in a process pool of `import_workers`
+        processes, existing instances are fetched with one query per batch and
+        every batch is written with `bulk_create`/`bulk_update` in its own
+        savepoint. A dry run reports the same rows and diffs without writing.
+        `save()`/signal side effects are not applied. Resources with
+        many-to-many import fields, which need every instance saved first,
+        are imported one row at a time by `import_data` instead.
+        `progress(processed, total, rows_per_second)` is called after each batch.
+
+        As in `import_data`, with `use_transactions` (by default
+        `get_use_transactions()`) the whole import is one transaction, rolled
+        back on errors (or validation errors with `rollback_on_validation_errors`),
+        so a failing batch doesn't leave the earlier ones written.
+        """
+        if self.get_bulk_many_to_many_fields():
+            return self._import_data_per_row(
+                dataset,
+                dry_run=dry_run,
+                raise_errors=raise_errors,
+                use_transactions=use_transactions,
+                collect_failed_rows=collect_failed_rows,
+                rollback_on_validation_errors=rollback_on_validation_errors,
+                **kwargs,
+            )
+
+        if use_transactions is None:
+            use_transactions = self.get_use_transactions()
+        db_connection = self.get_db_connection_name()
+        supports_transactions = getattr(connections[db_connection].features, "supports_transactions", False)
+        if use_transactions and not supports_transactions:
+            raise ImproperlyConfigured
+        using_transactions = (use_transactions or dry_run) and supports_transactions
+
+        with atomic_if_using_transaction(using_transactions, using=db_connection):
+            result = self._bulk_import_data(dataset, dry_run, raise_errors, collect_failed_rows, progress, **kwargs)
+            if using_transactions and (
+                dry_run or result.has_errors() or (rollback_on_validation_errors and result.has_validation_errors())
+            ):
+                transaction.set_rollback(True, using=db_connection)
+        return result
+
+    def _import_data_per_row(self, dataset, **kwargs):
+        """The stock import, one row at a time: its own `use_bulk` mode skips
+        many-to-many fields as well, so it's turned off for this resource instance"""
+        own_meta = vars(self).get("_meta")
+        self._meta = copy(self._meta)
+        self._meta.use_bulk = False
+        try:
+            return super().import_data(dataset, **kwargs)
+        finally:
+            if own_meta is None:
+                del self._meta
+            else:
+                self._meta = own_meta
+
+    def _bulk_import_data(self, dataset, dry_run, raise_errors, collect_failed_rows, progress, **kwargs):
+        result = self.get_result_class()()
+        result.diff_headers = self.get_diff_headers()
+
+        try:
+            self.before_import(dataset, True, dry_run, **kwargs)
+        except Exception as e:
+            result.append_base_error(self.get_error_result_class()(e, traceback.format_exc()))
+            if raise_errors:
+                raise
+
+        rows = list(dataset.dict)
+        result.total_rows = len(rows)
+        result.rows_per_second = 0
+        if collect_failed_rows:
+            result.add_dataset_headers(dataset.headers)
+
+        collect_diff = dry_run and not self._meta.skip_diff
+        batch_size = self._meta.batch_size or len(rows) or 1
+        started = time.perf_counter()
+        processed = 0
+        for chunk, cleaned in self._iter_cleaned_chunks(rows, batch_size):
+            self._bulk_import_batch(
+                dataset.headers, chunk, cleaned, result, dry_run, collect_diff, raise_errors, collect_failed_rows
+            )
+            processed += len(chunk)
+            result.rows_per_second = processed / max(time.perf_counter() - started, 1e-6)
+            if progress:
+                progress(processed, len(rows), result.rows_per_second)
+
+        try:
+            self.after_import(dataset, result, True, dry_run, **kwargs)
+        except Exception as e:
+            result.append_base_error(self.get_error_result_class()(e, traceback.format_exc()))
+            if raise_errors:
+                raise
+
+        return result
+
+    def import_data(
+        self,
+        dataset,
+        dry_run=False,
+        raise_errors=False,
+        use_transactions=None,
+        collect_failed_rows=False,
+        rollback_on_validation_errors=False,
+        **kwargs,
+    ):
+        if not self._meta.use_bulk:
+            return super().import_data(
+                dataset,
+                dry_run=dry_run,
+                raise_errors=raise_errors,
+                use_transactions=use_transactions,
+                collect_failed_rows=collect_failed_rows,
+                rollback_on_validation_errors=rollback_on_validation_errors,
+                **kwargs,
+            )
+        return self.bulk_import_data(
+            dataset,
+            dry_run=dry_run,
+            raise_errors=raise_errors,
+            use_transactions=use_transactions,
+            collect_failed_rows=collect_failed_rows,
+            rollback_on_validation_errors=rollback_on_validation_errors,
+            **kwargs,
+        )
+
+    # endregion
+
+
+class StreamingExportMixin:
+    """Stream CSV/JSON exports from `BaseModelResource` resources.
+
+    Replaces `ExportMixin.export_action`, every other format or resource is
+    exported the stock way.
+    """
+
+    streaming_export_formats = tuple(STREAMING_ENCODERS)
+
+    def get_export_form(self):
+        return ExportForm
+
+    def get_streaming_export_response(self, request, file_format, queryset, *args, **kwargs):
+        resource_class = self.get_export_resource_class()
+        resource = resource_class(**self.get_export_resource_kwargs(request, *args, **kwargs))
+        return StreamingHttpResponse(
+            resource.iter_export(file_format.get_title(), queryset),
+            content_type=file_format.get_content_type(),
+        )
+
+    def export_action(self, request, *args, **kwargs):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+
+        formats = self.get_export_formats()
+        form = self.get_export_form()(formats, request.POST or None)
+        if form.is_valid():
+            file_format = formats[int(form.cleaned_data["file_format"])]()
+            queryset = self.get_export_queryset(request)
+
+            streaming = file_format.get_title() in self.streaming_export_formats and issubclass(
+                self.get_export_resource_class(), BaseModelResource
+            )
+            if streaming:
+                response = self.get_streaming_export_response(request, file_format, queryset, *args, **kwargs)
+            else:
+                export_data = self.get_export_data(file_format, queryset, request=request, encoding=self.to_encoding)
+                response = HttpResponse(export_data, content_type=file_format.get_content_type())
+            response["Content-Disposition"] = 'attachment; filename="%s"' % (
+                self.get_export_filename(request, queryset, file_format),
+            )
+
+            post_export.send(sender=None, model=self.model)
+            return response
+
+        context = self.get_export_context_data()
+        context.update(self.admin_site.each_context(request))
+        context["title"] = _("Export")
+        context["form"] = form
+        context["opts"] = self.model._meta
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, [self.export_template_name], context)
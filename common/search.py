@@ -0,0 +1,387 @@
+"""
+Indexed `search_fields` for the admin and DRF.
+
+Django runs every search field as `icontains`, a `LIKE '%term%'` that no
+B-tree index can serve: each search scans the table. The text fields
+searched by `IndexedSearchMixin` admins and `IndexedSearchFilter` API views
+get a trigram index instead, which keeps the substring semantics:
+
+* Postgres: a `pg_trgm` GIN index on `UPPER(column::text)`, the expression
+  Django's `icontains` (and `istartswith`, `iexact`) filters on, so the
+  planner uses it for the unchanged queries;
+* SQLite: an FTS5 table with the `trigram` tokenizer (SQLite 3.34+) over
+  the model's indexed columns, kept in sync by triggers, which the search
+  then queries with `MATCH` instead of `LIKE`.
+
+Indexes are created after `migrate` (and by `manage.py search_index`) for
+the fields of the registered admins and of the API views found in the
+URLconf (views need a `queryset` attribute to be found, or
+`register_search_fields` can be called directly). Search fields across
+relations (`user__username`) index the related model's table. Terms
+shorter than 3 characters, other lookups (`^name`, `=name`...) and
+missing indexes fall back to the normal search.
+"""
+import operator
+from functools import reduce
+
+from django.conf import settings
+from django.contrib.admin.utils import lookup_spawns_duplicates
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DatabaseError, connections, models, router
+from django.db.backends.utils import truncate_name
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import RawSQL
+from django.utils.text import smart_split, unescape_string_literal
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+# search field prefixes of the admin and DRF, e.g. "^name" runs `name__istartswith`
+LOOKUP_PREFIXES = {"^": "istartswith", "=": "iexact", "@": "search", "$": "iregex"}
+INDEXED_LOOKUP = "icontains"
+INDEXED_FIELDS = (models.CharField, models.TextField)
+TRIGRAM_LENGTH = 3  # shorter terms can't be looked up in a trigram index
+SQLITE_TRIGRAM_VERSION = (3, 34, 0)
+
+# model: names of its fields to index
+SEARCH_INDEXES = {}
+# (database alias, model): (schema version, columns of its SQLite search table)
+_sqlite_indexed_columns = {}
+
+
+# region Search fields
+
+
+def construct_search(model, field_name):
+    """ORM lookup of a search field, as the admin and `SearchFilter` build it"""
+    lookup = LOOKUP_PREFIXES.get(field_name[:1])
+    if lookup:
+        return f"{field_name[1:]}{LOOKUP_SEP}{lookup}"
+
+    opts = model._meta
+    previous_field = None
+    for part in field_name.split(LOOKUP_SEP):
+        if part == "pk":
+            part = opts.pk.name
+        try:
+            field = opts.get_field(part)
+        except FieldDoesNotExist:
+            # the field name ends with a lookup
+            if previous_field and previous_field.get_lookup(part):
+                return field_name
+        else:
+            previous_field = field
+            if hasattr(field, "get_path_info"):
+                opts = field.get_path_info()[-1].to_opts
+    return f"{field_name}{LOOKUP_SEP}{INDEXED_LOOKUP}"
+
+
+def resolve_indexed_lookup(model, orm_lookup):
+    """`(relation prefix, model, field)` of an `icontains` lookup of a text field
+    (e.g. `("user__", User, username)` for "user__username__icontains"), or None"""
+    path, _, lookup = orm_lookup.rpartition(LOOKUP_SEP)
+    if lookup != INDEXED_LOOKUP or not path:
+        return None
+    *relations, name = path.split(LOOKUP_SEP)
+    try:
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+            if model is None:
+                return None
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    if not isinstance(field, INDEXED_FIELDS) or field.model is not model:
+        # inherited fields live in the parent's table
+        return None
+    prefix = "".join(f"{relation}{LOOKUP_SEP}" for relation in relations)
+    return prefix, model, field
+
+
+def register_search_fields(model, search_fields):
+    """Index the text fields `search_fields` (of `model`) search with `icontains`"""
+    for search_field in search_fields:
+        resolved = resolve_indexed_lookup(model, construct_search(model, str(search_field)))
+        if resolved is not None:
+            _, field_model, field = resolved
+            SEARCH_INDEXES.setdefault(field_model, set()).add(field.name)
+
+
+def register_api_search_fields(urlconf=None):
+    """Register the `search_fields` of the API views in the URLconf that search
+    with `IndexedSearchFilter`"""
+    from django.urls import URLPattern, URLResolver, get_resolver
+
+    def views(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from views(pattern.url_patterns)
+            elif isinstance(pattern, URLPattern):
+                yield getattr(pattern.callback, "cls", None)
+
+    for view in set(views(get_resolver(urlconf).url_patterns)):
+        backends = getattr(view, "filter_backends", None) or api_settings.DEFAULT_FILTER_BACKENDS
+        queryset = getattr(view, "queryset", None)
+        if not any(isinstance(backend, type) and issubclass(backend, IndexedSearchFilter) for backend in backends):
+            continue
+        if queryset is not None and getattr(view, "search_fields", None):
+            register_search_fields(queryset.model, view.search_fields)
+
+
+# endregion
+
+
+# region Indexes
+
+
+def _index_name(connection, table, suffix):
+    return truncate_name(f"{table}_{suffix}", connection.ops.max_name_length())
+
+
+def _sqlite_search_table(connection, model):
+    return _index_name(connection, model._meta.db_table, "search")
+
+
+def _postgresql_create_index(connection, model, field_names):
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    # without a transaction, the table isn't locked while the index is built
+    concurrently = "" if connection.in_atomic_block else "CONCURRENTLY "
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for field_name in sorted(field_names):
+            column = model._meta.get_field(field_name).column
+            index_name = quote(_index_name(connection, table, f"{column}_trgm"))
+            # a failed or interrupted concurrent build leaves an invalid index, which IF NOT EXISTS would keep
+            cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", [index_name])
+            row = cursor.fetchone()
+            if row is not None and not row[0]:
+                cursor.execute(f"DROP INDEX {concurrently}{index_name}")
+            cursor.execute(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS {index_name} "
+                f"ON {quote(table)} USING gin ((UPPER({quote(column)}::text)) gin_trgm_ops)"
+            )
+
+
+def _postgresql_drop_index(connection, model, field_names):
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for field_name in sorted(field_names):
+            column = model._meta.get_field(field_name).column
+            index_name = _index_name(connection, model._meta.db_table, f"{column}_trgm")
+            cursor.execute(f"DROP INDEX IF EXISTS {quote(index_name)}")
+
+
+def _sqlite_table_columns(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA table_info({connection.ops.quote_name(table)})")
+        return [row[1] for row in cursor.fetchall()]
+
+
+def _sqlite_triggers(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [table])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _sqlite_drop_index(connection, model, field_names=None):
+    quote = connection.ops.quote_name
+    search_table = _sqlite_search_table(connection, model)
+    with connection.cursor() as cursor:
+        for trigger in ("insert", "update", "delete"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {quote(f'{search_table}_{trigger}')}")
+        cursor.execute(f"DROP TABLE IF EXISTS {quote(search_table)}")
+    _sqlite_indexed_columns.pop((connection.alias, model), None)
+
+
+def _sqlite_create_index(connection, model, field_names):
+    """An external content FTS5 table: it only stores the index, the text stays in the model's table"""
+    pk = model._meta.pk
+    if not isinstance(pk, models.IntegerField):
+        raise DatabaseError(f"{model.__name__}: FTS5 tables need an integer primary key")
+    if connection.Database.sqlite_version_info < SQLITE_TRIGRAM_VERSION:
+        raise DatabaseError(f"SQLite {connection.Database.sqlite_version} has no trigram tokenizer (3.34+)")
+
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    search_table = _sqlite_search_table(connection, model)
+    columns = [model._meta.get_field(field_name).column for field_name in sorted(field_names)]
+    triggers = {f"{search_table}_{trigger}" for trigger in ("insert", "update", "delete")}
+    # SQLite's schema editor rebuilds a table to alter it, which drops its triggers but not the index
+    if _sqlite_table_columns(connection, search_table) == columns and triggers <= _sqlite_triggers(connection, table):
+        return
+    _sqlite_drop_index(connection, model)
+
+    column_list = ", ".join(quote(column) for column in columns)
+    new_values = ", ".join(f"new.{quote(column)}" for column in columns)
+    old_values = ", ".join(f"old.{quote(column)}" for column in columns)
+    delete_old = (
+        f"INSERT INTO {quote(search_table)} ({quote(search_table)}, rowid, {column_list}) "
+        f"VALUES ('delete', old.{quote(pk.column)}, {old_values});"
+    )
+    insert_new = (
+        f"INSERT INTO {quote(search_table)} (rowid, {column_list}) VALUES (new.{quote(pk.column)}, {new_values});"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {quote(search_table)} USING fts5({column_list}, "
+            f"content={quote(table)}, content_rowid={quote(pk.column)}, tokenize='trigram')"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {quote(f'{search_table}_insert')} AFTER INSERT ON {quote(table)} BEGIN {insert_new} END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {quote(f'{search_table}_update')} "
+            f"AFTER UPDATE OF {quote(pk.column)}, {column_list} ON {quote(table)} BEGIN {delete_old} {insert_new} END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {quote(f'{search_table}_delete')} AFTER DELETE ON {quote(table)} BEGIN {delete_old} END"
+        )
+        # index the existing rows
+        cursor.execute(f"INSERT INTO {quote(search_table)} ({quote(search_table)}) VALUES ('rebuild')")
+    _sqlite_indexed_columns.pop((connection.alias, model), None)
+
+
+def create_search_index(model, field_names, using="default"):
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        _postgresql_create_index(connection, model, field_names)
+    elif connection.vendor == "sqlite":
+        _sqlite_create_index(connection, model, field_names)
+
+
+def drop_search_index(model, field_names, using="default"):
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        _postgresql_drop_index(connection, model, field_names)
+    elif connection.vendor == "sqlite":
+        _sqlite_drop_index(connection, model, field_names)
+
+
+def ensure_search_indexes(using="default", rebuild=False):
+    """Create (or with `rebuild` recreate) the search index of every registered
+    model, returning `[(model, field names, error or None)]`"""
+    register_api_search_fields()
+    results = []
+    for model, field_names in SEARCH_INDEXES.items():
+        if not router.allow_migrate_model(using, model):
+            continue
+        try:
+            if rebuild:
+                drop_search_index(model, field_names, using)
+            create_search_index(model, field_names, using)
+        except DatabaseError as e:
+            results.append((model, field_names, e))
+        else:
+            results.append((model, field_names, None))
+    return results
+
+
+def create_search_indexes(sender, using="default", **kwargs):
+    """`post_migrate` receiver, a missing index only makes searches slower"""
+    for model, field_names, error in ensure_search_indexes(using):
+        if error is not None:
+            settings.LOGGER.warning(f"No search index on {model.__name__} ({', '.join(sorted(field_names))}): {error}")
+
+
+# endregion
+
+
+# region Searching
+
+
+def _sqlite_schema_version(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA schema_version")
+        return cursor.fetchone()[0]
+
+
+def sqlite_indexed_columns(model, using):
+    """Columns of `model`'s SQLite search table (empty without one or without
+    its triggers), looked up again once the schema changed in any process"""
+    connection = connections[using]
+    key = (using, model)
+    schema_version = _sqlite_schema_version(connection)
+    cached = _sqlite_indexed_columns.get(key)
+    if cached is None or cached[0] != schema_version:
+        search_table = _sqlite_search_table(connection, model)
+        columns = set(_sqlite_table_columns(connection, search_table))
+        triggers = {f"{search_table}_{trigger}" for trigger in ("insert", "update", "delete")}
+        if not triggers <= _sqlite_triggers(connection, model._meta.db_table):
+            # no longer kept in sync with the table
+            columns = set()
+        cached = _sqlite_indexed_columns[key] = (schema_version, columns)
+    return cached[1]
+
+
+def _fts_match(columns, term):
+    """FTS5 query of `term` as a substring of one of `columns`"""
+    phrase = '"' + term.replace('"', '""') + '"'
+    return "{" + " ".join(columns) + "} : " + phrase
+
+
+def search_condition(queryset, orm_lookups, term):
+    """The Q of one search term: `orm_lookups` ORed, the ones on a SQLite
+    search table replaced by a `MATCH` of the table"""
+    connection = connections[queryset.db]
+    if connection.vendor != "sqlite" or len(term) < TRIGRAM_LENGTH:
+        # the Postgres indexes serve the lookups as they are
+        return reduce(operator.or_, (models.Q(**{orm_lookup: term}) for orm_lookup in orm_lookups))
+
+    conditions = []
+    matched = {}  # (prefix, model): columns
+    for orm_lookup in orm_lookups:
+        resolved = resolve_indexed_lookup(queryset.model, orm_lookup)
+        if resolved is not None:
+            prefix, model, field = resolved
+            if field.column in sqlite_indexed_columns(model, queryset.db):
+                matched.setdefault((prefix, model), []).append(field.column)
+                continue
+        conditions.append(models.Q(**{orm_lookup: term}))
+
+    for (prefix, model), columns in matched.items():
+        search_table = connection.ops.quote_name(_sqlite_search_table(connection, model))
+        rows = RawSQL(f"SELECT rowid FROM {search_table} WHERE {search_table} MATCH %s", [_fts_match(columns, term)])
+        conditions.append(models.Q(**{f"{prefix}pk__in": rows}))
+    return reduce(operator.or_, conditions)
+
+
+class IndexedSearchMixin:
+    """`ModelAdmin` mixin searching its `search_fields` through their search index"""
+
+    def __init__(self, model, admin_site):
+        super().__init__(model, admin_site)
+        register_search_fields(model, self.search_fields)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_fields = self.get_search_fields(request)
+        if not search_fields or not search_term:
+            return queryset, False
+
+        orm_lookups = [construct_search(queryset.model, str(search_field)) for search_field in search_fields]
+        for term in smart_split(search_term):
+            if term.startswith(('"', "'")) and term[0] == term[-1]:
+                term = unescape_string_literal(term)
+            queryset = queryset.filter(search_condition(queryset, orm_lookups, term))
+        may_have_duplicates = any(lookup_spawns_duplicates(self.opts, orm_lookup) for orm_lookup in orm_lookups)
+        return queryset, may_have_duplicates
+
+
+class IndexedSearchFilter(filters.SearchFilter):
+    """`SearchFilter` searching the view's `search_fields` through their search index"""
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        orm_lookups = [self.construct_search(str(search_field), queryset) for search_field in search_fields]
+        base = queryset
+        conditions = [search_condition(queryset, orm_lookups, term) for term in search_terms]
+        queryset = queryset.filter(reduce(operator.and_, conditions))
+        if self.must_call_distinct(queryset, search_fields):
+            queryset = base.filter(models.Exists(queryset.filter(pk=models.OuterRef("pk"))))
+        return queryset
+
+
+# endregion
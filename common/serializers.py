@@ -0,0 +1,259 @@
+"""
+Read-only serializers that skip model instances and per-field objects.
+
+A DRF `ModelSerializer` builds a model instance per row, then calls the
+`to_representation` of every field on it. `ValuesSerializer` reads the
+columns with `values_list()` and converts the rows with a function compiled
+once per serializer class: one list comprehension building the dicts, with
+only the columns that need it (dates, decimals, files...) going through a
+conversion. The output is the same as `ModelSerializer`'s for the same
+fields.
+
+    class APIKeyReadSerializer(ValuesSerializer):
+        class Meta:
+            model = APIKey
+            fields = ("id", "name", "user", "username", "create_date")
+            # output name -> lookup, following relations through joins
+            sources = {"username": "user__username"}
+
+Fields are model fields (foreign keys give the related pk) or lookups in
+`sources`, there's no `SerializerMethodField` or nesting. Querysets are
+read with `values_list()`, lists of model instances, of dicts from
+`values()` and of tuples in column order are accepted too. In list views,
+`ValuesListMixin` makes the paginated page a `values_list()` slice as well.
+"""
+import datetime
+import operator
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import timezone
+from django.utils.encoding import is_protected_type
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+# DRF fields whose `to_representation` returns a database value unchanged
+UNCHANGED_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.FloatField,
+    serializers.IntegerField,
+    serializers.JSONField,
+    serializers.ReadOnlyField,
+)
+
+
+# region Conversions
+
+
+def _datetime(value, tz):
+    """`serializers.DateTimeField` in ISO 8601, `tz` is the current timezone (None without USE_TZ)"""
+    if tz is not None:
+        value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+    elif timezone.is_aware(value):
+        value = timezone.make_naive(value, datetime.timezone.utc)
+    value = value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def _file(value, storage, absolute_uri):
+    """`serializers.FileField`, `value` is a file name or a `FieldFile`"""
+    if not value:
+        return None
+    name = getattr(value, "name", value)
+    if not api_settings.UPLOADED_FILES_USE_URL:
+        return name
+    url = storage.url(name)
+    return absolute_uri(url) if absolute_uri is not None else url
+
+
+def _model_value(value, model_field):
+    """`serializers.ModelField` (e.g. of a `BinaryField`), which needs an object to read the value from"""
+    if is_protected_type(value):
+        return value
+    return model_field.value_to_string(SimpleNamespace(**{model_field.attname: value}))
+
+
+# endregion
+
+
+# region Compilation
+
+
+def _model_field(model, lookup):
+    """`(model field, nullable)` at the end of `lookup`, which may follow relations"""
+    *relations, name = lookup.split(LOOKUP_SEP)
+    nullable = False
+    for relation in relations:
+        field = model._meta.get_field(relation)
+        if not field.is_relation or field.many_to_many or field.one_to_many:
+            raise ImproperlyConfigured(f"{lookup}: {relation} isn't a foreign key of {model.__name__}")
+        nullable = nullable or field.null
+        model = field.related_model
+    field = model._meta.get_field(name)
+    if not field.concrete or field.many_to_many:
+        raise ImproperlyConfigured(f"{lookup}: {name} isn't a column of {model.__name__}")
+    return field, nullable or field.null
+
+
+def _instance_path(model, lookup):
+    """Attribute path of `lookup` on a model instance, foreign keys at the end give their pk"""
+    *relations, name = lookup.split(LOOKUP_SEP)
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return ".".join([*relations, model._meta.get_field(name).attname])
+
+
+def _conversion(name, model_field, variable):
+    """Expression converting `variable` the way `ModelSerializer` would, and the names it needs"""
+    if model_field.is_relation:
+        # `values_list()` already gives the related pk, as `PrimaryKeyRelatedField` does
+        return variable, {}
+    field_class, field_kwargs = serializers.ModelSerializer().build_standard_field(name, model_field)
+    field = field_class(**field_kwargs)
+    if isinstance(field, serializers.FileField):
+        return f"_file({variable}, storage_{variable}, absolute_uri)", {f"storage_{variable}": model_field.storage}
+    if isinstance(field, serializers.ModelField):
+        return f"_model_value({variable}, model_field_{variable})", {f"model_field_{variable}": model_field}
+    if isinstance(field, UNCHANGED_FIELDS):
+        return variable, {}
+    if isinstance(field, serializers.DateTimeField) and api_settings.DATETIME_FORMAT == ISO_8601:
+        return f"_datetime({variable}, tz)", {}
+    if isinstance(field, serializers.DateField) and api_settings.DATE_FORMAT == ISO_8601:
+        return f"{variable}.isoformat()", {}
+    if isinstance(field, serializers.TimeField) and api_settings.TIME_FORMAT == ISO_8601:
+        return f"{variable}.isoformat()", {}
+    # decimals, durations, UUIDs, other formats...
+    return f"field_{variable}({variable})", {f"field_{variable}": field.to_representation}
+
+
+class CompiledSerializer:
+    """The columns of a `ValuesSerializer` and its row conversion function"""
+
+    def __init__(self, model, fields, sources):
+        self.model = model
+        self.fields = tuple(fields)
+        self.columns = tuple(sources.get(name, name) for name in self.fields)
+        self.convert_rows = self.compile()
+        self.get_instance_row = operator.attrgetter(*(_instance_path(model, column) for column in self.columns))
+        self.get_dict_row = operator.itemgetter(*self.columns)
+
+    def compile(self):
+        namespace = {"_datetime": _datetime, "_file": _file, "_model_value": _model_value}
+        variables = [f"c{index}" for index in range(len(self.columns))]
+        items = []
+        for name, column, variable in zip(self.fields, self.columns, variables):
+            try:
+                model_field, nullable = _model_field(self.model, column)
+            except FieldDoesNotExist as e:
+                raise ImproperlyConfigured(f"{self.model.__name__} has no field {column}") from e
+            expression, names = _conversion(name, model_field, variable)
+            if expression != variable and nullable:
+                # a serializer field isn't called for None either
+                expression = f"None if {variable} is None else {expression}"
+            items.append(f"{name!r}: {expression}")
+            namespace.update(names)
+
+        # e.g. [{'id': c0, 'create_date': _datetime(c1, tz)} for c0, c1 in rows]
+        source = (
+            "def convert_rows(rows, tz, absolute_uri):\n"
+            f"    return [{{{', '.join(items)}}} for {', '.join(variables)}, in rows]\n"
+        )
+        exec(compile(source, f"<{self.model.__name__} serializer>", "exec"), namespace)
+        return namespace["convert_rows"]
+
+    def rows(self, data):
+        """The column values of `data` as tuples"""
+        if isinstance(data, models.Manager):
+            data = data.all()
+        if isinstance(data, models.QuerySet):
+            return values_queryset(data, self.columns)
+
+        data = list(data)
+        if not data or isinstance(data[0], tuple):
+            return data
+        getter = self.get_dict_row if isinstance(data[0], dict) else self.get_instance_row
+        if len(self.columns) == 1:
+            return [(getter(item),) for item in data]
+        return [getter(item) for item in data]
+
+
+def all_fields(model):
+    """The concrete fields in `ModelSerializer`'s "__all__" order: pk, columns, foreign keys.
+    "__all__" would include the many-to-many fields as well, which aren't columns."""
+    many_to_many = [field.name for field in model._meta.many_to_many]
+    if many_to_many:
+        raise ImproperlyConfigured(
+            f'"__all__" includes the many-to-many fields of {model.__name__} ({", ".join(many_to_many)}), '
+            "which a ValuesSerializer can't read: list Meta.fields instead"
+        )
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    return [
+        model._meta.pk.name,
+        *(field.name for field in fields if not field.is_relation),
+        *(field.name for field in fields if field.is_relation),
+    ]
+
+
+def values_queryset(queryset, columns):
+    # prefetches would run against the tuples
+    return queryset.prefetch_related(None).values_list(*columns)
+
+
+# endregion
+
+
+class ValuesListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        return self.child.convert(data)
+
+
+class ValuesSerializer(serializers.BaseSerializer):
+    """Read-only serializer of `Meta.fields` (or "__all__" concrete fields, for
+    models without many-to-many fields) of `Meta.model`, see the module documentation"""
+
+    @classmethod
+    def compiled(cls):
+        # per class, a subclass doesn't share its parent's fields
+        if "_compiled" not in cls.__dict__:
+            meta = cls.Meta
+            fields = meta.fields
+            if fields == serializers.ALL_FIELDS:
+                fields = all_fields(meta.model)
+            cls._compiled = CompiledSerializer(meta.model, fields, getattr(meta, "sources", {}))
+        return cls._compiled
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        child = cls(context=kwargs.get("context", {}))
+        return ValuesListSerializer(*args, child=child, **kwargs)
+
+    @classmethod
+    def values_queryset(cls, queryset):
+        """`queryset` reading only the serialized columns, as tuples"""
+        return values_queryset(queryset, cls.compiled().columns)
+
+    def convert(self, data):
+        """Representations of the rows of `data`"""
+        compiled = self.compiled()
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        request = self.context.get("request")
+        absolute_uri = request.build_absolute_uri if request is not None else None
+        return compiled.convert_rows(compiled.rows(data), tz, absolute_uri)
+
+    def to_representation(self, instance):
+        return self.convert([instance])[0]
+
+
+class ValuesListMixin:
+    """For list views (`ListAPIView`, `ModelViewSet`...) of a `ValuesSerializer`:
+    the paginated page is read with `values_list()` too, not as model instances"""
+
+    def paginate_queryset(self, queryset):
+        return super().paginate_queryset(self.get_serializer_class().values_queryset(queryset))
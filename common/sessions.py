@@ -0,0 +1,176 @@
+"""
+Cache session engine with write-behind database persistence.
+
+    SESSION_ENGINE = "common.sessions"
+
+Sessions live in the `SESSION_CACHE_ALIAS` cache. With
+`SESSION_PERSIST_TO_DB` they are also written to `django_session`, in
+batches from a background thread, and read back from there when the cache
+lost them. Saves that would only refresh the expiry (`SESSION_SAVE_EVERY_REQUEST`)
+are skipped if the session was written less than `SESSION_TOUCH_INTERVAL`
+seconds ago, so an idle session expires between `SESSION_COOKIE_AGE` minus
+that interval and `SESSION_COOKIE_AGE` after its last request. While the
+cache is failing, sessions are written to the database right away instead.
+
+Expired rows are deleted in batches by `python manage.py prune_sessions`
+(or Django's `clearsessions`).
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .write_behind import WriteBehindBuffer
+
+KEY_PREFIX = "common.sessions"
+PERSIST_TO_DB = getattr(settings, "SESSION_PERSIST_TO_DB", True)
+TOUCH_INTERVAL = getattr(settings, "SESSION_TOUCH_INTERVAL", 300)  # seconds
+PRUNE_BATCH_SIZE = 1000
+
+
+def write_sessions(pending):
+    """Apply buffered session saves, `{session_key: (session_data, expire_date)}`"""
+    sessions = [
+        Session(session_key=session_key, session_data=session_data, expire_date=expire_date)
+        for session_key, (session_data, expire_date) in pending.items()
+    ]
+    with transaction.atomic():
+        existing = set(
+            Session.objects.filter(session_key__in=[session.session_key for session in sessions]).values_list(
+                "session_key", flat=True
+            )
+        )
+        Session.objects.bulk_update(
+            [session for session in sessions if session.session_key in existing],
+            ["session_data", "expire_date"],
+        )
+        Session.objects.bulk_create(
+            [session for session in sessions if session.session_key not in existing],
+            ignore_conflicts=True,
+        )
+
+
+session_writes = WriteBehindBuffer(write_sessions, "session")
+
+
+def prune_expired_sessions(batch_size=PRUNE_BATCH_SIZE, sleep=0):
+    """Delete expired `django_session` rows `batch_size` at a time, yielding
+    the number deleted per batch, so no long transaction or big list is held"""
+    while True:
+        expired = Session.objects.filter(expire_date__lt=timezone.now()).values_list("session_key", flat=True)
+        session_keys = list(expired[:batch_size])
+        if not session_keys:
+            return
+        deleted, _ = Session.objects.filter(session_key__in=session_keys).delete()
+        yield deleted
+        if sleep:
+            time.sleep(sleep)
+
+
+class SessionStore(DBStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._cache = caches[settings.SESSION_CACHE_ALIAS]
+        # when the cached entry was last written, to coalesce touches
+        self._touched = None
+        super().__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return self.cache_key_prefix + self._get_or_create_session_key()
+
+    def load(self):
+        try:
+            entry = self._cache.get(self.cache_key)
+        except Exception:
+            # the cache being down shouldn't take the site with it
+            settings.LOGGER.exception("Could not read the session from the cache")
+            entry = None
+        if entry is not None:
+            self._touched = entry["touched"]
+            return entry["data"]
+
+        session = self._get_session_from_db() if PERSIST_TO_DB else None
+        if session is None:
+            self._session_key = None
+            return {}
+
+        data = self.decode(session.session_data)
+        self._touched = time.time()
+        try:
+            self._cache.set(
+                self.cache_key,
+                {"data": data, "touched": self._touched},
+                self.get_expiry_age(expiry=session.expire_date),
+            )
+        except Exception:
+            settings.LOGGER.exception("Could not write the session to the cache")
+        return data
+
+    def exists(self, session_key):
+        try:
+            if self.cache_key_prefix + session_key in self._cache:
+                return True
+        except Exception:
+            settings.LOGGER.exception("Could not read the session from the cache")
+        return PERSIST_TO_DB and super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+        now = time.time()
+        if not must_create and not self.modified and self._touched and now - self._touched < TOUCH_INTERVAL:
+            # only the expiry would move, and it was refreshed recently enough
+            return
+
+        entry = {"data": data, "touched": now}
+        try:
+            if must_create:
+                created = self._cache.add(self.cache_key, entry, self.get_expiry_age())
+            else:
+                self._cache.set(self.cache_key, entry, self.get_expiry_age())
+        except Exception:
+            settings.LOGGER.exception("Could not write the session to the cache")
+            if PERSIST_TO_DB:
+                # written through instead of buffered, the database is all `load()` can read it from
+                session_writes.discard(self.session_key)
+                if must_create:
+                    # raises CreateError when the key is taken
+                    super().save(must_create=True)
+                else:
+                    write_sessions({self.session_key: (self.encode(data), self.get_expiry_date())})
+            return
+        if must_create and not created:
+            raise CreateError
+        self._touched = now
+
+        if PERSIST_TO_DB:
+            session_writes.add(self.session_key, (self.encode(data), self.get_expiry_date()))
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        try:
+            self._cache.delete(self.cache_key_prefix + session_key)
+        except Exception:
+            settings.LOGGER.exception("Could not delete the session from the cache")
+        if PERSIST_TO_DB:
+            # not buffered: a logout must not leave the row to be read back by `load()`
+            # in the meantime, nor a pending touch to be inserted again after it
+            session_writes.discard(session_key)
+            Session.objects.filter(session_key=session_key).delete()
+
+    @classmethod
+    def clear_expired(cls):
+        for _ in prune_expired_sessions():
+            pass
@@ -0,0 +1,197 @@
+"""
+Serve the collected static files before Django's middleware stack runs.
+
+`StaticFilesWSGI`/`StaticFilesASGI` wrap the project's application (see
+`base_django_app/wsgi.py` and `asgi.py`). The files under `STATIC_ROOT` are
+stat'ed once, when the wrapper is created, into an in-memory index, so a
+static request costs a dict lookup and a `sendfile` instead of a view. Run
+`collectstatic` before starting (or restarting) the server.
+
+Files whose name has a content hash (as listed in the manifest of
+`common.storage.CompressedManifestStaticFilesStorage`) are sent as immutable,
+other ones are cached for `STATIC_MAX_AGE` seconds. When the client accepts
+gzip, the precompressed `<name>.gz` written by `collectstatic` is sent instead.
+"""
+import json
+import mimetypes
+import os
+from collections import namedtuple
+from http import HTTPStatus
+from urllib.parse import urlparse
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.utils.http import http_date
+
+from .middleware import in_thread
+
+BLOCK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_MAX_AGE = getattr(settings, "STATIC_MAX_AGE", 60)  # seconds, for files without a hash in their name
+MANIFEST_NAME = "staticfiles.json"
+
+StaticFile = namedtuple("StaticFile", ["path", "size", "etag"])
+StaticEntry = namedtuple("StaticEntry", ["content_type", "last_modified", "cache_control", "plain", "gzip"])
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an `Accept-Encoding` header allows gzip (`gzip;q=0` doesn't)"""
+    for coding in accept_encoding.lower().split(","):
+        name, _, params = coding.partition(";")
+        if name.strip() not in ("gzip", "*"):
+            continue
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def _stat(path, suffix=""):
+    stat = os.stat(path)
+    return StaticFile(path, stat.st_size, f'"{stat.st_size:x}-{int(stat.st_mtime):x}{suffix}"'), stat.st_mtime
+
+
+class StaticFilesIndex:
+    def __init__(self, root, url):
+        self.root = str(root)
+        self.prefix = "/" + urlparse(url).path.strip("/") + "/"
+        self.files = self.build()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(settings.STATIC_ROOT, settings.STATIC_URL)
+
+    def hashed_names(self):
+        try:
+            with open(os.path.join(self.root, MANIFEST_NAME)) as manifest:
+                return set(json.load(manifest).get("paths", {}).values())
+        except (OSError, ValueError):
+            return set()
+
+    def build(self):
+        """`{url path: StaticEntry}` of every file under the root"""
+        if not os.path.isdir(self.root):
+            settings.LOGGER.warning(f"STATIC_ROOT {self.root} doesn't exist, run collectstatic")
+            return {}
+
+        names = set()
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                names.add(os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, "/"))
+
+        hashed_names = self.hashed_names()
+        files = {}
+        for name in names:
+            if name.endswith(".gz") and name[:-3] in names:
+                continue  # precompressed variant
+            plain, mtime = _stat(os.path.join(self.root, name))
+            gzip = _stat(os.path.join(self.root, f"{name}.gz"), "-gz")[0] if f"{name}.gz" in names else None
+
+            content_type, encoding = mimetypes.guess_type(name)
+            if encoding is not None or content_type is None:
+                # e.g. a .tar.gz, sent as is
+                content_type = "application/octet-stream"
+            elif content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+                content_type += "; charset=utf-8"
+            cache_control = IMMUTABLE_CACHE_CONTROL if name in hashed_names else f"public, max-age={STATIC_MAX_AGE}"
+            files[self.prefix + name] = StaticEntry(content_type, http_date(mtime), cache_control, plain, gzip)
+        return files
+
+    def get_response(self, method, path, accept_encoding, if_none_match):
+        """`(status, headers, StaticFile to send or None)`, or None when
+        it isn't a static file and Django should handle the request"""
+        if method not in ("GET", "HEAD"):
+            return None
+        entry = self.files.get(path)
+        if entry is None:
+            return None
+
+        file = entry.gzip if entry.gzip is not None and accepts_gzip(accept_encoding) else entry.plain
+        headers = [
+            ("Cache-Control", entry.cache_control),
+            ("ETag", file.etag),
+            ("Last-Modified", entry.last_modified),
+        ]
+        if entry.gzip is not None:
+            headers.append(("Vary", "Accept-Encoding"))
+
+        if if_none_match and (if_none_match.strip() == "*" or file.etag in if_none_match):
+            return HTTPStatus.NOT_MODIFIED, headers, None
+
+        headers += [("Content-Type", entry.content_type), ("Content-Length", str(file.size))]
+        if file is entry.gzip:
+            headers.append(("Content-Encoding", "gzip"))
+        return HTTPStatus.OK, headers, file
+
+
+class StaticFilesWSGI:
+    def __init__(self, application, index=None):
+        self.application = application
+        self.index = index or StaticFilesIndex.from_settings()
+
+    def __call__(self, environ, start_response):
+        method = environ["REQUEST_METHOD"]
+        # PEP 3333 paths are bytes decoded as latin-1
+        path = environ.get("PATH_INFO", "").encode("latin-1").decode("utf-8", "replace")
+        response = self.index.get_response(
+            method, path, environ.get("HTTP_ACCEPT_ENCODING", ""), environ.get("HTTP_IF_NONE_MATCH")
+        )
+        if response is None:
+            return self.application(environ, start_response)
+
+        status, headers, file = response
+        start_response(f"{status.value} {status.phrase}", headers)
+        if file is None or method == "HEAD":
+            return []
+        # the server's wrapper, e.g. gunicorn's, uses sendfile()
+        file_wrapper = environ.get("wsgi.file_wrapper", FileWrapper)
+        return file_wrapper(open(file.path, "rb"), BLOCK_SIZE)
+
+
+class StaticFilesASGI:
+    def __init__(self, application, index=None):
+        self.application = application
+        self.index = index or StaticFilesIndex.from_settings()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            request_headers = {
+                name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]
+            }
+            response = self.index.get_response(
+                scope["method"],
+                scope["path"],
+                request_headers.get("accept-encoding", ""),
+                request_headers.get("if-none-match"),
+            )
+            if response is not None:
+                await self.send_file(scope["method"], send, *response)
+                return
+        await self.application(scope, receive, send)
+
+    async def send_file(self, method, send, status, headers, file):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status.value,
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            }
+        )
+        if file is None or method == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        f = await in_thread(open)(file.path, "rb")
+        try:
+            while True:
+                chunk = await in_thread(f.read)(BLOCK_SIZE)
+                more_body = len(chunk) == BLOCK_SIZE
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                if not more_body:
+                    break
+        finally:
+            f.close()
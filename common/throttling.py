@@ -0,0 +1,264 @@
+"""
+Sliding window rate limiting, for DRF views and as a middleware.
+
+Each key keeps O(1) state: the request count of the current fixed window and
+of the previous one. The number of requests in the sliding window is
+estimated as `previous * (1 - elapsed) + current`, `elapsed` being the
+fraction of the current window already gone.
+
+The state lives in Redis when `CACHE_ENABLED` (updated by a Lua script, so
+it's atomic across workers) and in a lock protected dict of the process
+otherwise. Everything is a no-op unless `ENABLE_THROTTLING`.
+"""
+import math
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+from .middleware import BaseMiddleware, in_thread
+
+THROTTLE_KEY_PREFIX = "throttle"
+LOCAL_STORE_MAX_KEYS = 100000
+
+Hit = namedtuple("Hit", ["allowed", "count", "retry_after"])
+
+
+def parse_rate(rate):
+    """"100/min" -> (100, 60), like DRF's rates"""
+    if rate is None:
+        return None, None
+    num, period = rate.split("/")
+    return int(num), {"s": 1, "m": 60, "h": 3600, "d": 86400}[period[0]]
+
+
+def sliding_window(previous, current, elapsed, limit, window):
+    """Return `(allowed, estimated count, seconds to wait if not allowed)`"""
+    estimated = previous * (1 - elapsed) + current
+    if estimated < limit:
+        return True, estimated + 1, 0
+    if current < limit:
+        # the previous window's share shrinks as the window slides
+        return False, estimated, (1 - (limit - current) / previous - elapsed) * window
+    # nothing frees up before the next window, where `current` becomes `previous`
+    return False, estimated, (2 - elapsed - limit / current) * window
+
+
+# region Stores
+
+
+class LocalStore:
+    """Per process store, for when there's no shared cache"""
+
+    # only holds a lock for a few operations, fine to call from the event loop
+    blocking = False
+
+    def __init__(self, max_keys=LOCAL_STORE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window):
+        now = time.time()
+        current_window = int(now // window)
+        elapsed = now / window - current_window
+        with self._lock:
+            window_id, current, previous, _ = self._windows.get(key, (current_window, 0, 0, None))
+            if window_id != current_window:
+                previous = current if window_id == current_window - 1 else 0
+                current = 0
+
+            allowed, count, retry_after = sliding_window(previous, current, elapsed, limit, window)
+            if allowed:
+                current += 1
+            if key not in self._windows and len(self._windows) >= self.max_keys:
+                self._purge(now)
+            # the state is useless once both windows are over
+            self._windows[key] = (current_window, current, previous, now + 2 * window)
+        return Hit(allowed, count, retry_after)
+
+    def _purge(self, now):
+        expired = [key for key, (_, _, _, expires) in self._windows.items() if expires < now]
+        for key in expired:
+            del self._windows[key]
+        while len(self._windows) >= self.max_keys:
+            self._windows.pop(next(iter(self._windows)))
+
+
+class RedisStore:
+    """Store shared by every worker, the whole update runs in one Lua script"""
+
+    blocking = True
+
+    SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local current_window = math.floor(now / window)
+local state = redis.call('HMGET', KEYS[1], 'w', 'c', 'p')
+local window_id = tonumber(state[1])
+local current = tonumber(state[2]) or 0
+local previous = tonumber(state[3]) or 0
+if window_id ~= current_window then
+    if window_id == current_window - 1 then
+        previous = current
+    else
+        previous = 0
+    end
+    current = 0
+end
+local elapsed = now / window - current_window
+local allowed = 0
+if previous * (1 - elapsed) + current < limit then
+    allowed = 1
+    current = current + 1
+    redis.call('HSET', KEYS[1], 'w', current_window, 'c', current, 'p', previous)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(window * 2000))
+end
+return {allowed, current, previous, tostring(elapsed)}
+"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._script = None
+
+    def hit(self, key, limit, window):
+        if self._script is None:
+            self._script = self.cache._cache.get_client(write=True).register_script(self.SCRIPT)
+        allowed, current, previous, elapsed = self._script(keys=[self.cache.make_key(key)], args=[limit, window])
+        if allowed:
+            return Hit(True, previous * (1 - float(elapsed)) + current, 0)
+        _, count, retry_after = sliding_window(previous, current, float(elapsed), limit, window)
+        return Hit(False, count, retry_after)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                uses_redis = hasattr(cache, "_cache") and hasattr(cache._cache, "get_client")
+                if getattr(settings, "CACHE_ENABLED", False) and uses_redis:
+                    _store = RedisStore(cache)
+                else:
+                    _store = LocalStore()
+    return _store
+
+
+def hit(key, limit, window):
+    """Count a request for `key`, allowing at most `limit` per `window` seconds"""
+    return get_store().hit(f"{THROTTLE_KEY_PREFIX}:{key}", limit, window)
+
+
+# endregion
+
+
+# region DRF
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """`SimpleRateThrottle` (same scopes and `DEFAULT_THROTTLE_RATES`) on the
+    sliding window store instead of a cached timestamp list"""
+
+    def allow_request(self, request, view):
+        if not getattr(settings, "ENABLE_THROTTLING", True) or self.rate is None:
+            return True
+
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        self.result = hit(key, self.num_requests, self.duration)
+        return self.result.allowed
+
+    def wait(self):
+        return math.ceil(self.result.retry_after)
+
+
+class AnonRateThrottle(SlidingWindowRateThrottle):
+    """Anonymous requests, by IP"""
+
+    scope = "anon"
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return None
+        return self.cache_format % {"scope": self.scope, "ident": self.get_ident(request)}
+
+
+class UserRateThrottle(SlidingWindowRateThrottle):
+    """Authenticated requests by user, anonymous ones by IP"""
+
+    scope = "user"
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+
+class IPRateThrottle(SlidingWindowRateThrottle):
+    """Every request, by IP"""
+
+    scope = "ip"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {"scope": self.scope, "ident": self.get_ident(request)}
+
+
+# endregion
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """Limit every request to `THROTTLE_RATE` per client IP.
+
+    It runs before authentication, so it's a coarse guard against abusive
+    clients; finer per user/API key limits are the DRF throttles'.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.num_requests, self.duration = parse_rate(getattr(settings, "THROTTLE_RATE", None))
+        self.exempt_paths = tuple(getattr(settings, "THROTTLE_EXEMPT_PATHS", ()))
+        # `get_ident` honours `NUM_PROXIES` when reading X-Forwarded-For
+        self.ident = BaseThrottle()
+
+    def get_key(self, request):
+        enabled = getattr(settings, "ENABLE_THROTTLING", True)
+        if not enabled or self.num_requests is None or request.path.startswith(self.exempt_paths):
+            return None
+        return f"ip_{self.ident.get_ident(request)}"
+
+    def throttled(self, result):
+        if result.allowed:
+            return None
+        response = HttpResponse("Request was throttled.", status=429, content_type="text/plain")
+        response["Retry-After"] = str(math.ceil(result.retry_after))
+        return response
+
+    def process_request(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return self.throttled(hit(key, self.num_requests, self.duration))
+
+    async def aprocess_request(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        if get_store().blocking:
+            result = await in_thread(hit)(key, self.num_requests, self.duration)
+        else:
+            result = hit(key, self.num_requests, self.duration)
+        return self.throttled(result)
@@ -0,0 +1,68 @@
+"""
+Warm a freshly started process up before it serves traffic.
+
+Called by the gunicorn hooks of `gunicorn.conf.py`: in the master after
+`preload_app` (so the work is shared copy-on-write by every worker) and in
+each worker after the fork.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+WARM_UP_TEMPLATES = (
+    "admin/base_site.html",
+    "admin/index.html",
+    "admin/login.html",
+    "admin/change_list.html",
+    "admin/change_form.html",
+)
+
+
+def warm_up_code(templates=WARM_UP_TEMPLATES):
+    """Populate the process wide, connection free caches"""
+    # reverse() and resolve() build these on first use
+    resolver = get_resolver()
+    resolver.reverse_dict
+    resolver.app_dict
+
+    for template_name in getattr(settings, "WARM_UP_TEMPLATES", templates):
+        try:
+            get_template(template_name)
+        except TemplateDoesNotExist:
+            pass
+
+    # DRF imports its renderers, parsers and authentication classes lazily
+    from rest_framework.settings import api_settings
+
+    for name in (
+        "DEFAULT_RENDERER_CLASSES",
+        "DEFAULT_PARSER_CLASSES",
+        "DEFAULT_AUTHENTICATION_CLASSES",
+        "DEFAULT_PERMISSION_CLASSES",
+        "DEFAULT_THROTTLE_CLASSES",
+    ):
+        getattr(api_settings, name)
+
+
+def close_connections():
+    """Close the database and cache connections, so a fork doesn't share their sockets"""
+    connections.close_all()
+    for cache in caches.all(initialized_only=True):
+        cache.close()
+
+
+def open_connections():
+    """Connect to every database and cache up front, failures are only logged"""
+    for connection in connections.all():
+        try:
+            connection.ensure_connection()
+        except Exception:
+            settings.LOGGER.exception(f"Could not connect to database {connection.alias!r}")
+    for cache in caches.all():
+        try:
+            cache.get("warm-up")
+        except Exception:
+            settings.LOGGER.exception("Could not reach the cache")
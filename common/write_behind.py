@@ -0,0 +1,107 @@
+"""
+Coalesced, batched writes from a background thread.
+
+Hot paths (session touches, "last used" timestamps...) add their writes to a
+`WriteBehindBuffer` keyed by the row they update. Only the latest value per
+key is kept and the buffer is flushed as one batch every `interval` seconds,
+when `max_size` keys are pending, and at interpreter exit.
+"""
+import atexit
+import os
+import threading
+import weakref
+
+from django.conf import settings
+from django.db import close_old_connections
+
+WRITE_BEHIND_INTERVAL = getattr(settings, "WRITE_BEHIND_INTERVAL", 2)  # seconds, 0 writes inline
+WRITE_BEHIND_MAX_SIZE = 1000
+
+BUFFERS = weakref.WeakSet()
+
+
+def flush_all():
+    """Flush every buffer of the process, e.g. from a server's worker exit hook"""
+    for buffer in list(BUFFERS):
+        buffer.flush()
+
+
+class WriteBehindBuffer:
+    def __init__(self, flush, name, interval=None, max_size=WRITE_BEHIND_MAX_SIZE):
+        """`flush` receives a `{key: value}` dict of the pending writes"""
+        self._flush = flush
+        self.name = name
+        self.interval = WRITE_BEHIND_INTERVAL if interval is None else interval
+        self.max_size = max_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        # held for a whole flush, so `discard()` can wait for the batch being written
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        BUFFERS.add(self)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, key, value):
+        if self.interval <= 0:
+            self._write({key: value})
+            return
+
+        self._ensure_started()
+        with self._lock:
+            self._pending[key] = value
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._wakeup.set()
+
+    def discard(self, key):
+        """Drop the pending write of `key`. Returns once a flush in progress is
+        done, so a write made after this isn't overwritten by an older one."""
+        with self._flush_lock, self._lock:
+            self._pending.pop(key, None)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if pending and not self._write(pending):
+                with self._lock:
+                    # keep the failed writes for the next flush, unless superseded meanwhile
+                    for key, value in pending.items():
+                        self._pending.setdefault(key, value)
+
+    def _write(self, pending):
+        try:
+            self._flush(pending)
+        except Exception:
+            settings.LOGGER.exception(f"Write-behind flush of {len(pending)} {self.name} write(s) failed")
+            return False
+        return True
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # forked: the parent flushes what it had buffered
+                self._pending = {}
+            else:
+                atexit.register(self.flush)
+            self._thread = threading.Thread(target=self._run, name=f"write-behind-{self.name}", daemon=True)
+            self._thread.start()
+            self._pid = pid
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            # this thread keeps its connection, drop it once it's unusable or too old
+            close_old_connections()
+            self.flush()
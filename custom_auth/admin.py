@@ -1,3 +1,27 @@
 from django.contrib import admin
+from django.utils.translation import gettext_lazy as _
+
+from common.search import IndexedSearchMixin
+
+from .models import APIKey
+
 
 # Register your models here.
+@admin.register(APIKey)
+class APIKeyAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ("name", "prefix", "user", "is_active", "expires_at", "last_used", "create_date")
+    list_filter = ("is_active",)
+    list_select_related = ("user",)
+    search_fields = ("name", "prefix", "user__username")
+    raw_id_fields = ("user",)
+    readonly_fields = ("prefix", "last_used")
+    actions = ["revoke"]
+
+    def has_add_permission(self, request):
+        # the raw key is only shown once, keys are created with `manage.py create_api_key`
+        return False
+
+    @admin.action(description=_("Revoke selected API keys"))
+    def revoke(self, request, queryset):
+        for api_key in queryset.filter(is_active=True):
+            api_key.revoke()
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CustomAuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'custom_auth'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if getattr(settings, "COALESCE_LAST_LOGIN", False):
+            from .last_login import install
+
+            install()
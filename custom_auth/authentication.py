@@ -0,0 +1,150 @@
+"""
+API key authentication for DRF.
+
+Clients send `X-API-Key: <prefix>.<secret>`. The key is looked up by its
+(unique, indexed) prefix and its SHA-256 hash compared in constant time.
+Successful verifications (the key's and its user's ids, not the objects)
+are kept in a per process cache for `API_KEY_CACHE_TTL` seconds (0 disables
+it), so repeated calls with the same key don't hit the database. Revoking,
+changing or deleting a key bumps a generation number in the default cache,
+which empties every process' cache on their next request. That takes a
+cache shared between the processes: with the local memory cache the others
+would keep accepting a revoked key, so the settings only enable it with
+CACHE_ENABLED. The user is loaded per request through `CachedModelBackend`,
+so changes to it apply as they do to session users.
+"""
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+
+from common.write_behind import WriteBehindBuffer
+
+from .backends import CachedModelBackend
+from .models import APIKey, hash_api_key
+
+API_KEY_HEADER = "HTTP_X_API_KEY"
+API_KEY_CACHE_TTL = getattr(settings, "API_KEY_CACHE_TTL", 0)  # seconds
+API_KEY_CACHE_SIZE = 10000
+GENERATION_CACHE_KEY = "custom_auth:api_keys:generation"
+
+
+def get_generation():
+    return cache.get(GENERATION_CACHE_KEY, 0)
+
+
+def bump_generation():
+    """Invalidate the verified keys cached by every process"""
+    cache.add(GENERATION_CACHE_KEY, 0, None)
+    try:
+        cache.incr(GENERATION_CACHE_KEY)
+    except ValueError:
+        # evicted in between
+        cache.set(GENERATION_CACHE_KEY, 1, None)
+
+
+def write_last_used(pending):
+    APIKey.objects.bulk_update(
+        [APIKey(pk=api_key_id, last_used=last_used) for api_key_id, last_used in pending.items()],
+        ["last_used"],
+    )
+
+
+last_used_writes = WriteBehindBuffer(write_last_used, "API key last_used")
+
+
+class VerifiedKeys:
+    """Per process cache of verified keys, `(key id, user id, expiry)` by key hash"""
+
+    def __init__(self, ttl=API_KEY_CACHE_TTL, max_size=API_KEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.generation = None
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, hashed_key, generation):
+        with self._lock:
+            if generation != self.generation:
+                self._keys.clear()
+                self.generation = generation
+                return None
+            entry = self._keys.get(hashed_key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, hashed_key, verified, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            if len(self._keys) >= self.max_size:
+                # drop the oldest entry, dicts keep insertion order
+                self._keys.pop(next(iter(self._keys)))
+            self._keys[hashed_key] = (time.monotonic() + self.ttl, verified)
+
+
+verified_keys = VerifiedKeys()
+
+
+class APIKeyAuthentication(authentication.BaseAuthentication):
+    www_authenticate_realm = "api"
+
+    def authenticate(self, request):
+        raw_key = request.META.get(API_KEY_HEADER)
+        if not raw_key:
+            return None
+
+        hashed_key = hash_api_key(raw_key)
+        if verified_keys.ttl:
+            api_key = self.verify_cached(raw_key, hashed_key)
+        else:
+            api_key = self.verify(raw_key, hashed_key)
+
+        last_used_writes.add(api_key.pk, timezone.now())
+        return api_key.user, api_key
+
+    def verify_cached(self, raw_key, hashed_key):
+        generation = get_generation()
+        verified = verified_keys.get(hashed_key, generation)
+        if verified is not None:
+            return self.get_verified_key(*verified)
+        api_key = self.verify(raw_key, hashed_key)
+        verified_keys.set(hashed_key, (api_key.pk, api_key.user_id, api_key.expires_at), generation)
+        return api_key
+
+    def get_verified_key(self, api_key_id, user_id, expires_at):
+        """The key of a cached verification, with its user loaded for this request"""
+        # the other fields are deferred, read from the database if used
+        api_key = APIKey.from_db(APIKey.objects.db, ["id", "user_id", "expires_at"], [api_key_id, user_id, expires_at])
+        if api_key.is_expired:
+            raise exceptions.AuthenticationFailed(_("API key expired."))
+        user = CachedModelBackend().get_user(user_id)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        api_key.user = user
+        return api_key
+
+    def verify(self, raw_key, hashed_key):
+        prefix, separator, _secret = raw_key.partition(".")
+        if not separator:
+            raise exceptions.AuthenticationFailed(_("Invalid API key."))
+
+        api_key = APIKey.objects.select_related("user").filter(prefix=prefix, is_active=True).first()
+        # compared even without a key, so timing doesn't tell whether the prefix exists
+        expected = api_key.hashed_key if api_key is not None else hash_api_key("")
+        if not hmac.compare_digest(hashed_key, expected) or api_key is None:
+            raise exceptions.AuthenticationFailed(_("Invalid API key."))
+        if api_key.is_expired:
+            raise exceptions.AuthenticationFailed(_("API key expired."))
+        if not api_key.user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        return api_key
+
+    def authenticate_header(self, request):
+        return f'X-API-Key realm="{self.www_authenticate_realm}"'
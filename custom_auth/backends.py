@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+
+USER_CACHE_KEY = "custom_auth:user:{}"
+PERMISSION_CACHE_KEY = "custom_auth:perms:{}:{}"
+PERMISSION_SOURCES = ("user", "group")
+
+
+def get_user_cache_key(user_id):
+    return USER_CACHE_KEY.format(user_id)
+
+
+def invalidate_cached_user(user_id):
+    cache.delete(get_user_cache_key(user_id))
+
+
+def get_permission_cache_key(user_id, from_name):
+    return PERMISSION_CACHE_KEY.format(user_id, from_name)
+
+
+def invalidate_cached_permissions(user_ids, from_names=PERMISSION_SOURCES):
+    keys = [get_permission_cache_key(user_id, from_name) for user_id in user_ids for from_name in from_names]
+    if keys:
+        cache.delete_many(keys)
+
+
+def users_with_perm(perm, is_active=True, include_superusers=True):
+    """Users having `perm` ("app_label.codename" or a `Permission`) directly or
+    through a group, as a single query with one EXISTS per source"""
+    if isinstance(perm, Permission):
+        permissions = Permission.objects.filter(pk=perm.pk)
+    elif isinstance(perm, str):
+        try:
+            app_label, codename = perm.split(".")
+        except ValueError:
+            raise ValueError("Permission name should be in the form app_label.permission_codename.")
+        permissions = Permission.objects.filter(codename=codename, content_type__app_label=app_label)
+    else:
+        raise TypeError("The `perm` argument must be a string or a permission instance.")
+
+    User = get_user_model()
+    user_permissions = User.user_permissions.through.objects.filter(
+        user_id=OuterRef("pk"),
+        permission__in=permissions,
+    )
+    group_permissions = Group.permissions.through.objects.filter(
+        group__in=User.groups.through.objects.filter(user_id=OuterRef(OuterRef("pk"))).values("group_id"),
+        permission__in=permissions,
+    )
+    user_q = Q(Exists(user_permissions)) | Q(Exists(group_permissions))
+    if include_superusers:
+        user_q |= Q(is_superuser=True)
+    if is_active is not None:
+        user_q &= Q(is_active=is_active)
+    return User._default_manager.filter(user_q)
+
+
+class CachedModelBackend(ModelBackend):
+    """`ModelBackend` that serves `request.user` and its permissions from the cache.
+
+    Users are cached for `USER_CACHE_TTL` seconds (0 disables the cache) and
+    dropped on save, delete and logout, see `custom_auth.signals`. The cached
+    user still carries its password hash, so `django.contrib.auth.get_user`
+    keeps verifying the session auth hash and a password change still ends
+    the other sessions. Writes that skip `save()` (`QuerySet.update`) are
+    picked up when the entry expires.
+
+    The user and group permission sets of non superusers are cached for
+    `PERMISSION_CACHE_TTL` seconds and dropped whenever the user, its groups,
+    its permissions or its groups' permissions change.
+    """
+
+    def get_user(self, user_id):
+        ttl = getattr(settings, "USER_CACHE_TTL", 0)
+        if not ttl:
+            return super().get_user(user_id)
+
+        key = get_user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, ttl)
+        elif not self.user_can_authenticate(user):
+            return None
+        return user
+
+    def _can_cache_permissions(self, user_obj, obj):
+        return (
+            getattr(settings, "PERMISSION_CACHE_TTL", 0)
+            and obj is None
+            and user_obj.is_active
+            and not user_obj.is_anonymous
+            and not user_obj.is_superuser
+        )
+
+    def _get_permissions(self, user_obj, obj, from_name):
+        perm_cache_name = "_%s_perm_cache" % from_name
+        if not self._can_cache_permissions(user_obj, obj) or hasattr(user_obj, perm_cache_name):
+            return super()._get_permissions(user_obj, obj, from_name)
+
+        key = get_permission_cache_key(user_obj.pk, from_name)
+        perms = cache.get(key)
+        if perms is None:
+            perms = super()._get_permissions(user_obj, obj, from_name)
+            cache.set(key, perms, settings.PERMISSION_CACHE_TTL)
+        else:
+            setattr(user_obj, perm_cache_name, perms)
+        return perms
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if self._can_cache_permissions(user_obj, obj) and not hasattr(user_obj, "_perm_cache"):
+            # both sources in one round trip
+            keys = {get_permission_cache_key(user_obj.pk, from_name): from_name for from_name in PERMISSION_SOURCES}
+            for key, perms in cache.get_many(keys).items():
+                setattr(user_obj, "_%s_perm_cache" % keys[key], perms)
+        return super().get_all_permissions(user_obj, obj)
+
+    def with_perm(self, perm, is_active=True, include_superusers=True, obj=None):
+        if obj is not None:
+            return get_user_model()._default_manager.none()
+        return users_with_perm(perm, is_active=is_active, include_superusers=include_superusers)
@@ -0,0 +1,321 @@
+import io
+import secrets
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.urls import path, reverse
+from django.utils import timezone
+from rest_framework import generics, permissions, serializers
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from common.benchmarking import int_list, latency_stats, register
+from common.search import ensure_search_indexes
+from common import renderers
+from common.serializers import ValuesListMixin, ValuesSerializer
+
+from .admin import APIKeyAdmin
+from .backends import invalidate_cached_user
+from .models import APIKey
+
+BACKENDS = (
+    "django.contrib.auth.backends.ModelBackend",
+    "custom_auth.backends.CachedModelBackend",
+)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _view(request):
+    return HttpResponse(str(request.user.pk))
+
+
+@register("auth_request")
+def auth_request(username="", requests="1000", ttl="300"):
+    """Queries and latency of resolving `request.user` with and without the user cache"""
+    User = get_user_model()
+    users = User.objects.order_by("pk")
+    user = users.filter(username=username).first() if username else users.first()
+    if user is None:
+        yield {"skipped": "no user"}
+        return
+
+    factory = RequestFactory()
+    handler = SessionMiddleware(AuthenticationMiddleware(_view))
+    with override_settings(AUTHENTICATION_BACKENDS=list(BACKENDS), USER_CACHE_TTL=int(ttl)):
+        for backend in BACKENDS:
+            invalidate_cached_user(user.pk)
+            session = SessionMiddleware(_view).SessionStore()
+            session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+            session[BACKEND_SESSION_KEY] = backend
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+
+            request_count = int(requests)
+            queries = QueryCounter()
+            with connection.execute_wrapper(queries):
+                started = time.perf_counter()
+                for _ in range(request_count):
+                    request = factory.get("/")
+                    request.COOKIES[settings.SESSION_COOKIE_NAME] = session.session_key
+                    response = handler(request)
+                    assert response.content == str(user.pk).encode()
+                seconds = time.perf_counter() - started
+
+            session.delete()
+            yield {
+                "backend": backend.rsplit(".", 1)[-1],
+                "requests": request_count,
+                "queries_per_request": round(queries.count / request_count, 2),
+                "ms_per_request": round(seconds * 1000 / request_count, 3),
+            }
+
+
+@contextmanager
+def _benchmark_user(**extra_fields):
+    """A user for the benchmark, deleted with its API keys afterwards"""
+    user = get_user_model().objects.create_user(f"benchmark-{secrets.token_hex(4)}", **extra_fields)
+    try:
+        yield user
+    finally:
+        user.delete()
+
+
+def _api_keys(user, count, prefix):
+    return [
+        APIKey(user=user, name=f"Key {i}", prefix=f"{prefix}{i}", hashed_key=f"{i:064x}") for i in range(count)
+    ]
+
+
+def _write_stats(func, row_count):
+    queries = QueryCounter()
+    with connection.execute_wrapper(queries):
+        started = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - started
+    return {
+        "rows_per_second": round(row_count / seconds, 1),
+        "queries_per_row": round(queries.count / row_count, 3),
+    }
+
+
+@register("model_save")
+def model_save(rows="1000", batch_size="500"):
+    """`BaseDjangoModel.save()` row by row (each row committed) against the bulk
+    paths, on `APIKey` rows of a user created for the benchmark"""
+    row_count, batch_size = int(rows), int(batch_size)
+    with _benchmark_user() as user:
+        saved, bulk_created = _api_keys(user, row_count, "s-"), _api_keys(user, row_count, "b-")
+
+        def save(api_keys, rename=True):
+            for api_key in api_keys:
+                if rename:
+                    api_key.name += "*"
+                api_key.save()
+
+        def bulk_update(api_keys):
+            now = timezone.now()
+            for api_key in api_keys:
+                api_key.name += "*"
+                api_key.update_date = now
+            APIKey.objects.bulk_update(api_keys, ["name", "update_date"], batch_size=batch_size)
+
+        paths = (
+            ("insert", "save", lambda: save(saved, rename=False)),
+            ("insert", "bulk_create", lambda: APIKey.objects.bulk_create(bulk_created, batch_size=batch_size)),
+        )
+        for operation, method, func in paths:
+            yield {"operation": operation, "method": method, "rows": row_count, **_write_stats(func, row_count)}
+
+        # loaded from the database, so `save()` knows the changed fields
+        saved = list(APIKey.objects.filter(user=user, prefix__startswith="s-"))
+        bulk_updated = list(APIKey.objects.filter(user=user, prefix__startswith="b-"))
+        paths = (
+            ("update", "save", lambda: save(saved)),
+            ("update", "save_unchanged", lambda: save(saved, rename=False)),
+            ("update", "bulk_update", lambda: bulk_update(bulk_updated)),
+            (
+                "update",
+                "queryset_update",
+                lambda: APIKey.objects.filter(user=user).update(name="Key", update_date=timezone.now()),
+            ),
+        )
+        for operation, method, func in paths:
+            yield {"operation": operation, "method": method, "rows": row_count, **_write_stats(func, row_count)}
+
+
+def _request_stats(client, url, requests):
+    """Latency of GET `url` through the test client, once warmed up"""
+    for _ in range(min(20, requests)):
+        client.get(url)
+    queries = QueryCounter()
+    latencies = []
+    statuses = set()
+    with connection.execute_wrapper(queries):
+        started = time.perf_counter()
+        for _ in range(requests):
+            request_started = time.perf_counter()
+            response = client.get(url)
+            latencies.append(time.perf_counter() - request_started)
+            statuses.add(str(response.status_code))
+        seconds = time.perf_counter() - started
+    return {
+        "status": ",".join(sorted(statuses)),
+        **latency_stats(latencies, seconds),
+        "queries_per_request": round(queries.count / requests, 2),
+    }
+
+
+@register("admin_changelist")
+def admin_changelist(rows="500", requests="200"):
+    """Latency of the `APIKey` admin changelist (plain and searched) for a logged
+    in superuser, through the test client and the full middleware stack"""
+    # a benchmark is an abusive client
+    with override_settings(ENABLE_THROTTLING=False, ALLOWED_HOSTS=["testserver"]):
+        with _benchmark_user(is_staff=True, is_superuser=True) as user:
+            APIKey.objects.bulk_create(_api_keys(user, int(rows), "a-"))
+            client = Client()
+            client.force_login(user)
+            changelist = reverse("admin:custom_auth_apikey_changelist")
+            for page, url in (("changelist", changelist), ("search", f"{changelist}?q=Key+1")):
+                yield {"page": page, "rows": int(rows), **_request_stats(client, url, int(requests))}
+            client.logout()
+
+
+class APIKeySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = APIKey
+        fields = ("id", "name", "prefix", "user", "is_active", "expires_at", "last_used", "create_date")
+
+
+class APIKeyListView(generics.ListAPIView):
+    serializer_class = APIKeySerializer
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = []
+
+    def get_queryset(self):
+        return APIKey.objects.filter(user=self.request.user).order_by("pk")
+
+
+class APIKeyValuesSerializer(ValuesSerializer):
+    class Meta:
+        model = APIKey
+        fields = APIKeySerializer.Meta.fields
+
+
+class APIKeyValuesListView(ValuesListMixin, APIKeyListView):
+    serializer_class = APIKeyValuesSerializer
+
+
+# the project has no API of its own yet, `api_list` routes these representative list views
+urlpatterns = [
+    path("api-keys/", APIKeyListView.as_view(), name="benchmark-api-keys"),
+    path("api-keys/values/", APIKeyValuesListView.as_view(), name="benchmark-api-keys-values"),
+]
+LIST_URLS = {"model": "benchmark-api-keys", "values": "benchmark-api-keys-values"}
+
+
+@register("api_list")
+def api_list(rows="10,100,1000", requests="200", serializers="model,values"):
+    """Latency of a DRF list endpoint of `APIKey` (with a `ModelSerializer`, or a
+    `ValuesSerializer`) for a logged in user, through the test client and the full
+    middleware stack"""
+    with override_settings(ENABLE_THROTTLING=False, ALLOWED_HOSTS=["testserver"], ROOT_URLCONF=__name__):
+        for row_count in int_list(rows):
+            with _benchmark_user() as user:
+                APIKey.objects.bulk_create(_api_keys(user, row_count, "l-"))
+                client = Client()
+                client.force_login(user)
+                for serializer in serializers.split(","):
+                    url = reverse(LIST_URLS[serializer])
+                    yield {"serializer": serializer, "rows": row_count, **_request_stats(client, url, int(requests))}
+                client.logout()
+
+
+def _best_seconds(func, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    return min(seconds)
+
+
+@register("serialization")
+def serialization(rows="10000", repeat="5"):
+    """Cost per row of a list payload of `APIKey`: serializing the queryset (query
+    included) with `ModelSerializer` and `ValuesSerializer`, then rendering and
+    parsing the JSON with DRF's classes and the `common.renderers` backends"""
+    row_count = int(rows)
+    repeat = int(repeat)
+    with _benchmark_user() as user:
+        APIKey.objects.bulk_create(_api_keys(user, row_count, "s-"), batch_size=1000)
+        queryset = APIKey.objects.filter(user=user).order_by("pk")
+        data = content = None
+        stages = [
+            ("serialize", "ModelSerializer", lambda: APIKeySerializer(queryset, many=True).data),
+            ("serialize", "ValuesSerializer", lambda: APIKeyValuesSerializer(queryset, many=True).data),
+            ("render", "JSONRenderer", lambda: JSONRenderer().render(data)),
+            *(
+                ("render", backend, lambda dumps=dumps: dumps(data))
+                for backend, (dumps, loads, error) in renderers.BACKENDS.items()
+            ),
+            ("parse", "JSONParser", lambda: JSONParser().parse(io.BytesIO(content))),
+            *(
+                ("parse", backend, lambda loads=loads: loads(content))
+                for backend, (dumps, loads, error) in renderers.BACKENDS.items()
+            ),
+        ]
+        for stage, implementation, func in stages:
+            seconds = _best_seconds(func, repeat)
+            yield {
+                "stage": stage,
+                "implementation": implementation,
+                "rows": row_count,
+                "total_ms": round(seconds * 1000, 1),
+                "per_row_us": round(seconds / row_count * 1_000_000, 2),
+            }
+            if data is None:
+                data = func()
+                content = JSONRenderer().render(data)
+
+
+@register("admin_search")
+def admin_search(rows="100000", terms="Key 4242,x-99999,nomatch", repeat="10"):
+    """A changelist search (count and first page) of `APIKey` with its search
+    index and with Django's `icontains` search"""
+    ensure_search_indexes()
+    plain_admin = admin.ModelAdmin(APIKey, admin.site)
+    plain_admin.search_fields = APIKeyAdmin.search_fields
+    admins = (("indexed", admin.site._registry[APIKey]), ("icontains", plain_admin))
+    with _benchmark_user() as user:
+        APIKey.objects.bulk_create(_api_keys(user, int(rows), "x-"), batch_size=1000)
+        for term in terms.split(","):
+            for search, model_admin in admins:
+
+                def run():
+                    queryset, _ = model_admin.get_search_results(None, APIKey.objects.all(), term)
+                    queryset.count()
+                    list(queryset[:100].values_list("pk"))
+
+                yield {
+                    "term": term,
+                    "search": search,
+                    "rows": int(rows),
+                    "search_ms": round(_best_seconds(run, int(repeat)) * 1000, 2),
+                }
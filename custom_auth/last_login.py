@@ -0,0 +1,49 @@
+"""
+Coalesced `last_login` writes.
+
+With `COALESCE_LAST_LOGIN` Django's `update_last_login` receiver (one UPDATE
+per login) is replaced by `record_last_login`, which buffers the timestamps
+and writes them from a background thread, as a single UPDATE per flush,
+every `LAST_LOGIN_FLUSH_INTERVAL` seconds and at exit. While the database
+is reachable the stored value is never more than that interval behind.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.signals import user_logged_in
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from common.write_behind import WriteBehindBuffer
+
+LAST_LOGIN_FLUSH_INTERVAL = getattr(settings, "LAST_LOGIN_FLUSH_INTERVAL", 30)  # seconds
+
+
+def write_last_logins(pending):
+    User = get_user_model()
+    User._default_manager.filter(pk__in=pending).update(
+        last_login=Case(
+            *[When(pk=user_id, then=Value(last_login)) for user_id, last_login in pending.items()],
+            output_field=DateTimeField(),
+        )
+    )
+
+
+last_login_writes = WriteBehindBuffer(
+    write_last_logins,
+    "last_login",
+    interval=LAST_LOGIN_FLUSH_INTERVAL,
+    # flushing early is fine, it's `interval` that bounds staleness
+    max_size=500,
+)
+
+
+def record_last_login(sender, user, **kwargs):
+    user.last_login = timezone.now()
+    last_login_writes.add(user.pk, user.last_login)
+
+
+def install():
+    """Swap `update_last_login` for `record_last_login`"""
+    if user_logged_in.disconnect(update_last_login, dispatch_uid="update_last_login"):
+        user_logged_in.connect(record_last_login, dispatch_uid="custom_auth.record_last_login")
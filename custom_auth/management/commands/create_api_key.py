@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from custom_auth.models import APIKey
+
+
+class Command(BaseCommand):
+    help = "Create an API key for a user and print it (it can't be shown again)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="User the key authenticates as")
+        parser.add_argument("-n", "--name", required=True, help="What the key is used for")
+        parser.add_argument("--days", type=int, help="Expire the key after this many days")
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User._default_manager.get_by_natural_key(options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist")
+
+        expires_at = timezone.now() + timedelta(days=options["days"]) if options["days"] else None
+        api_key, raw_key = APIKey.objects.create_key(user, options["name"], expires_at=expires_at)
+        self.stderr.write(f"Created {api_key}, send it as the X-API-Key header:")
+        self.stdout.write(raw_key)
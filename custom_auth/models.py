@@ -1,6 +1,77 @@
+import hashlib
+import secrets
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from common.base_models import BaseDjangoManager, BaseDjangoModel
+
+API_KEY_PREFIX_BYTES = 6
+API_KEY_SECRET_BYTES = 32
 
 
 # Create your models here.
 class User(AbstractUser):
     pass
+
+
+def hash_api_key(raw_key):
+    # keys are random and long, a fast hash is enough (unlike passwords)
+    return hashlib.sha256(raw_key.encode()).hexdigest()
+
+
+class APIKeyManager(BaseDjangoManager):
+    def create_key(self, user, name, expires_at=None):
+        """Create a key for `user`, returning `(api_key, raw_key)`.
+
+        Only a hash is stored, `raw_key` can't be recovered later.
+        """
+        prefix = secrets.token_urlsafe(API_KEY_PREFIX_BYTES)
+        raw_key = f"{prefix}.{secrets.token_urlsafe(API_KEY_SECRET_BYTES)}"
+        api_key = self.create(
+            user=user,
+            name=name,
+            prefix=prefix,
+            hashed_key=hash_api_key(raw_key),
+            expires_at=expires_at,
+        )
+        return api_key, raw_key
+
+
+class APIKey(BaseDjangoModel):
+    """API key of a user, sent as `X-API-Key: <prefix>.<secret>`.
+
+    `is_active` is cleared to revoke the key.
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_("User"),
+        related_name="api_keys",
+        on_delete=models.CASCADE,
+    )
+    name = models.CharField(_("Name"), max_length=100)
+    prefix = models.CharField(_("Prefix"), max_length=16, unique=True, editable=False)
+    hashed_key = models.CharField(_("Hashed key"), max_length=64, editable=False)
+    expires_at = models.DateTimeField(_("Expires at"), null=True, blank=True)
+    last_used = models.DateTimeField(_("Last used"), null=True, blank=True, editable=False)
+
+    objects = APIKeyManager()
+
+    class Meta:
+        verbose_name = _("API key")
+        verbose_name_plural = _("API keys")
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix}...)"
+
+    @property
+    def is_expired(self):
+        return self.expires_at is not None and self.expires_at <= timezone.now()
+
+    def revoke(self):
+        self.is_active = False
+        self.save(update_fields=["is_active"])
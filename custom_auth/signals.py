@@ -0,0 +1,141 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .backends import invalidate_cached_permissions, invalidate_cached_user, users_with_perm
+from .models import APIKey
+
+User = get_user_model()
+
+CHANGED_ACTIONS = ("post_add", "post_remove", "post_clear")
+
+
+def _group_member_ids(group_ids):
+    return list(User._default_manager.filter(groups__in=group_ids).values_list("pk", flat=True).distinct())
+
+
+def _changed_ids(sender, instance, action, pk_set, get_cleared_ids):
+    """Ids on the other side of an m2m change.
+
+    `post_clear` has no `pk_set`, so the ids are read on `pre_clear` and kept
+    on the instance until then.
+    """
+    attname = f"_{sender._meta.db_table}_cleared_ids"
+    if action == "pre_clear":
+        setattr(instance, attname, list(get_cleared_ids()))
+    elif action == "post_clear":
+        return instance.__dict__.pop(attname, [])
+    elif action in CHANGED_ACTIONS:
+        return pk_set or []
+    return []
+
+
+@receiver(post_save, sender=User, dispatch_uid="custom_auth.invalidate_user_on_save")
+@receiver(post_delete, sender=User, dispatch_uid="custom_auth.invalidate_user_on_delete")
+def invalidate_user(sender, instance, **kwargs):
+    # covers password changes too, `set_password` is always followed by a save
+    invalidate_cached_user(instance.pk)
+    # `is_active` and `is_superuser` decide which permissions apply
+    invalidate_cached_permissions([instance.pk])
+
+
+@receiver(user_logged_out, dispatch_uid="custom_auth.invalidate_user_on_logout")
+def invalidate_user_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_cached_user(user.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through, dispatch_uid="custom_auth.invalidate_group_membership")
+def invalidate_group_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in CHANGED_ACTIONS:
+            invalidate_cached_permissions([instance.pk], ["group"])
+        return
+
+    user_ids = _changed_ids(
+        sender,
+        instance,
+        action,
+        pk_set,
+        lambda: User._default_manager.filter(groups=instance).values_list("pk", flat=True),
+    )
+    invalidate_cached_permissions(user_ids, ["group"])
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through, dispatch_uid="custom_auth.invalidate_user_permissions")
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in CHANGED_ACTIONS:
+            invalidate_cached_permissions([instance.pk], ["user"])
+        return
+
+    user_ids = _changed_ids(
+        sender,
+        instance,
+        action,
+        pk_set,
+        lambda: User._default_manager.filter(user_permissions=instance).values_list("pk", flat=True),
+    )
+    invalidate_cached_permissions(user_ids, ["user"])
+
+
+@receiver(m2m_changed, sender=Group.permissions.through, dispatch_uid="custom_auth.invalidate_group_permissions")
+def invalidate_group_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in CHANGED_ACTIONS:
+            invalidate_cached_permissions(_group_member_ids([instance.pk]), ["group"])
+        return
+
+    if action in ("post_add", "post_remove"):
+        # pk_set holds group ids here
+        user_ids = _group_member_ids(pk_set)
+    else:
+        user_ids = _changed_ids(
+            sender,
+            instance,
+            action,
+            pk_set,
+            lambda: _group_member_ids(Group.objects.filter(permissions=instance).values("pk")),
+        )
+    invalidate_cached_permissions(user_ids, ["group"])
+
+
+@receiver(pre_delete, sender=Group, dispatch_uid="custom_auth.collect_group_members")
+def collect_group_members(sender, instance, **kwargs):
+    # the membership rows are gone (without m2m_changed) once the group is deleted
+    instance._member_ids = _group_member_ids([instance.pk])
+
+
+@receiver(post_delete, sender=Group, dispatch_uid="custom_auth.invalidate_deleted_group")
+def invalidate_deleted_group(sender, instance, **kwargs):
+    invalidate_cached_permissions(instance.__dict__.pop("_member_ids", []), ["group"])
+
+
+@receiver(pre_delete, sender=Permission, dispatch_uid="custom_auth.collect_permission_users")
+def collect_permission_users(sender, instance, **kwargs):
+    users = users_with_perm(instance, is_active=None, include_superusers=False)
+    instance._user_ids = list(users.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Permission, dispatch_uid="custom_auth.invalidate_deleted_permission")
+def invalidate_deleted_permission(sender, instance, **kwargs):
+    invalidate_cached_permissions(instance.__dict__.pop("_user_ids", []))
+
+
+@receiver(post_save, sender=Permission, dispatch_uid="custom_auth.invalidate_saved_permission")
+def invalidate_saved_permission(sender, instance, created, **kwargs):
+    # the cached sets hold "app_label.codename", stale once the codename or content type changes
+    if not created:
+        users = users_with_perm(instance, is_active=None, include_superusers=False)
+        invalidate_cached_permissions(list(users.values_list("pk", flat=True)))
+
+
+@receiver(post_save, sender=APIKey, dispatch_uid="custom_auth.invalidate_api_key_on_save")
+@receiver(post_delete, sender=APIKey, dispatch_uid="custom_auth.invalidate_api_key_on_delete")
+def invalidate_api_key(sender, instance, created=False, **kwargs):
+    if not created:
+        from .authentication import bump_generation
+
+        bump_generation()
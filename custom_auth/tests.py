@@ -1,3 +1,889 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from types import ModuleType, SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, models, transaction
+from django.db.models import Exists, OuterRef, QuerySet
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from import_export.admin import ImportExportMixin
+from import_export.formats.base_formats import CSV, JSON
+from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+import tablib
+
+from common import metrics, sessions, throttling
+from common.jobs import BackgroundJobMixin, claim_next_job, enqueue_export
+from common.management.commands.generate_admin import AdminApp
+from common.management.commands.startup_profile import time_cold_check
+from common.media import MediaUpload, serve_media
+from common.models import ImportExportJob
+from common.paginators import EstimatedCountPaginator, timed_count
+from common.renderers import FastJSONRenderer
+from common.resources import BaseModelResource, StreamingExportMixin
+from common.search import ensure_search_indexes, search_condition
+from common.serializers import ValuesSerializer
+
+from . import authentication
+from .admin import APIKeyAdmin
+from .backends import CachedModelBackend, get_user_cache_key, users_with_perm
+from .models import APIKey, User
+from .throttling import APIKeyRateThrottle
+
+METERED_CACHES = {
+    "default": {
+        "BACKEND": "common.metrics.MeteredCache",
+        "METERED_BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "METERED_ALIAS": "tests",
+        "LOCATION": "custom_auth-tests",
+    }
+}
+
+
+def cache_gets(result):
+    return metrics.collect().get(metrics.CACHE_GETS.key("", ("tests", result)), 0)
+
+
+@override_settings(CACHES=METERED_CACHES, SESSION_ENGINE="common.sessions")
+class MeteredCacheSessionTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.user = User.objects.create_superuser("admin-tests", password="secret")
+
+    def test_admin_login(self):
+        response = self.client.post(
+            reverse("admin:login"), {"username": "admin-tests", "password": "secret", "next": "/admin/"}
+        )
+        self.assertRedirects(response, "/admin/", fetch_redirect_response=False)
+        self.assertEqual(self.client.get("/admin/").status_code, 200)
+
+    def test_cache_api(self):
+        cache = caches["default"]
+        cache.set("present", 1)
+        self.assertIn("present", cache)
+        self.assertNotIn("absent", cache)
+        self.assertEqual(cache.get_or_set("absent", 2), 2)
+        self.assertEqual(cache.incr("present"), 2)
+
+    def test_reads_are_counted(self):
+        cache = caches["default"]
+        cache.set("present", 1)
+        hits, misses = cache_gets("hit"), cache_gets("miss")
+
+        cache.get("present")
+        cache.get("absent")
+        cache.get_many(["present", "absent"])
+        async_to_sync(cache.aget)("present")
+        async_to_sync(cache.aget_many)(["present", "absent"])
+        self.assertEqual(cache_gets("hit") - hits, 4)
+        self.assertEqual(cache_gets("miss") - misses, 3)
+
+    @mock.patch.object(sessions.session_writes, "interval", 60)
+    def test_session_delete(self):
+        store = sessions.SessionStore()
+        store["key"] = "value"
+        store.create()
+        sessions.session_writes.flush()
+        rows = Session.objects.filter(session_key=store.session_key)
+        self.assertTrue(rows.exists())
+
+        # the row goes at once, and a save still buffered isn't written afterwards
+        store["key"] = "other"
+        store.save()
+        store.delete()
+        self.assertFalse(rows.exists())
+        sessions.session_writes.flush()
+        self.assertFalse(rows.exists())
+        self.assertFalse(sessions.SessionStore().exists(store.session_key))
+
+    def test_cache_errors(self):
+        cache = caches["default"]
+        broken = {name: mock.DEFAULT for name in ("get", "add", "set", "delete", "has_key")}
+        rows = Session.objects.filter(session_key__isnull=False)
+        with mock.patch.multiple(cache, **broken) as methods, self.assertLogs(settings.LOGGER, "ERROR"):
+            for method in methods.values():
+                method.side_effect = ConnectionError
+            # written to the database at once, not buffered
+            store = sessions.SessionStore()
+            store["key"] = "value"
+            store.create()
+            self.assertEqual(rows.get().get_decoded(), {"key": "value"})
+            store["key"] = "other"
+            store.save()
+            self.assertEqual(rows.get().get_decoded(), {"key": "other"})
+
+            loaded = sessions.SessionStore(store.session_key)
+            self.assertEqual(loaded.load(), {"key": "other"})
+            loaded.delete()
+            self.assertFalse(rows.exists())
+
+            with mock.patch.object(sessions, "PERSIST_TO_DB", False):
+                store = sessions.SessionStore()
+                store["key"] = "value"
+                store.save()
+            self.assertFalse(rows.exists())
+
+
+class BaseDjangoModelTests(TestCase):
+    def setUp(self):
+        api_key, raw_key = APIKey.objects.create_key(User.objects.create_user("model-tests"), "tests")
+        self.api_key = APIKey.objects.get(pk=api_key.pk)
+
+    def test_unchanged_save(self):
+        with self.assertNumQueries(0):
+            self.api_key.save()
+
+    def test_changed_field_save(self):
+        self.api_key.name = "renamed"
+        with CaptureQueriesContext(connection) as queries:
+            self.api_key.save()
+        (query,) = queries.captured_queries
+        updated = re.findall(r'"(\w+)" = ', query["sql"].split(" WHERE ")[0])
+        self.assertEqual(sorted(updated), ["name", "update_date"])
+        self.assertEqual(APIKey.objects.get(pk=self.api_key.pk).name, "renamed")
+
+    def test_update_fields_save(self):
+        APIKey.objects.filter(pk=self.api_key.pk).update(update_date=timezone.now() - timedelta(days=1))
+        self.api_key.refresh_from_db()
+        previous = self.api_key.update_date
+        self.api_key.save(update_fields=["name"])
+        self.assertGreater(APIKey.objects.get(pk=self.api_key.pk).update_date, previous)
+
+    def test_pre_save_fields(self):
+        self.assertEqual(ImportExportJob.get_pre_save_fields(), ["input_file", "output_file"])
+        self.assertEqual(APIKey.get_pre_save_fields(), [])
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        job = ImportExportJob.objects.create(kind=ImportExportJob.EXPORT, model_label="custom_auth.APIKey")
+        job = ImportExportJob.objects.get(pk=job.pk)
+        with override_settings(MEDIA_ROOT=media_root.name):
+            # changes the `FieldFile` in place, the attribute stays the same object
+            job.output_file.save("keys.csv", ContentFile(b"id\n"), save=False)
+            job.save()
+        self.assertEqual(ImportExportJob.objects.get(pk=job.pk).output_file.name, job.output_file.name)
+
+
+class SearchIndexTests(TransactionTestCase):
+    def alter_name_field(self, max_length):
+        old_field = APIKey._meta.get_field("name")
+        new_field = models.CharField(old_field.verbose_name, max_length=max_length)
+        new_field.set_attributes_from_name("name")
+        new_field.model = APIKey
+        with connection.schema_editor() as editor:
+            editor.alter_field(APIKey, old_field, new_field)
+
+    def test_search_after_alter_field(self):
+        ensure_search_indexes()
+        # SQLite rebuilds the table, the search index is checked again on post_migrate
+        self.alter_name_field(200)
+        self.addCleanup(self.alter_name_field, APIKey._meta.get_field("name").max_length)
+        ensure_search_indexes()
+
+        APIKey.objects.create_key(User.objects.create_user("search-tests"), "nightly export")
+        queryset = APIKey.objects.all()
+        self.assertEqual(queryset.filter(search_condition(queryset, ["name__icontains"], "export")).count(), 1)
+
+    def test_search_after_index_dropped(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite search tables")
+        ensure_search_indexes()
+        self.addCleanup(ensure_search_indexes, rebuild=True)
+        APIKey.objects.create_key(User.objects.create_user("search-tests"), "nightly export")
+        queryset = APIKey.objects.all()
+
+        def search():
+            return queryset.filter(search_condition(queryset, ["name__icontains"], "export")).count()
+
+        self.assertEqual(search(), 1)
+        # dropped by another process, the search falls back to icontains instead of missing the new rows
+        search_table = f"{APIKey._meta.db_table}_search"
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {connection.ops.quote_name(f'{search_table}_insert')}")
+        APIKey.objects.create_key(User.objects.get(), "weekly export")
+        self.assertEqual(search(), 2)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {connection.ops.quote_name(search_table)}")
+        self.assertEqual(search(), 2)
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.owner = User.objects.create_user("owner", is_staff=True)
+        self.job = ImportExportJob.objects.create(
+            kind=ImportExportJob.EXPORT,
+            model_label="custom_auth.User",
+            output_file=default_storage.save("jobs/exports/users.csv", ContentFile(b"id\n1\n")),
+            created_by=self.owner,
+        )
+
+    def serve(self, user, path):
+        request = RequestFactory().get(f"/{path}")
+        request.user = user
+        return serve_media(request, path)
+
+    def test_job_files(self):
+        path = self.job.output_file.name
+        for user in (AnonymousUser(), User.objects.create_user("other", is_staff=True)):
+            with self.assertRaises(Http404):
+                self.serve(user, path)
+        with self.assertRaises(Http404):
+            self.serve(AnonymousUser(), f"uploads/../{path}")
+
+        response = self.serve(self.owner, path)
+        self.assertEqual(b"".join(response.streaming_content), b"id\n1\n")
+        self.assertTrue(response["Content-Disposition"].startswith("attachment"))
+        response.close()
+
+    def test_resumed_upload_offset(self):
+        upload = MediaUpload.create("data.bin", 10, self.owner.pk, resumable=True)
+        loaded = MediaUpload.load(upload.id)
+        # a chunk appended by another request between `load()` and the lock
+        with open(upload.part_path, "ab") as f:
+            f.write(b"12345")
+        self.assertFalse(loaded.open())
+        self.assertEqual(loaded.offset, 5)
+
+
+class APIKeyResource(BaseModelResource):
+    import_workers = 0
+
+    class Meta:
+        model = APIKey
+        use_bulk = True
+        batch_size = 3
+        clean_model_instances = True
+        import_id_fields = ("prefix",)
+        fields = ("prefix", "name", "hashed_key", "user", "expires_at")
+
+
+class APIKeyRowResource(APIKeyResource):
+    class Meta(APIKeyResource.Meta):
+        use_bulk = False
+
+
+class UserGroupsResource(BaseModelResource):
+    class Meta:
+        model = User
+        use_bulk = True
+        import_id_fields = ("username",)
+        fields = ("username", "groups")
+
+
+class BulkImportTests(TestCase):
+    HEADERS = ["prefix", "name", "hashed_key", "user", "expires_at"]
+
+    def setUp(self):
+        self.user = User.objects.create_user("import-tests")
+        APIKey.objects.create(user=self.user, name="old", prefix="existing", hashed_key="hash")
+
+    def dataset(self, *rows):
+        """`user` None stands for the test user"""
+        return tablib.Dataset(
+            *[[self.user.pk if value is None else value for value in row] for row in rows], headers=self.HEADERS
+        )
+
+    def import_rows(self, resource, dataset, **kwargs):
+        """The result of importing `dataset` and the keys it leaves, rolled back afterwards"""
+        with transaction.atomic():
+            result = resource.import_data(dataset, **kwargs)
+            keys = sorted(APIKey.objects.values_list("prefix", "name", "user", "expires_at"))
+            transaction.set_rollback(True)
+        summary = (
+            [row_result.import_type for row_result in result.rows],
+            dict(result.totals),
+            [(invalid_row.number, invalid_row.error_dict) for invalid_row in result.invalid_rows],
+            [[str(error.error) for error in row_result.errors] for row_result in result.rows],
+        )
+        return summary, keys
+
+    def assertSameImport(self, dataset, **kwargs):
+        bulk = self.import_rows(APIKeyResource(), dataset, **kwargs)
+        self.assertEqual(bulk, self.import_rows(APIKeyRowResource(), dataset, **kwargs))
+        return bulk
+
+    def test_same_results_as_per_row(self):
+        valid_rows = [
+            ["p1", "one", "hash", None, ""],
+            ["existing", "updated", "hash", None, "2030-01-01 00:00:00"],
+            # the same new key twice in a batch updates the first row's key
+            ["p1", "one again", "hash", None, ""],
+            ["p5", "five", "hash", None, ""],
+        ]
+        invalid_rows = [
+            ["p2", "x" * 200, "hash", None, ""],
+            ["p4", "bad date", "hash", None, "not a date"],
+        ]
+        (row_types, totals, invalid, errors), keys = self.assertSameImport(self.dataset(*valid_rows, *invalid_rows))
+        self.assertEqual(row_types, ["new", "update", "update", "new", "invalid", "invalid"])
+        self.assertEqual([number for number, error_dict in invalid], [5, 6])
+        self.assertEqual([prefix for prefix, name, user, expires_at in keys], ["existing", "p1", "p5"])
+
+        # nothing is written with rollback_on_validation_errors, or after an error (an unknown user)
+        summary, keys = self.assertSameImport(
+            self.dataset(*valid_rows, *invalid_rows), rollback_on_validation_errors=True
+        )
+        self.assertEqual(keys, [("existing", "old", self.user.pk, None)])
+        (row_types, totals, invalid, errors), keys = self.assertSameImport(
+            self.dataset(*valid_rows, ["p3", "unknown user", "hash", "999999", ""])
+        )
+        self.assertEqual(errors[-1], ["User matching query does not exist."])
+        self.assertEqual(keys, [("existing", "old", self.user.pk, None)])
+
+    def test_queries_per_batch(self):
+        def queries(batches):
+            rows = [[f"{batches}-{index}", "key", "hash", None, ""] for index in range(3 * batches - 1)]
+            with CaptureQueriesContext(connection) as captured:
+                self.import_rows(APIKeyResource(), self.dataset(["existing", "updated", "hash", None, ""], *rows))
+            return len(captured)
+
+        # the users (one IN, not one per row), the existing keys and the insert in a savepoint
+        self.assertEqual(queries(2) - queries(1), 5)
+        self.assertEqual(queries(4) - queries(2), 2 * 5)
+
+    def test_clean_rows_in_workers(self):
+        rows = [[f"p{index}", "key", "hash", None, ""] for index in range(7)]
+        dataset = self.dataset(*rows, ["p8", "", "hash", None, "not a date"])
+        resource = APIKeyResource()
+        resource.import_workers = 2
+        self.assertEqual(self.import_rows(resource, dataset), self.import_rows(APIKeyResource(), dataset))
+
+    def test_many_to_many_fields(self):
+        group = Group.objects.create(name="import-tests")
+        dataset = tablib.Dataset(["m2m-user", str(group.pk)], headers=["username", "groups"])
+        result = UserGroupsResource().import_data(dataset)
+        self.assertFalse(result.has_errors())
+        # imported one row at a time, the bulk path can't write them
+        self.assertEqual(list(User.objects.get(username="m2m-user").groups.all()), [group])
+
+
+class APIKeyExportAdmin(ImportExportMixin, APIKeyAdmin):
+    resource_class = APIKeyResource
+
+
+class APIKeyStreamingExportAdmin(StreamingExportMixin, APIKeyExportAdmin):
+    pass
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        self.superuser = User.objects.create_superuser("export-tests")
+        group = Group.objects.create(name="export-tests")
+        for index in range(7):
+            user = User.objects.create_user(f"export-{index}")
+            user.groups.add(group)
+            APIKey.objects.create(
+                user=user,
+                name=f'key "{index}", ü\n',
+                prefix=f"p{index}",
+                hashed_key="hash",
+                expires_at=timezone.now() if index % 2 else None,
+            )
+
+    def test_same_output_as_export(self):
+        for resource in (APIKeyResource(), UserGroupsResource()):
+            queryset = resource._meta.model.objects.order_by("pk")
+            for file_format in (CSV(), JSON()):
+                with self.subTest(resource=type(resource).__name__, file_format=file_format.get_title()):
+                    expected = file_format.export_data(resource.export(queryset))
+                    self.assertEqual("".join(resource.iter_export(file_format.get_title(), queryset)), expected)
+
+    def test_export_action(self):
+        def export(admin_class, file_format):
+            model_admin = admin_class(APIKey, admin.site)
+            formats = [format_class().get_title() for format_class in model_admin.get_export_formats()]
+            request = RequestFactory().post("/admin/", {"file_format": formats.index(file_format)})
+            request.user = self.superuser
+            response = model_admin.export_action(request)
+            if response.streaming:
+                return b"".join(response.streaming_content)
+            return response.content
+
+        for file_format in ("csv", "json"):
+            with self.subTest(file_format):
+                self.assertEqual(
+                    export(APIKeyStreamingExportAdmin, file_format), export(APIKeyExportAdmin, file_format)
+                )
+
+    def test_queries_per_chunk(self):
+        def queries(resource, chunk_size):
+            resource.export_chunk_size = chunk_size
+            with CaptureQueriesContext(connection) as captured:
+                list(resource.iter_export_rows(resource._meta.model.objects.all()))
+            return len(captured)
+
+        # 8 users with the superuser
+        for chunk_size, chunks in ((2, 4), (3, 3), (8, 1)):
+            with self.subTest(chunk_size):
+                # the users are selected with the keys
+                self.assertEqual(queries(APIKeyResource(), chunk_size), 1)
+                # and the groups prefetched once per chunk
+                self.assertEqual(queries(UserGroupsResource(), chunk_size), 1 + chunks)
+
+
+class APIKeyJobAdmin(BackgroundJobMixin, ImportExportMixin, APIKeyAdmin):
+    resource_class = APIKeyResource
+
+
+class JobTests(TransactionTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.superuser = User.objects.create_superuser("job-tests")
+
+    def test_claim_next_job(self):
+        first, second = (enqueue_export(APIKey, "csv") for _ in range(2))
+        claimed = []
+        racing = [True]
+        update = QuerySet.update
+
+        def racing_update(queryset, **kwargs):
+            # another worker claims a job between this one listing the pending jobs and claiming one
+            if racing:
+                racing.pop()
+                claimed.append(claim_next_job())
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", racing_update):
+            claimed.append(claim_next_job())
+        self.assertEqual(sorted(claimed), [first.pk, second.pk])
+        self.assertIsNone(claim_next_job())
+
+    def test_export_query_string(self):
+        for index, (name, is_active) in enumerate((("export 1", True), ("export 2", False), ("other", True))):
+            APIKey.objects.create(
+                user=self.superuser, name=name, prefix=f"p{index}", hashed_key="hash", is_active=is_active
+            )
+        model_admin = APIKeyJobAdmin(APIKey, admin.site)
+        formats = model_admin.get_export_formats()
+        file_format = next(index for index, file_format in enumerate(formats) if file_format().get_title() == "csv")
+        request = RequestFactory().post(
+            "/admin/custom_auth/apikey/export/?is_active__exact=1&q=export",
+            {"file_format": file_format, "in_background": "on"},
+        )
+        request.user = self.superuser
+        with mock.patch.object(model_admin, "message_user"):
+            response = model_admin.export_action(request)
+        job = ImportExportJob.objects.get()
+        self.assertEqual(response.url, reverse("admin:common_importexportjob_status", args=[job.pk]))
+        self.assertEqual(job.export_rows, {"query_string": "is_active__exact=1&q=export"})
+
+        # the worker filters the rows again with the admin's changelist
+        with mock.patch.dict(admin.site._registry, {APIKey: model_admin}):
+            call_command("run_jobs", "--once", stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportExportJob.DONE, job.error)
+        with job.output_file.open("r") as f:
+            self.assertEqual([row["name"] for row in csv.DictReader(f)], ["export 1"])
+
+    def test_status_view_permission(self):
+        job = enqueue_export(APIKey, "csv", user=self.superuser)
+        model_admin = admin.site._registry[ImportExportJob]
+
+        def status(user, query_string=""):
+            request = RequestFactory().get(f"/status/?{query_string}")
+            request.user = user
+            return model_admin.status_view(request, job.pk)
+
+        staff = User.objects.create_user("job-staff", is_staff=True)
+        with self.assertRaises(PermissionDenied):
+            status(staff)
+        self.assertEqual(status(staff, "format=json").status_code, 403)
+        response = status(self.superuser, "format=json")
+        self.assertEqual(json.loads(response.content)["status"], ImportExportJob.PENDING)
+
+
+class GeneratedAdminTests(TestCase):
+    def admin_app(self, model, **options):
+        app_config = apps.get_app_config(model._meta.app_label)
+        model_res = [re.compile(f"^{model.__name__}$")]
+        admin_app = AdminApp(app_config, model_res, no_query_db=False, count_workers=1, **options)
+        admin_app.analyze()
+        return admin_app
+
+    def generated_admin(self, model):
+        """The `ModelAdmin` `generate_admin` writes for `model`, registered on an empty registry"""
+        admin_app = self.admin_app(model)
+        namespace = {"__name__": f"{model._meta.app_label}.admin", "__package__": model._meta.app_label}
+        with mock.patch.object(admin.site, "_registry", {}):
+            exec(str(admin_app), namespace)
+            return admin.site._registry[model]
+
+    def test_changelist_queries(self):
+        superuser = User.objects.create_superuser("admin-tests")
+        for index in range(10):
+            APIKey.objects.create_key(User.objects.create_user(f"user-{index}"), f"key {index}")
+        model_admin = self.generated_admin(APIKey)
+        self.assertIn("user", model_admin.list_select_related)
+
+        # the generated admin's own URLs (import, export...) next to the site's
+        admin_urls = [path("custom_auth/apikey/", include(model_admin.urls)), *admin.site.get_urls()]
+        urlconf = ModuleType("generated_admin_urls")
+        urlconf.urlpatterns = [path("admin/", include((admin_urls, "admin")))]
+        request = RequestFactory().get("/admin/custom_auth/apikey/")
+        request.user = superuser
+        with override_settings(ROOT_URLCONF=urlconf):
+            # the `user` list filter's choices, the counts (filtered and full) and the page,
+            # which joins the users instead of reading them one row at a time
+            with self.assertNumQueries(4):
+                response = model_admin.changelist_view(request).render()
+        self.assertContains(response, "user-9")
+
+    def test_estimated_count_paginator(self):
+        for index in range(10):
+            User.objects.create_user(f"user-{index}")
+        thresholds = {"list_filter_threshold": 2, "raw_id_threshold": 3, "large_table_threshold": 4}
+        for estimated_count_threshold, paginator in ((8, EstimatedCountPaginator), (20, None)):
+            with self.subTest(estimated_count_threshold):
+                admin_app = self.admin_app(User, estimated_count_threshold=estimated_count_threshold, **thresholds)
+                # the related counts stop at the foreign key thresholds, the table's own goes further
+                self.assertEqual(admin_app.related_counts.max_count, 4)
+                (admin_model,) = admin_app
+                self.assertIs(admin_model.paginator, paginator)
+                self.assertIs(admin_model.show_full_result_count, False)
+
+
+@override_settings(USER_CACHE_TTL=60, PERMISSION_CACHE_TTL=60)
+class CachedModelBackendTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.backend = CachedModelBackend()
+        self.user = User.objects.create_user("backend-tests", password="password")
+        self.group = Group.objects.create(name="backend-tests")
+        self.user.groups.add(self.group)
+        content_type = ContentType.objects.get_for_model(APIKey)
+        self.user_perm, self.group_perm, self.other_perm = (
+            Permission.objects.create(codename=codename, name=codename, content_type=content_type)
+            for codename in ("user_perm", "group_perm", "other_perm")
+        )
+        self.user.user_permissions.add(self.user_perm)
+        self.group.permissions.add(self.group_perm)
+
+    def get_user(self, queries):
+        with self.assertNumQueries(queries):
+            return self.backend.get_user(self.user.pk)
+
+    def get_permissions(self, queries=0):
+        """The permissions of a fresh instance of the user, `queries` counting the permission queries"""
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(queries):
+            return self.backend.get_all_permissions(user)
+
+    def test_user_cache(self):
+        self.assertEqual(self.get_user(1), self.user)
+        cached = self.get_user(0)
+        self.assertEqual(cached, self.user)
+        self.assertIsNot(cached, self.get_user(0))
+
+        self.user.first_name = "changed"
+        self.user.save()
+        self.assertEqual(self.get_user(1).first_name, "changed")
+
+        # an inactive user is rejected even when it comes from the cache
+        cached.is_active = False
+        cache.set(get_user_cache_key(self.user.pk), cached)
+        self.assertIsNone(self.get_user(0))
+
+    def test_logout(self):
+        self.client.force_login(self.user, backend="custom_auth.backends.CachedModelBackend")
+        self.get_user(1)
+        self.client.logout()
+        self.assertIsNone(cache.get(get_user_cache_key(self.user.pk)))
+
+    def test_permission_cache(self):
+        perms = {"custom_auth.user_perm", "custom_auth.group_perm"}
+        self.assertEqual(self.get_permissions(2), perms)
+        self.assertEqual(self.get_permissions(), perms)
+
+        changes = [
+            (lambda: self.group.permissions.add(self.other_perm), perms | {"custom_auth.other_perm"}),
+            (lambda: self.other_perm.group_set.clear(), perms),
+            (lambda: self.user.user_permissions.remove(self.user_perm), {"custom_auth.group_perm"}),
+            (lambda: self.user_perm.user_set.add(self.user), perms),
+            (lambda: self.user.groups.clear(), {"custom_auth.user_perm"}),
+            (lambda: self.group.user_set.add(self.user), perms),
+        ]
+        for change, expected in changes:
+            change()
+            self.assertEqual(self.get_permissions(1), expected)
+            self.assertEqual(self.get_permissions(), expected)
+
+    def test_renamed_and_deleted_permission(self):
+        self.get_permissions(2)
+        self.group_perm.codename = "renamed_perm"
+        self.group_perm.save()
+        self.assertEqual(self.get_permissions(2), {"custom_auth.user_perm", "custom_auth.renamed_perm"})
+
+        self.user_perm.delete()
+        self.assertEqual(self.get_permissions(2), {"custom_auth.renamed_perm"})
+
+
+class UsersWithPermTests(TestCase):
+    def test_same_users_as_model_backend(self):
+        content_type = ContentType.objects.get_for_model(APIKey)
+        perm = Permission.objects.create(codename="tested_perm", name="tested_perm", content_type=content_type)
+        group = Group.objects.create(name="with-perm")
+        group.permissions.add(perm)
+        for is_active, prefix in ((True, "active"), (False, "inactive")):
+            direct, in_group, both, superuser, _ = (
+                User.objects.create_user(f"{prefix}-{name}", is_active=is_active)
+                for name in ("direct", "group", "both", "superuser", "none")
+            )
+            direct.user_permissions.add(perm)
+            in_group.groups.add(group)
+            both.user_permissions.add(perm)
+            both.groups.add(group)
+            superuser.is_superuser = True
+            superuser.save()
+
+        for perm_arg in ("custom_auth.tested_perm", perm):
+            for is_active in (True, False, None):
+                for include_superusers in (True, False):
+                    with self.subTest(perm=perm_arg, is_active=is_active, include_superusers=include_superusers):
+                        kwargs = {"is_active": is_active, "include_superusers": include_superusers}
+                        expected = ModelBackend().with_perm(perm_arg, **kwargs).values_list("username", flat=True)
+                        users = users_with_perm(perm_arg, **kwargs).values_list("username", flat=True)
+                        # no duplicates either, a user having the permission both ways is listed once
+                        self.assertEqual(sorted(users), sorted(expected))
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        User.objects.bulk_create(User(username=f"user-{index:03}") for index in range(200))
+
+    def paginator(self, queryset, **attributes):
+        paginator = EstimatedCountPaginator(queryset.order_by("pk"), 10)
+        for name, value in attributes.items():
+            setattr(paginator, name, value)
+        return paginator, paginator.count
+
+    def test_small_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        paginator, count = self.paginator(User.objects.all())
+        self.assertEqual((count, paginator.estimated), (200, False))
+        paginator, count = self.paginator(User.objects.all(), estimate_threshold=100)
+        self.assertEqual((count, paginator.estimated), (200, True))
+
+    def test_count_timeout(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite progress handler")
+        # compares every user with every other one, long enough to be interrupted
+        slow = User.objects.filter(Exists(User.objects.filter(first_name__contains=OuterRef("username"))))
+        self.assertIsNone(timed_count(slow, timeout=0))
+        # the progress handler is removed afterwards
+        self.assertEqual(timed_count(slow, timeout=60), 0)
+
+        for estimate, expected in ((150, 150), (None, EstimatedCountPaginator.estimate_threshold)):
+            with mock.patch("common.paginators.estimate_queryset_rows", return_value=estimate):
+                paginator, count = self.paginator(slow, count_timeout=0)
+            self.assertEqual((count, paginator.estimated), (expected, True))
+
+
+@mock.patch.object(authentication.verified_keys, "ttl", 60)
+@mock.patch.object(authentication.last_used_writes, "add")
+class APIKeyAuthenticationTests(TestCase):
+    def authenticate(self, raw_key):
+        request = RequestFactory().get("/", HTTP_X_API_KEY=raw_key)
+        return authentication.APIKeyAuthentication().authenticate(request)
+
+    def test_cached_verification(self, add_last_used):
+        user = User.objects.create_user("api-tests")
+        api_key, raw_key = APIKey.objects.create_key(user, "tests")
+        first_user, first_key = self.authenticate(raw_key)
+        second_user, second_key = self.authenticate(raw_key)
+        self.assertEqual((first_user, first_key), (user, api_key))
+        self.assertEqual((second_user, second_key), (user, api_key))
+        # the verification is cached, not the user: requests don't share an instance
+        self.assertIsNot(first_user, second_user)
+
+        user.is_active = False
+        user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(raw_key)
+
+    def test_revoked_key(self, add_last_used):
+        api_key, raw_key = APIKey.objects.create_key(User.objects.create_user("api-tests"), "tests")
+        self.authenticate(raw_key)
+        self.authenticate(raw_key)
+        api_key.revoke()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(raw_key)
+
+    @mock.patch.object(authentication.verified_keys, "ttl", 0)
+    def test_without_cache(self, add_last_used):
+        api_key, raw_key = APIKey.objects.create_key(User.objects.create_user("api-tests"), "tests")
+        for _ in range(2):
+            # the key with its user, on every request
+            with self.assertNumQueries(1):
+                self.assertEqual(self.authenticate(raw_key)[1], api_key)
+        api_key.revoke()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(raw_key)
+
+
+class ThrottlingTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 60 * 1000.0  # the start of a window
+        self.enterContext(mock.patch.object(throttling, "_store", throttling.LocalStore()))
+        self.enterContext(mock.patch.object(throttling, "time", SimpleNamespace(time=lambda: self.now)))
+
+    def assertRetryAfter(self, key, limit, window):
+        """Once denied, `key` stays denied until the `retry_after` of the denial, and is allowed right after"""
+        result = throttling.hit(key, limit, window)
+        while result.allowed:
+            result = throttling.hit(key, limit, window)
+        denied_at = self.now
+        self.now = denied_at + result.retry_after - 0.01
+        self.assertFalse(throttling.hit(key, limit, window).allowed)
+        self.now = denied_at + result.retry_after + 0.01
+        self.assertTrue(throttling.hit(key, limit, window).allowed)
+
+    def test_sliding_window(self):
+        self.assertEqual([throttling.hit("key", 3, 60).count for _ in range(3)], [1, 2, 3])
+        self.assertFalse(throttling.hit("key", 3, 60).allowed)
+        # nothing frees up before the next window
+        self.assertRetryAfter("key", 3, 60)
+        # then the previous window's share shrinks as the window slides
+        self.assertRetryAfter("key", 3, 60)
+        self.now += 30
+        self.assertRetryAfter("key", 3, 60)
+        # both windows over
+        self.now += 120
+        self.assertEqual(throttling.hit("key", 3, 60).count, 1)
+
+    def test_drf_throttles(self):
+        factory = APIRequestFactory()
+
+        def anonymous():
+            return factory.get("/")
+
+        def with_api_key():
+            request = factory.get("/")
+            force_authenticate(request, user=User(pk=1), token=APIKey(pk=1))
+            return request
+
+        cases = [
+            (throttling.AnonRateThrottle, anonymous, True),
+            (throttling.AnonRateThrottle, with_api_key, False),
+            (throttling.UserRateThrottle, anonymous, True),
+            (throttling.UserRateThrottle, with_api_key, True),
+            (throttling.IPRateThrottle, with_api_key, True),
+            (APIKeyRateThrottle, anonymous, False),
+            (APIKeyRateThrottle, with_api_key, True),
+        ]
+        for throttle_class, make_request, throttled in cases:
+            with self.subTest(throttle=throttle_class.__name__, request=make_request.__name__):
+                throttle = type("Throttle", (throttle_class,), {"rate": "2/min"})
+                view = APIView.as_view(throttle_classes=[throttle], permission_classes=[])
+                with mock.patch.object(throttling, "_store", throttling.LocalStore()):
+                    responses = [view(make_request()) for _ in range(3)]
+                # APIView has no handler, a request let through gets a 405
+                statuses = [response.status_code for response in responses]
+                self.assertEqual(statuses, [405, 405, 429 if throttled else 405])
+                if throttled:
+                    self.assertEqual(responses[-1]["Retry-After"], "60")
+
+    @override_settings(THROTTLE_RATE="2/min", THROTTLE_EXEMPT_PATHS=["/static/"])
+    def test_middleware(self):
+        middleware = throttling.ThrottleMiddleware(lambda request: HttpResponse())
+
+        def get(path="/", ip="127.0.0.1"):
+            return middleware(RequestFactory().get(path, REMOTE_ADDR=ip))
+
+        self.assertEqual([get().status_code for _ in range(2)], [200, 200])
+        response = get()
+        self.assertEqual((response.status_code, response["Retry-After"]), (429, "60"))
+        self.assertEqual(get(ip="10.0.0.1").status_code, 200)
+        self.assertEqual(get("/static/app.css").status_code, 200)
+        self.now += 60.01
+        self.assertEqual(get().status_code, 200)
+
+
+def all_fields_serializer(base, model):
+    meta = type("Meta", (), {"model": model, "fields": serializers.ALL_FIELDS})
+    return type(f"{model.__name__}Serializer", (base,), {"Meta": meta})
+
+
+class ValuesSerializerTests(TestCase):
+    def test_all_fields(self):
+        APIKey.objects.create_key(User.objects.create_user("serializer-tests"), "tests")
+        queryset = APIKey.objects.all()
+        expected = all_fields_serializer(serializers.ModelSerializer, APIKey)(queryset, many=True).data
+        self.assertEqual(all_fields_serializer(ValuesSerializer, APIKey)(queryset, many=True).data, expected)
+
+        # "__all__" would include `groups` and `user_permissions`
+        with self.assertRaises(ImproperlyConfigured):
+            all_fields_serializer(ValuesSerializer, User).compiled()
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    def test_big_integers(self):
+        data = {"id": 2**64, "name": "caf\u00e9"}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class StartupTests(SimpleTestCase):
+    # imported by the optional apps only, see FAST_STARTUP_COMMANDS
+    OPTIONAL_MODULES = ("django.contrib.admin", "import_export", "rest_framework", "debug_toolbar", "corsheaders")
+
+    def loaded_modules(self, command, modules):
+        """Which of `modules` a fresh `manage.py <command>` has imported once Django is set up"""
+        script = (
+            "import json, sys\n"
+            f"sys.argv = ['manage.py', {command!r}]\n"
+            "import django\n"
+            "django.setup(set_prefix=False)\n"
+            f"print(json.dumps([name for name in {list(modules)!r} if name in sys.modules]))\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+            env={**os.environ, "FAST_STARTUP": "True"},
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def test_cold_check_budget(self):
+        timings = time_cold_check(settings.STARTUP_BUDGET_RUNS)
+        runs = ", ".join(f"{seconds:.2f}s" for seconds in timings)
+        self.assertLessEqual(statistics.median(timings), settings.STARTUP_BUDGET, f"cold `manage.py check`: {runs}")
+
+    def test_fast_startup_commands(self):
+        for command in settings.FAST_STARTUP_COMMANDS:
+            with self.subTest(command):
+                self.assertEqual(self.loaded_modules(command, (*self.OPTIONAL_MODULES, "termcolor")), [])
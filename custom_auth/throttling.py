@@ -0,0 +1,14 @@
+from common.throttling import SlidingWindowRateThrottle
+
+from .models import APIKey
+
+
+class APIKeyRateThrottle(SlidingWindowRateThrottle):
+    """Requests authenticated with an API key, by key"""
+
+    scope = "api_key"
+
+    def get_cache_key(self, request, view):
+        if not isinstance(request.auth, APIKey):
+            return None
+        return self.cache_format % {"scope": self.scope, "ident": request.auth.pk}
@@ -0,0 +1,99 @@
+"""
+gunicorn settings, picked up when gunicorn is started from this directory:
+
+    gunicorn base_django_app.wsgi
+
+Every value can be overridden from the environment (or `.env`), see the
+`GUNICORN_*` names below. With `preload_app` the master imports Django and
+warms it up once, workers share that memory copy-on-write and only open
+their own connections after the fork.
+
+Compare boot time and per worker memory with and without preloading with
+`python manage.py benchmark gunicorn_boot`.
+"""
+import os
+import time
+
+# imported under another name, gunicorn would take `config` for its own setting
+from decouple import config as env
+
+from common.benchmarking import process_memory_kb
+
+BOOT_STARTED = time.perf_counter()
+
+
+def cpu_count():
+    # the CPUs this process may run on, which can be less than the machine's in a container
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = env("GUNICORN_BIND", default="0.0.0.0:8000")
+threads = env("GUNICORN_THREADS", cast=int, default=1)
+# with threads, fewer processes handle the same concurrency
+workers = env("GUNICORN_WORKERS", cast=int, default=cpu_count() * 2 + 1 if threads == 1 else cpu_count() + 1)
+worker_class = env("GUNICORN_WORKER_CLASS", default="gthread" if threads > 1 else "sync")
+preload_app = env("GUNICORN_PRELOAD", cast=bool, default=True)
+# recycle workers to contain slow leaks, jittered so they don't restart together
+max_requests = env("GUNICORN_MAX_REQUESTS", cast=int, default=2000)
+max_requests_jitter = env("GUNICORN_MAX_REQUESTS_JITTER", cast=int, default=max_requests // 10)
+timeout = env("GUNICORN_TIMEOUT", cast=int, default=30)
+graceful_timeout = env("GUNICORN_GRACEFUL_TIMEOUT", cast=int, default=30)
+keepalive = env("GUNICORN_KEEPALIVE", cast=int, default=5)
+accesslog = env("GUNICORN_ACCESS_LOG", default=None)
+# heartbeat files in memory rather than on a possibly slow /tmp
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def on_starting(server):
+    # before the app is loaded, so the settings module isn't set yet
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "base_django_app.settings")
+    from django.conf import settings
+
+    if settings.ENABLE_METRICS:
+        from common.metrics import clear_directory
+
+        # the counters start over with the master, like the processes do
+        clear_directory()
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from common.warmup import close_connections, warm_up_code
+
+        warm_up_code()
+        # nothing the workers could inherit
+        close_connections()
+
+    rss, pss = process_memory_kb()
+    server.log.info(
+        f"Ready in {time.perf_counter() - BOOT_STARTED:.2f}s "
+        f"(preload_app={server.cfg.preload_app}, master RSS {rss} kB, PSS {pss} kB)"
+    )
+
+
+def post_fork(server, worker):
+    worker.fork_started = time.perf_counter()
+
+
+def post_worker_init(worker):
+    # runs in the worker once the app is loaded, before it accepts connections
+    from common.warmup import close_connections, open_connections, warm_up_code
+
+    close_connections()
+    warm_up_code()
+    open_connections()
+
+    rss, pss = process_memory_kb()
+    worker.log.info(
+        f"Worker {worker.pid} ready in {time.perf_counter() - worker.fork_started:.2f}s (RSS {rss} kB, PSS {pss} kB)"
+    )
+
+
+def worker_exit(server, worker):
+    from common.write_behind import flush_all
+
+    # don't lose the writes still buffered when a worker is recycled or stopped
+    flush_all()